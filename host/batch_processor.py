@@ -5,6 +5,7 @@ class PromptValidationError(Exception):
 from __future__ import annotations
 
 import json
+from functools import partial
 from pathlib import Path
 from typing import Optional
 import logging
@@ -16,10 +17,16 @@ from common import (
     save_log,
     fallback_user_prompt,
     append_export_result_to_log,
-    extract_export_errors
+    extract_export_errors,
+    format_progress_line,
+    run_export_job,
+    ImagePayload,
+    JsonBody,
+    hamming_distance,
 )
 from prompts import get_prompt
-from llm_api import LLMProvider
+from llm_api import LLMProvider, chat_many
+from metrics_store import record_metric
 
 def build_messages(system_prompt: str, sample: list[dict], vision_images: list, provider_type: str = "ollama"):
     """
@@ -55,17 +62,16 @@ def build_messages(system_prompt: str, sample: list[dict], vision_images: list,
         from typing import cast, Any
         if provider_type == "ollama":
             # 'images' deve ser lista de strings (API Ollama)
-            images_list = [item.b64] if isinstance(item.b64, str) else (item.b64 if isinstance(item.b64, list) else [])
             messages.append({
                 "role": "user",
                 "content": description,
-                "images": cast(Any, images_list)
+                "images": cast(Any, [ImagePayload(item)])
             })
         else:
             # OpenAI / LM Studio espera 'content' como lista de objetos
             content_list = [
                 {"type": "text", "text": description},
-                {"type": "image_url", "image_url": {"url": item.data_url}}
+                {"type": "image_url", "image_url": {"url": ImagePayload(item, data_url=True)}}
             ]
             messages.append({
                 "role": "user",
@@ -98,6 +104,159 @@ def extract_json_from_markdown(text: str) -> str:
 
 
 
+def estimate_image_payload_bytes(item) -> int:
+    """Tamanho aproximado de uma imagem serializada na mensagem (base64 + descrição)."""
+    return item.b64_size + len(str(item.path)) + 256
+
+
+def estimate_messages_bytes(system_prompt: str, sample: list[dict], vision_images: list, provider_type: str) -> int:
+    """Tamanho do JSON de build_messages, calculado sem codificar as imagens em base64."""
+    return len(JsonBody(build_messages(system_prompt, sample, vision_images, provider_type)))
+
+
+def chunk_vision_images(vision_images: list, max_bytes: int) -> list[list]:
+    """
+    Divide as imagens em sub-lotes cujo payload estimado não passa de max_bytes.
+    Sempre retorna ao menos um lote (vazio no modo texto); uma imagem maior que o
+    limite sozinha vai em um lote próprio.
+    """
+    if not vision_images:
+        return [[]]
+
+    chunks: list[list] = []
+    current: list = []
+    current_bytes = 0
+    for item in vision_images:
+        size = estimate_image_payload_bytes(item)
+        if current and current_bytes + size > max_bytes:
+            chunks.append(current)
+            current, current_bytes = [], 0
+        if size > max_bytes:
+            logging.warning(f"Imagem {item.path} ({size / (1024 * 1024):.1f} MB) excede sozinha o limite de payload")
+        current.append(item)
+        current_bytes += size
+    chunks.append(current)
+    return chunks
+
+
+def group_near_duplicates(vision_images: list, threshold: int, pick_sharpest: bool = False) -> list[tuple]:
+    """
+    Agrupa quadros consecutivos (rajadas) cujo dHash difere do primeiro quadro do
+    grupo em até ``threshold`` bits. Retorna [(representante, [demais quadros])];
+    o representante é o primeiro quadro ou, com ``pick_sharpest``, o mais nítido.
+    Imagens sem hash ficam sozinhas.
+    """
+    groups: list[list] = []
+    for item in vision_images:
+        anchor = groups[-1][0] if groups else None
+        if (
+            anchor is not None
+            and item.dhash is not None
+            and anchor.dhash is not None
+            and hamming_distance(anchor.dhash, item.dhash) <= threshold
+        ):
+            groups[-1].append(item)
+        else:
+            groups.append([item])
+
+    result = []
+    for group in groups:
+        rep = max(group, key=lambda item: item.sharpness) if pick_sharpest else group[0]
+        result.append((rep, [item for item in group if item is not rep]))
+    return result
+
+
+def expand_plan_to_groups(plan: dict, duplicates: dict) -> dict:
+    """
+    Replica a decisão do modelo sobre cada representante para os quadros do seu
+    grupo: entradas com ``id`` (edits) são copiadas, listas ``ids`` (tags) e
+    listas de ids (export) ganham os membros. ``duplicates``: {id_rep: [ids]}.
+    """
+    members_of = {str(rep_id): members for rep_id, members in duplicates.items() if members}
+    if not members_of:
+        return plan
+
+    def expand_ids(ids: list) -> list:
+        # compara como string: o modelo pode devolver "12" para o id 12
+        out = list(ids)
+        present = {str(i) for i in ids}
+        for img_id in ids:
+            for member in members_of.get(str(img_id), []):
+                if str(member) not in present:
+                    present.add(str(member))
+                    out.append(member)
+        return out
+
+    expanded = {}
+    for key, value in plan.items():
+        if not isinstance(value, list):
+            expanded[key] = value
+            continue
+        items = []
+        for entry in value:
+            if isinstance(entry, dict) and isinstance(entry.get("ids"), list):
+                entry = {**entry, "ids": expand_ids(entry["ids"])}
+            items.append(entry)
+            if isinstance(entry, dict) and "id" in entry:
+                items.extend({**entry, "id": m} for m in members_of.get(str(entry["id"]), []))
+        if all(isinstance(v, (int, str)) for v in items):
+            items = expand_ids(items)
+        expanded[key] = items
+    return expanded
+
+def merge_plan_answers(answers: list[str]) -> tuple[Optional[dict], list[int]]:
+    """
+    Funde os planos JSON de vários sub-lotes em um só.
+
+    Listas são concatenadas (ids escalares sem duplicatas); entradas de ``tags``
+    com o mesmo nome têm os ids unidos. Valores escalares ficam com o primeiro
+    lote. Retorna (plano ou None se nenhum lote for JSON válido, lotes com falha).
+    """
+    merged: Optional[dict] = None
+    failed: list[int] = []
+    for idx, answer in enumerate(answers, 1):
+        try:
+            parsed = json.loads(extract_json_from_markdown(answer or ""))
+        except (json.JSONDecodeError, TypeError):
+            failed.append(idx)
+            continue
+        if not isinstance(parsed, dict):
+            failed.append(idx)
+            continue
+        if merged is None:
+            merged = {}
+        for key, value in parsed.items():
+            if key not in merged:
+                merged[key] = list(value) if isinstance(value, list) else value
+            elif isinstance(value, list) and isinstance(merged[key], list):
+                merged[key].extend(value)
+
+    if merged:
+        for key, value in merged.items():
+            if not isinstance(value, list):
+                continue
+            if key == "tags":
+                merged[key] = _merge_tag_entries(value)
+            elif all(isinstance(v, (int, str)) for v in value):
+                merged[key] = list(dict.fromkeys(value))
+    return merged, failed
+
+
+def _merge_tag_entries(entries: list) -> list:
+    by_tag: dict = {}
+    others = []
+    for entry in entries:
+        if not isinstance(entry, dict) or not entry.get("tag"):
+            others.append(entry)
+            continue
+        target = by_tag.setdefault(entry["tag"], {**entry, "ids": []})
+        for img_id in entry.get("ids", []):
+            if img_id not in target["ids"]:
+                target["ids"].append(img_id)
+    return list(by_tag.values()) + others
+
+
+
 class BatchProcessor:
     def __init__(self, client, provider: LLMProvider, dry_run: bool = False):
         self.client = client
@@ -119,7 +278,8 @@ class BatchProcessor:
         config_dict = {k: v for k, v in vars(args).items() if k not in ["func", "prompt_file"]}
         logging.info(f"[{mode}] Configuração ativa: {config_dict}")
         
-        images = fetch_images(self.client, args)
+        # Só a página que será processada é transferida pelo MCP
+        images = fetch_images(self.client, args, limit=args.limit)
         logging.info(f"[{mode}] Imagens filtradas: {len(images)}")
         if not images:
             return None, None, [], [], {}, 0.0
@@ -136,12 +296,15 @@ class BatchProcessor:
                 "error": str(e),
             })
             raise PromptValidationError(f"Falha ao carregar prompt: {e}") from e
+        dedupe_threshold = getattr(args, "dedupe_threshold", 0) or 0
         # progress_callback não definido, definir como None por padrão
         vision_images, vision_errors = prepare_vision_payloads_async(
             sample,
             attach_images=not args.text_only,
             progress_callback=None,
-            max_workers=4
+            max_workers=getattr(args, "prep_workers", None),
+            backend=getattr(args, "prep_backend", None) or "thread",
+            fingerprint=dedupe_threshold > 0,
         )
         
         if not vision_images and images and not args.text_only:
@@ -156,44 +319,122 @@ class BatchProcessor:
         if vision_errors:
             logging.warning(f"[{mode}] Erros de imagem: {vision_errors}")
 
-        messages = build_messages(system_prompt, sample, vision_images, self.provider_type)
-        
-        # Calculate approximate payload size and guard upper bound
-        import json as json_module
-        payload_size_mb = len(json_module.dumps(messages)) / (1024 * 1024)
+        # Rajadas: só um quadro por grupo de quase-duplicatas vai ao modelo
+        prepared = vision_images
+        duplicates = {}
+        if dedupe_threshold > 0 and len(vision_images) > 1:
+            groups = group_near_duplicates(
+                vision_images, dedupe_threshold, pick_sharpest=getattr(args, "dedupe_best", False)
+            )
+            vision_images = [rep for rep, _ in groups]
+            duplicates = {
+                rep.meta.get("id"): [m.meta.get("id") for m in members]
+                for rep, members in groups if members
+            }
+            if duplicates:
+                logging.info({
+                    "event": "near_duplicates_collapsed",
+                    "mode": mode,
+                    "images": len(prepared),
+                    "sent": len(vision_images),
+                    "groups": len(duplicates),
+                    "threshold": dedupe_threshold,
+                })
+
+        # Calculate approximate payload size and split into bounded chunks
         max_payload_mb = getattr(args, "max_payload_mb", 12.0) or 12.0
-        if payload_size_mb > max_payload_mb and vision_images:
-            logging.warning(
+        max_inflight = max(1, getattr(args, "max_inflight", 1) or 1)
+        chunks = chunk_vision_images(
+            vision_images, int(max_payload_mb * 1024 * 1024) - len(system_prompt.encode("utf-8"))
+        )
+
+        # As mensagens (com o base64) só são montadas na hora do envio de cada lote
+        requests_to_send = []
+        payload_size_mb = 0.0
+        for chunk in chunks:
+            chunk_sample = [item.meta for item in chunk] if chunk else sample
+            payload_size_mb += estimate_messages_bytes(
+                system_prompt, chunk_sample, chunk, self.provider_type
+            ) / (1024 * 1024)
+            requests_to_send.append((chunk, partial(
+                build_messages, system_prompt, chunk_sample, chunk, self.provider_type
+            )))
+
+        if len(chunks) > 1:
+            logging.info(
                 {
-                    "event": "payload_too_large",
+                    "event": "payload_chunked",
                     "mode": mode,
-                    "payload_mb": round(payload_size_mb, 2),
+                    "chunks": len(chunks),
                     "max_mb": max_payload_mb,
                     "images": len(vision_images),
+                    "max_inflight": max_inflight,
                 }
             )
-            # Fallback: desabilita envio de imagens para evitar OOM/timeout
-            vision_images = []
-            messages = build_messages(system_prompt, sample, vision_images, self.provider_type)
-            payload_size_mb = len(json_module.dumps(messages)) / (1024 * 1024)
-            logging.info(f"[{mode}] Reenviando como texto-only. Novo payload: {payload_size_mb:.1f} MB")
 
         logging.info(
-            f"[{mode}] Enviando {len(vision_images)} imagem(ns) ao LLM ({self.provider.model}, payload: {payload_size_mb:.1f} MB)..."
+            f"[{mode}] Enviando {len(vision_images)} imagem(ns) ao LLM ({self.provider.model}, "
+            f"payload: {payload_size_mb:.1f} MB em {len(chunks)} requisição(ões))..."
         )
         logging.debug(f"[{mode}] Prompt System: {system_prompt[:100]}...")
         
-        answer, meta = self.provider.chat(messages)
+        if len(requests_to_send) == 1:
+            answer, meta = self.provider.chat(requests_to_send[0][1]())
+        else:
+            answer, meta = self._chat_chunks(mode, requests_to_send, max_inflight)
         
         answer_size_kb = len(answer) / 1024 if answer else 0
         logging.info(
             f"[{mode}] Resposta recebida ({meta.get('latency_ms', 0)}ms, {answer_size_kb:.1f} KB)"
         )
 
-        log_file = save_log(mode, args.source, sample, answer, extra={"llm": meta})
+        extra = {"llm": meta}
+        if duplicates:
+            # A decisão sobre cada representante vale para o grupo inteiro
+            extra["duplicates"] = duplicates
+            try:
+                plan = json.loads(extract_json_from_markdown(answer or ""))
+            except (json.JSONDecodeError, TypeError):
+                plan = None
+            if isinstance(plan, dict):
+                answer = json.dumps(expand_plan_to_groups(plan, duplicates), ensure_ascii=False)
+
+        log_file = save_log(mode, args.source, sample, answer, extra=extra)
         logging.info(f"[{mode}] Log: {log_file}")
         
-        return answer, log_file, sample, vision_images, meta, payload_size_mb
+        return answer, log_file, sample, prepared, meta, payload_size_mb
+
+    def _chat_chunks(self, mode: str, requests_to_send: list, max_inflight: int):
+        """Envia os sub-lotes (até max_inflight simultâneos) e funde os planos JSON."""
+        import time
+
+        started = time.time()
+        total = len(requests_to_send)
+        results = chat_many(
+            self.provider, [make_messages for _, make_messages in requests_to_send], min(max_inflight, total)
+        )
+        for idx, ((chunk, _), (_, chunk_meta)) in enumerate(zip(requests_to_send, results), 1):
+            logging.info(
+                f"[{mode}] Lote {idx}/{total} respondido ({len(chunk)} imagem(ns), "
+                f"{chunk_meta.get('latency_ms', 0)}ms)"
+            )
+
+        answers = [answer for answer, _ in results]
+        merged, failed = merge_plan_answers(answers)
+        if failed:
+            logging.warning({"event": "chunk_json_error", "mode": mode, "failed_chunks": failed})
+        chunk_metas = [meta for _, meta in results]
+        meta = dict(chunk_metas[0]) if chunk_metas else {}
+        meta.update({
+            "latency_ms": int((time.time() - started) * 1000),
+            "chunks": chunk_metas,
+            "failed_chunks": failed,
+        })
+
+        if merged is None:
+            # Nenhum lote retornou JSON válido: devolve o bruto para o erro usual de parsing
+            return "\n".join(answers), meta
+        return json.dumps(merged, ensure_ascii=False), meta
 
     def run_mode_rating(self, args):
         import time
@@ -265,33 +506,8 @@ class BatchProcessor:
             )
 
     def _log_metric(self, mode, success, duration, extra=None):
-        """Loga métrica simples em logs/metrics.json."""
-        import json, time
-        from pathlib import Path
-        metrics_path = Path(__file__).parent.parent / "logs" / "metrics.json"
-        metrics_path.parent.mkdir(exist_ok=True)
-        entry = {
-            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
-            "mode": mode,
-            "success": success,
-            "duration": round(duration, 3),
-        }
-        if extra:
-            entry.update(extra)
-        try:
-            if metrics_path.exists():
-                with open(metrics_path, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-            else:
-                data = []
-        except Exception:
-            data = []
-        data.append(entry)
-        try:
-            with open(metrics_path, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            logging.warning(f"Falha ao gravar métricas: {e}")
+        """Registra a métrica no JSONL append-only (ver metrics_store.py)."""
+        record_metric(mode, success, duration, extra)
 
     def run_mode_tagging(self, args):
         # Modular: carrega prompt via utilitário, com validação YAML
@@ -366,7 +582,19 @@ class BatchProcessor:
         if self.dry_run:
             return
         params = {"target_dir": args.target_dir, "ids": ids, "format": "jpg", "overwrite": False}
-        res = self.client.call_tool("export_collection", params)
+        if getattr(args, "export_parallel", None):
+            params["max_parallel"] = args.export_parallel
+        if getattr(args, "export_batch", None):
+            params["batch_size"] = args.export_batch
+        last = None
+
+        def report(current, total, message):
+            nonlocal last
+            if (current, total) != last:
+                last = (current, total)
+                print(format_progress_line(current, total, message), flush=True)
+
+        res = run_export_job(self.client, params, progress_callback=report)
         print("[export] Resultado:", res["content"][0]["text"])
         if log_file:
             append_export_result_to_log(log_file, res)
@@ -27,29 +27,69 @@ class IMcpClient:
         return False
 from __future__ import annotations
 
+import atexit
 import base64
+import gzip
+import hashlib
 import json
 import mimetypes
 import os
+import random
 import shutil
 import select
+import socket
+import sqlite3
+import stat
+import tempfile
 import subprocess
 import time
 import io
 import logging
 import logging.handlers
+import multiprocessing
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from concurrent.futures import BrokenExecutor, Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from dataclasses import dataclass
 from pathlib import Path
 from types import SimpleNamespace
+from collections.abc import Sequence
 from typing import Iterable, List, Optional, Callable
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from raw_preview import extract_raw_preview, is_raw_file
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem lock entre processos
+    fcntl = None
+
+try:
+    import numpy as np  # opcional: hash perceptual vetorizado
+except ImportError:
+    np = None
+
+try:
+    import zstandard  # opcional: DT_MCP_RUN_LOG_COMPRESS=zstd
+except ImportError:
+    zstandard = None
 
 try:
     from PIL import Image
     HAS_PILLOW = True
+    # Orientação EXIF -> transposição equivalente
+    _ORIENTATION_TRANSPOSE = {
+        2: Image.Transpose.FLIP_LEFT_RIGHT,
+        3: Image.Transpose.ROTATE_180,
+        4: Image.Transpose.FLIP_TOP_BOTTOM,
+        5: Image.Transpose.TRANSPOSE,
+        6: Image.Transpose.ROTATE_270,
+        7: Image.Transpose.TRANSVERSE,
+        8: Image.Transpose.ROTATE_90,
+    }
 except ImportError:
     HAS_PILLOW = False
 
@@ -57,6 +97,30 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 LOG_DIR = BASE_DIR / "logs"
 PROMPT_DIR = BASE_DIR / "config" / "prompts"
 DT_SERVER_CMD = ["lua", str(BASE_DIR / "server" / "dt_mcp_server.lua")]
+THUMB_CACHE_DIR = BASE_DIR / "cache" / "thumbnails"
+THUMB_CACHE_MAX_MB = 512
+CATALOG_SNAPSHOT_PATH = BASE_DIR / "cache" / "catalog.sqlite"
+CATALOG_SYNC_PAGE = 2000
+# Corpo das requisições ao LLM: fatias de base64 (múltiplo de 3) e blocos enviados
+JSON_BODY_B64_CHUNK = 48 * 1024
+JSON_BODY_BUFFER = 64 * 1024
+# Agrupamento de quase-duplicatas: dHash de 64 bits e grade usada para a nitidez
+DHASH_SIZE = 8
+SHARPNESS_SIZE = 64
+# Diário de execuções (logs/runs-*.jsonl.gz): retenção por idade e tamanho total
+RUN_LOG_RETENTION_DAYS = 30
+RUN_LOG_MAX_MB = 200
+# Diretório privado (0700) do usuário para o socket do daemon
+RUNTIME_DIR = (
+    Path(os.environ["XDG_RUNTIME_DIR"]) / "dt-mcp"
+    if os.environ.get("XDG_RUNTIME_DIR")
+    else Path(tempfile.gettempdir()) / f"dt-mcp-{getattr(os, 'getuid', lambda: 0)()}"
+)
+# Socket do daemon MCP (servidor Lua inicializado uma vez por sessão)
+DAEMON_SOCKET_PATH = RUNTIME_DIR / "daemon.sock"
+# Jobs de export assíncrono (export_start/export_status)
+EXPORT_POLL_INTERVAL = 1.0
+PROGRESS_PREFIX = "[progress]"
 
 def setup_logging(verbose: bool = False, json_logging: bool = True):
     """Setup logging with optional JSON format for structured logs."""
@@ -114,10 +178,113 @@ def setup_logging(verbose: bool = False, json_logging: bool = True):
 
 @dataclass
 class VisionImage:
+    """
+    Imagem preparada para o modelo. Guarda só os bytes JPEG; base64 e data URL
+    são montados quando a mensagem do provider é criada.
+    """
     meta: dict
     path: Path
-    b64: str
-    data_url: str
+    data: bytes
+    mime: str = "image/jpeg"
+    # Preenchidos só quando a preparação pede fingerprint (agrupamento de rajadas)
+    dhash: Optional[int] = None
+    sharpness: float = 0.0
+
+    @property
+    def b64(self) -> str:
+        return base64.b64encode(self.data).decode("ascii")
+
+    @property
+    def data_url(self) -> str:
+        return f"data:{self.mime};base64,{self.b64}"
+
+    @property
+    def b64_size(self) -> int:
+        """Tamanho do base64 sem codificá-lo (4 caracteres a cada 3 bytes)."""
+        return 4 * ((len(self.data) + 2) // 3)
+
+
+class ImagePayload:
+    """
+    Imagem dentro das mensagens do provider: vira a string base64 (ou data URL)
+    só quando o corpo da requisição é escrito por JsonBody.
+    """
+    __slots__ = ("image", "prefix")
+
+    def __init__(self, image: VisionImage, data_url: bool = False):
+        self.image = image
+        self.prefix = f"data:{image.mime};base64," if data_url else ""
+
+    @property
+    def encoded_size(self) -> int:
+        return len(self.prefix) + self.image.b64_size
+
+    def iter_encoded(self, chunk_size: int = JSON_BODY_B64_CHUNK) -> Iterable[bytes]:
+        yield self.prefix.encode("ascii")
+        data = memoryview(self.image.data)
+        for start in range(0, len(data), chunk_size):
+            yield base64.b64encode(data[start:start + chunk_size])
+
+    def __str__(self) -> str:
+        return self.prefix + self.image.b64
+
+
+def _json_parts(value) -> Iterable:
+    """Fragmentos do JSON de ``value``: bytes já serializados ou ImagePayload."""
+    if isinstance(value, ImagePayload):
+        yield b'"'
+        yield value
+        yield b'"'
+    elif isinstance(value, dict):
+        yield b"{"
+        for idx, (key, item) in enumerate(value.items()):
+            yield (b"," if idx else b"") + json.dumps(str(key)).encode("ascii") + b":"
+            yield from _json_parts(item)
+        yield b"}"
+    elif isinstance(value, (list, tuple)):
+        yield b"["
+        for idx, item in enumerate(value):
+            if idx:
+                yield b","
+            yield from _json_parts(item)
+        yield b"]"
+    else:
+        yield json.dumps(value, allow_nan=False).encode("ascii")
+
+
+class JsonBody:
+    """
+    Corpo JSON enviado em streaming pelo requests. As imagens são codificadas em
+    base64 em fatias durante o envio, então o pico de memória fica perto de uma
+    imagem, e não do payload inteiro. ``len()`` é calculado sem codificar nada
+    (vira o Content-Length; servidores sem suporte a upload chunked também aceitam).
+    Pode ser iterado de novo a cada retry.
+    """
+
+    def __init__(self, payload, buffer_size: int = JSON_BODY_BUFFER):
+        self.payload = payload
+        self.buffer_size = buffer_size
+        self._length: Optional[int] = None
+
+    def __len__(self) -> int:
+        if self._length is None:
+            self._length = sum(
+                part.encoded_size if isinstance(part, ImagePayload) else len(part)
+                for part in _json_parts(self.payload)
+            )
+        return self._length
+
+    def __iter__(self):
+        buffer = bytearray()
+        for part in _json_parts(self.payload):
+            pieces = part.iter_encoded() if isinstance(part, ImagePayload) else (part,)
+            for piece in pieces:
+                buffer += piece
+                if len(buffer) >= self.buffer_size:
+                    yield bytes(buffer)
+                    buffer.clear()
+        if buffer:
+            yield bytes(buffer)
 
 
 class McpClient:
@@ -131,15 +298,23 @@ class McpClient:
         env: Optional[dict] = None,
         response_timeout: float = 30.0,
         appimage_path: Optional[str] = None,
+        socket_path: Optional[str] = None,
     ):
         self.command = command
+        # Com socket_path, conecta ao daemon (mcp_daemon.py) em vez de iniciar o Lua
+        self.socket_path = socket_path
+        self._sock: Optional[socket.socket] = None
+        self._tx = None
         # Se command for AppImage, ajustamos env automaticamente
     class PromptValidationError(Exception):
         """Erro de domínio para falhas de validação de prompt."""
         pass
         self._appimage_proc: Optional[subprocess.Popen] = None
         self._appimage_mount: Optional[str] = None
-        self._setup_appimage_env(env, appimage_path)
+        if socket_path:
+            self.env = env
+        else:
+            self._setup_appimage_env(env, appimage_path)
         
         self.protocol_version = protocol_version
         self.client_info = client_info
@@ -153,6 +328,11 @@ class McpClient:
         self.log_file = log_file
         self.response_timeout = response_timeout
         self._next_req_id = 1
+        # Respostas chegam por uma thread leitora e são entregues por id
+        self._pending: dict[str, Future] = {}
+        self._pending_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._reader: Optional[threading.Thread] = None
         
     def _setup_appimage_env(self, env: Optional[dict], appimage_path: Optional[str] = None):
         """Se o comando for um AppImage ou appimage_path for fornecido, monta e configura LD_LIBRARY_PATH."""
@@ -277,10 +457,12 @@ class McpClient:
             self._appimage_proc = None
 
     def _next_id(self) -> str:
-        self.msg_id += 1
-        return str(self.msg_id)
+        with self._pending_lock:
+            self.msg_id += 1
+            return str(self.msg_id)
 
-    def request(self, method: str, params: Optional[dict] = None):
+    def request_async(self, method: str, params: Optional[dict] = None) -> Future:
+        """Envia a requisição sem esperar; o Future recebe o ``result`` (ou o erro)."""
         req_id = self._next_id()
         req = {
             "jsonrpc": "2.0",
@@ -290,42 +472,93 @@ class McpClient:
         }
         line = json.dumps(req)
         logging.debug(f"MCP TX: {line}")
-        
-        assert self.proc.stdin is not None
-        self.proc.stdin.write(line + "\n")
-        self.proc.stdin.flush()
 
-        assert self.proc.stdout is not None
-        ready, _, _ = select.select([self.proc.stdout], [], [], self.response_timeout)
-        if not ready:
+        # Transporte antes do registro: um erro aqui não deixa Future órfão em _pending
+        tx = self._tx
+        if tx is None:
+            raise RuntimeError("Cliente MCP não iniciado (chame start())")
+        future: Future = Future()
+        with self._pending_lock:
+            self._pending[req_id] = future
+        try:
+            with self._write_lock:
+                tx.write(line + "\n")
+                tx.flush()
+        except (BrokenPipeError, OSError, ValueError) as exc:
+            with self._pending_lock:
+                self._pending.pop(req_id, None)
+            raise RuntimeError(f"Falha ao enviar requisição ao servidor MCP: {exc}") from exc
+        return future
+
+    def request(self, method: str, params: Optional[dict] = None):
+        future = self.request_async(method, params)
+        try:
+            return future.result(timeout=self.response_timeout)
+        except FutureTimeoutError:
+            with self._pending_lock:
+                self._pending = {k: f for k, f in self._pending.items() if f is not future}
             stderr_output = self._drain_stderr()
             extra = f" | stderr: {stderr_output}" if stderr_output else ""
             logging.error(f"MCP Timeout: {extra}")
             raise TimeoutError(
                 f"Servidor MCP não respondeu em {self.response_timeout}s (timeout){extra}"
-            )
+            ) from None
 
-        resp_line = self.proc.stdout.readline()
-        if not resp_line:
-            stderr_output = self._drain_stderr()
-            extra = f" | stderr: {stderr_output}" if stderr_output else ""
-            logging.error(f"MCP Empty Response: {extra}")
-            raise RuntimeError(f"Servidor MCP não respondeu (stdout vazio){extra}")
-            
-        logging.debug(f"MCP RX: {resp_line.strip()}")
-        resp = json.loads(resp_line)
-        if "error" in resp:
-            raise RuntimeError(resp["error"])
-        return resp["result"]
-
-    def _drain_stderr(self) -> str:
-        assert self.proc.stderr is not None
+    def _read_loop(self, rx, proc: Optional[subprocess.Popen] = None) -> None:
+        """Lê as respostas do servidor e resolve os Futures pendentes pelo id."""
+        try:
+            for resp_line in rx:
+                resp_line = resp_line.strip()
+                if not resp_line:
+                    continue
+                logging.debug(f"MCP RX: {resp_line}")
+                try:
+                    resp = json.loads(resp_line)
+                except json.JSONDecodeError:
+                    logging.warning(f"MCP RX inválido (ignorado): {resp_line[:200]}")
+                    continue
+                resp_id = resp.get("id")
+                with self._pending_lock:
+                    future = self._pending.pop(str(resp_id), None) if resp_id is not None else None
+                if future is None:
+                    # Notificações ou respostas de requisições que já expiraram
+                    continue
+                if "error" in resp:
+                    future.set_exception(RuntimeError(resp["error"]))
+                else:
+                    future.set_result(resp.get("result"))
+        except (OSError, ValueError):
+            # stdout fechado por close()
+            pass
+        self._fail_pending(proc)
+
+    def _fail_pending(self, proc: Optional[subprocess.Popen]) -> None:
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        stderr_output = self._drain_stderr(proc) if proc is not None else ""
+        extra = f" | stderr: {stderr_output}" if stderr_output else ""
+        logging.error(f"MCP Empty Response: {extra}")
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(RuntimeError(f"Servidor MCP não respondeu (stdout vazio){extra}"))
+
+    def _drain_stderr(self, proc: Optional[subprocess.Popen] = None) -> str:
+        proc = proc or self.proc
+        if proc is None and self._sock is not None:
+            return ""
+        if proc is None or proc.stderr is None or proc.stderr.closed:
+            return ""
         lines = []
         while True:
-            ready, _, _ = select.select([self.proc.stderr], [], [], 0)
+            try:
+                ready, _, _ = select.select([proc.stderr], [], [], 0)
+            except (OSError, ValueError):
+                break
             if not ready:
                 break
-            line = self.proc.stderr.readline()
+            line = proc.stderr.readline()
             if not line:
                 break
             lines.append(line.strip())
@@ -336,8 +569,22 @@ class McpClient:
         return content
 
     def start(self):
-        """Inicia o subprocesso do servidor MCP."""
-        if self.proc:
+        """Inicia o subprocesso do servidor MCP (ou conecta ao daemon)."""
+        if self.proc or self._sock:
+            return
+
+        if self.socket_path:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                self._sock.connect(str(self.socket_path))
+            except OSError:
+                self._sock.close()
+                self._sock = None
+                raise
+            self._tx = self._sock.makefile("w", encoding="utf-8", newline="\n")
+            rx = self._sock.makefile("r", encoding="utf-8", newline="\n")
+            self._reader = threading.Thread(target=self._read_loop, args=(rx,), name="mcp-reader", daemon=True)
+            self._reader.start()
             return
 
         self.proc = subprocess.Popen(
@@ -348,6 +595,11 @@ class McpClient:
             text=True,
             env=self.env
         )
+        self._tx = self.proc.stdin
+        self._reader = threading.Thread(
+            target=self._read_loop, args=(self.proc.stdout, self.proc), name="mcp-reader", daemon=True
+        )
+        self._reader.start()
 
     def __enter__(self):
         self.start()
@@ -373,7 +625,31 @@ class McpClient:
         params = {"name": name, "arguments": arguments or {}}
         return self.request("tools/call", params)
 
+    def call_tool_async(self, name: str, arguments: Optional[dict] = None) -> Future:
+        """Como ``call_tool``, mas retorna um Future; várias chamadas podem ficar em voo."""
+        params = {"name": name, "arguments": arguments or {}}
+        return self.request_async("tools/call", params)
+
     def close(self):
+        if self._sock is not None:
+            # Só desconecta: o daemon continua vivo para os próximos clientes
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            if self._reader is not None:
+                self._reader.join(timeout=2)
+                self._reader = None
+            self._fail_pending(None)
+            for stream in (self._tx, self._sock):
+                try:
+                    stream.close()
+                except Exception:
+                    pass
+            self._sock = None
+            self._tx = None
+            return
+
         if not self.proc:
             return
 
@@ -395,6 +671,11 @@ class McpClient:
                 except Exception:
                     pass
 
+        if self._reader is not None:
+            self._reader.join(timeout=2)
+            self._reader = None
+        self._fail_pending(self.proc)
+
         for stream in (self.proc.stdin, self.proc.stdout, self.proc.stderr):
             try:
                 if stream:
@@ -403,12 +684,90 @@ class McpClient:
                 pass
         
         self.proc = None
+        self._tx = None
+
+
+def ensure_private_dir(path: Path) -> Path:
+    """Cria ``path`` com modo 0700 e recusa diretórios de outro usuário ou abertos a outros."""
+    path.mkdir(mode=0o700, parents=True, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        raise RuntimeError(f"{path} não é um diretório")
+    if hasattr(os, "getuid") and (st.st_uid != os.getuid() or st.st_mode & 0o077):
+        raise RuntimeError(f"{path} precisa pertencer ao usuário atual com permissão 0700")
+    return path
+
+
+def _owned_socket(path: Path) -> bool:
+    """Só conecta a sockets do próprio usuário (lstat: links simbólicos não passam)."""
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    if not stat.S_ISSOCK(st.st_mode):
+        logging.warning(f"[daemon] {path} não é um socket; ignorando")
+        return False
+    if hasattr(os, "getuid") and st.st_uid != os.getuid():
+        logging.warning(f"[daemon] {path} pertence a outro usuário; ignorando")
+        return False
+    return True
+
+
+def find_running_daemon(path: Optional[Path] = None) -> Optional[str]:
+    """Retorna o caminho do socket se houver um daemon MCP aceitando conexões.
+
+    O caminho vem de ``path``, da variável DT_MCP_SOCKET ou de DAEMON_SOCKET_PATH,
+    e só é usado se for um socket do usuário atual.
+    DT_MCP_DAEMON=0 desativa a detecção.
+    """
+    if os.environ.get("DT_MCP_DAEMON", "1") == "0" or not hasattr(socket, "AF_UNIX"):
+        return None
+    candidate = Path(path or os.environ.get("DT_MCP_SOCKET") or DAEMON_SOCKET_PATH)
+    if not _owned_socket(candidate):
+        return None
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.settimeout(0.5)
+        probe.connect(str(candidate))
+        return str(candidate)
+    except OSError:
+        return None
+    finally:
+        probe.close()
 
 
 def _ensure_paths() -> None:
     LOG_DIR.mkdir(parents=True, exist_ok=True)
 
 
+# Status em que o servidor está ocupado/indisponível e vale tentar de novo
+RETRYABLE_STATUS = {429, 502, 503, 504}
+HTTP_POOL_SIZE = 8
+RETRY_MAX_DELAY = 30.0
+
+
+def make_http_session(pool_size: int = HTTP_POOL_SIZE) -> requests.Session:
+    """Cria uma Session com pool de conexões keep-alive (retries ficam por nossa conta)."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def backoff_delay(attempt: int, base: float, cap: float = RETRY_MAX_DELAY) -> float:
+    """Backoff exponencial com jitter completo: uniforme em [0, min(cap, base * 2^(attempt-1))]."""
+    return random.uniform(0, min(cap, base * (2 ** (attempt - 1))))
+
+
+def _retry_after_seconds(resp) -> Optional[float]:
+    value = resp.headers.get("Retry-After") if resp.headers else None
+    try:
+        return min(RETRY_MAX_DELAY, max(0.0, float(value))) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
 def post_json_with_retries(
     url: str,
     payload: dict,
@@ -417,6 +776,8 @@ def post_json_with_retries(
     retries: int = 1,
     retry_delay: float = 1.0,
     description: str | None = None,
+    stream: bool = False,
+    session: requests.Session | None = None,
 ):
     """Faz POST JSON com retries curtos e logs de tentativa.
 
@@ -425,15 +786,23 @@ def post_json_with_retries(
     url: str
         URL alvo.
     payload: dict
-        Corpo JSON enviado.
+        Corpo JSON, serializado em streaming por ``JsonBody`` (imagens em
+        ``ImagePayload`` são codificadas em base64 durante o envio).
     timeout: float
         Timeout em segundos.
     retries: int
         Número de novas tentativas após a primeira.
     retry_delay: float
-        Intervalo entre tentativas, em segundos.
+        Base do backoff exponencial com jitter entre tentativas, em segundos.
+        Respostas 429/502/503/504 também são repetidas, respeitando Retry-After.
     description: str | None
         Texto amigável para logs. Se omitido, usa a própria URL.
+    stream: bool
+        Se True, retorna assim que os cabeçalhos chegam (corpo lido sob demanda
+        via ``iter_lines``); elapsed_ms passa a medir só até a resposta começar.
+    session: requests.Session | None
+        Session com pool keep-alive (ver ``make_http_session``). Sem ela, cada
+        chamada abre uma conexão nova via ``requests.post``.
     """
 
     desc = description or f"POST {url}"
@@ -441,11 +810,28 @@ def post_json_with_retries(
     last_error: Exception | None = None
     last_timeout_msg: str | None = None
 
+    post = session.post if session is not None else requests.post
+    body = JsonBody(payload)
+
     for attempt in range(1, attempts + 1):
         started = time.time()
         try:
-            resp = requests.post(url, json=payload, timeout=timeout)
+            resp = post(
+                url, data=body, headers={"Content-Type": "application/json"},
+                timeout=timeout, stream=stream,
+            )
             elapsed_ms = int((time.time() - started) * 1000)
+            if resp.status_code in RETRYABLE_STATUS and attempt < attempts:
+                delay = _retry_after_seconds(resp)
+                logging.warning({
+                    "event": "http_retryable_status",
+                    "desc": desc,
+                    "attempt": attempt,
+                    "status_code": resp.status_code,
+                })
+                resp.close()
+                time.sleep(delay if delay is not None else backoff_delay(attempt, retry_delay))
+                continue
             if attempt > 1:
                 logging.info({
                     "event": "http_retry_success",
@@ -477,7 +863,7 @@ def post_json_with_retries(
             })
 
         if attempt < attempts:
-            time.sleep(retry_delay)
+            time.sleep(backoff_delay(attempt, retry_delay))
 
     if last_timeout_msg:
         raise RuntimeError(last_timeout_msg)
@@ -665,48 +1051,230 @@ def load_prompt(
     return path.read_text(encoding="utf-8")
 
 
-def encode_image_to_base64(image_path: Path, max_dimension: int = 1600) -> tuple[str, str]:
+class ThumbnailCache:
+    """Cache em disco das miniaturas JPEG geradas para o LLM.
+
+    A chave é derivada de (path, tamanho, mtime, max_dimension, quality), então
+    qualquer alteração no arquivo de origem gera uma nova entrada. As entradas
+    menos usadas recentemente são removidas quando o total ultrapassa
+    ``max_bytes`` (o mtime do arquivo em cache marca o último acesso).
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int = THUMB_CACHE_MAX_MB * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes: Optional[int] = None
+
+    @staticmethod
+    def make_key(image_path: Path, max_dimension: int, quality: int) -> Optional[str]:
+        """Retorna a chave da miniatura ou None se a origem não existir."""
+        try:
+            st = image_path.stat()
+        except OSError:
+            return None
+        raw_key = f"{image_path.resolve()}|{st.st_size}|{st.st_mtime_ns}|{max_dimension}|{quality}"
+        return hashlib.sha256(raw_key.encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.jpg"
+
+    def get(self, key: str) -> Optional[bytes]:
+        entry = self._entry_path(key)
+        try:
+            data = entry.read_bytes()
+        except OSError:
+            return None
+        try:
+            # Marca o acesso para a política LRU
+            os.utime(entry, None)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        entry = self._entry_path(key)
+        try:
+            entry.parent.mkdir(parents=True, exist_ok=True)
+            tmp = entry.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_bytes(data)
+            # Sobrescrita da mesma chave: desconta o tamanho da entrada anterior
+            try:
+                previous = entry.stat().st_size
+            except OSError:
+                previous = 0
+            os.replace(tmp, entry)
+        except OSError as exc:
+            logging.warning(f"Falha ao gravar miniatura em cache ({entry}): {exc}")
+            return
+
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._scan())
+            else:
+                self._total_bytes += len(data) - previous
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _scan(self) -> list[tuple[float, int, Path]]:
+        entries = []
+        if not self.cache_dir.exists():
+            return entries
+        for entry in self.cache_dir.glob("*/*.jpg"):
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry))
+        return entries
+
+    def _evict(self) -> None:
+        """Remove as entradas mais antigas até ficar em ~90% do limite."""
+        entries = sorted(self._scan(), key=lambda e: e[0])
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * 0.9)
+        removed = 0
+        for _, size, entry in entries:
+            if total <= target:
+                break
+            try:
+                entry.unlink()
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        self._total_bytes = total
+        if removed:
+            logging.debug(f"Cache de miniaturas: {removed} entrada(s) removida(s), {total / (1024 * 1024):.1f} MB em uso")
+
+    def clear(self) -> None:
+        with self._lock:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+            self._total_bytes = 0
+
+
+_thumbnail_cache: Optional[ThumbnailCache] = None
+
+
+def get_thumbnail_cache() -> Optional[ThumbnailCache]:
+    """Cache padrão usado por encode_image_to_base64 (None se desabilitado)."""
+    global _thumbnail_cache
+    if os.environ.get("DT_MCP_THUMB_CACHE", "1") == "0":
+        return None
+    if _thumbnail_cache is None:
+        cache_dir = Path(os.environ.get("DT_MCP_THUMB_CACHE_DIR") or THUMB_CACHE_DIR)
+        try:
+            max_mb = float(os.environ.get("DT_MCP_THUMB_CACHE_MB") or THUMB_CACHE_MAX_MB)
+        except ValueError:
+            max_mb = THUMB_CACHE_MAX_MB
+        _thumbnail_cache = ThumbnailCache(cache_dir, int(max_mb * 1024 * 1024))
+    return _thumbnail_cache
+
+
+def encode_image_bytes(
+    image_path: Path,
+    max_dimension: int = 1600,
+    quality: int = 85,
+    cache: Optional[ThumbnailCache] = None,
+    use_cache: bool = True,
+) -> tuple[bytes, str]:
     """
-    Lê a imagem, redimensiona se necessário (e se Pillow estiver disponível) 
-    e retorna (b64_string, data_url).
+    Lê a imagem, redimensiona se necessário (e se Pillow estiver disponível)
+    e retorna (bytes, mime) prontos para envio.
     Converte para JPEG para reduzir tamanho de tráfego, a menos que falhe.
+    Miniaturas já geradas são reaproveitadas do ThumbnailCache (use_cache=False
+    desabilita o cache).
     """
     mime, _ = mimetypes.guess_type(image_path.name)
     mime = mime or "image/jpeg"
 
+    # Cache antes de qualquer leitura do arquivo (inclusive o preview do RAW)
+    if use_cache and HAS_PILLOW:
+        cache = cache or get_thumbnail_cache()
+    else:
+        cache = None
+    cache_key = ThumbnailCache.make_key(image_path, max_dimension, quality) if cache else None
+    if cache and cache_key:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached, "image/jpeg"
+
+    # RAWs: usa o JPEG embutido em vez de enviar o arquivo RAW inteiro
+    preview = None
+    if is_raw_file(image_path):
+        preview = extract_raw_preview(image_path, max_dimension)
+        if preview is None:
+            raise OSError(f"RAW sem preview JPEG embutido utilizável: {image_path.name}")
+
     if not HAS_PILLOW:
         # Fallback sem otimização
-        raw = image_path.read_bytes()
-        b64 = base64.b64encode(raw).decode("ascii")
-        return b64, f"data:{mime};base64,{b64}"
+        if preview:
+            return preview.data, "image/jpeg"
+        return image_path.read_bytes(), mime
 
     try:
-        with Image.open(image_path) as img:
+        with Image.open(io.BytesIO(preview.data) if preview else image_path) as img:
+            orientation = 1
+            if preview:
+                # 0x0112: Orientation no EXIF do JPEG embutido (RAF)
+                orientation = preview.orientation or img.getexif().get(0x0112, 1)
+            w, h = img.size
+            needs_resize = w > max_dimension or h > max_dimension
+
+            # JPEG: decodifica já reduzido (1/2, 1/4, 1/8) no domínio DCT, sem
+            # passar pela resolução cheia. Precisa ocorrer antes de qualquer load().
+            if needs_resize and img.format == "JPEG":
+                scale = max_dimension / max(w, h)
+                img.draft("RGB", (max(1, int(w * scale)), max(1, int(h * scale))))
+
+            # Paletas precisam virar RGB antes do resize (senão usa NEAREST)
+            if img.mode == "P":
+                img = img.convert("RGB")
+
+            # Redimensionar se for muito grande; reducing_gap faz um reduce()
+            # inteiro antes do filtro final para formatos sem draft
+            if needs_resize:
+                img.thumbnail((max_dimension, max_dimension), reducing_gap=2.0)
+
             # Converter para RGB se necessário (ex: PNG com alpha ou RAWs suportados)
-            if img.mode in ("RGBA", "P"):
+            if img.mode not in ("RGB", "L"):
                 img = img.convert("RGB")
-            
-            # Redimensionar se for muito grande
-            w, h = img.size
-            if w > max_dimension or h > max_dimension:
-                img.thumbnail((max_dimension, max_dimension))
-            
+
+            # O Pillow não aplica a orientação: vem do IFD0 do RAW ou do EXIF do preview
+            if orientation in _ORIENTATION_TRANSPOSE:
+                img = img.transpose(_ORIENTATION_TRANSPOSE[orientation])
+
             # Salvar em buffer como JPEG
             buffer = io.BytesIO()
-            img.save(buffer, format="JPEG", quality=85)
+            img.save(buffer, format="JPEG", quality=quality)
             raw = buffer.getvalue()
-            
+            if cache and cache_key:
+                cache.put(cache_key, raw)
+
             # Atualiza mime para JPEG pois convertemos
-            mime = "image/jpeg"
-            b64 = base64.b64encode(raw).decode("ascii")
-            return b64, f"data:{mime};base64,{b64}"
+            return raw, "image/jpeg"
 
     except Exception as e:
         print(f"[aviso] Falha ao otimizar imagem {image_path.name}: {e}. Usando original.")
         # Fallback em caso de erro no Pillow (ex: arquivo corrompido ou formato não suportado)
-        raw = image_path.read_bytes()
-        b64 = base64.b64encode(raw).decode("ascii")
-        return b64, f"data:{mime};base64,{b64}"
+        if preview:
+            return preview.data, "image/jpeg"
+        return image_path.read_bytes(), mime
+
+
+def encode_image_to_base64(
+    image_path: Path,
+    max_dimension: int = 1600,
+    quality: int = 85,
+    cache: Optional[ThumbnailCache] = None,
+    use_cache: bool = True,
+) -> tuple[str, str]:
+    """Como encode_image_bytes, mas retorna (b64_string, data_url)."""
+    raw, mime = encode_image_bytes(
+        image_path, max_dimension, quality, cache=cache, use_cache=use_cache
+    )
+    b64 = base64.b64encode(raw).decode("ascii")
+    return b64, f"data:{mime};base64,{b64}"
 
 
 def prepare_vision_payloads(
@@ -739,9 +1307,10 @@ def prepare_vision_payloads(
             original_size_mb = 0
         
         try:
-            b64, data_url = encode_image_to_base64(image_path)
-            b64_size_kb = len(b64) / 1024
-            total_b64_size += len(b64)
+            raw, mime = encode_image_bytes(image_path)
+            payload = VisionImage(meta=img, path=image_path, data=raw, mime=mime)
+            b64_size_kb = payload.b64_size / 1024
+            total_b64_size += payload.b64_size
             
             # Log sempre na primeira, última e a cada 3 imagens
             if idx % 3 == 0 or idx == 1 or idx == total_count:
@@ -760,14 +1329,7 @@ def prepare_vision_payloads(
             errors.append(f"Falha ao ler {image_path}: {exc}")
             continue
 
-        payloads.append(
-            VisionImage(
-                meta=img,
-                path=image_path,
-                b64=b64,
-                data_url=data_url,
-            )
-        )
+        payloads.append(payload)
     
     if payloads:
         total_mb = total_b64_size / (1024 * 1024)
@@ -776,14 +1338,127 @@ def prepare_vision_payloads(
     return payloads, errors
 
 
+def image_fingerprint(raw: bytes, hash_size: int = DHASH_SIZE) -> tuple[int, float]:
+    """
+    dHash (hash_size² bits) e nitidez de uma miniatura JPEG, para agrupar quadros
+    quase idênticos de rajadas. A nitidez é a média dos gradientes absolutos numa
+    versão 64x64 em tons de cinza (só comparável entre fotos parecidas).
+    Usa NumPy quando instalado; sem ele o cálculo é o mesmo em Python puro.
+    """
+    with Image.open(io.BytesIO(raw)) as img:
+        img.draft("L", (SHARPNESS_SIZE * 2, SHARPNESS_SIZE * 2))
+        gray = img.convert("L")
+    small = gray.resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    detail = gray.resize((SHARPNESS_SIZE, SHARPNESS_SIZE), Image.Resampling.BILINEAR)
+
+    if np is not None:
+        px = np.asarray(small, dtype=np.int16)
+        bits = (px[:, 1:] > px[:, :-1]).ravel()
+        value = int.from_bytes(np.packbits(bits).tobytes(), "big") >> (-bits.size % 8)
+        d = np.asarray(detail, dtype=np.float32)
+        sharpness = float(np.abs(np.diff(d, axis=0)).mean() + np.abs(np.diff(d, axis=1)).mean())
+        return value, round(sharpness, 4)
+
+    px = small.tobytes()
+    width = hash_size + 1
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = px[row * width + col]
+            value = (value << 1) | (px[row * width + col + 1] > left)
+    d = detail.tobytes()
+    n = SHARPNESS_SIZE
+    vertical = sum(abs(d[i + n] - d[i]) for i in range(n * (n - 1))) / (n * (n - 1))
+    horizontal = sum(
+        abs(d[r * n + c + 1] - d[r * n + c]) for r in range(n) for c in range(n - 1)
+    ) / (n * (n - 1))
+    return value, round(vertical + horizontal, 4)
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _encode_image_job(
+    idx: int, image_path: str, max_dimension: int = 1600, quality: int = 85, fingerprint: bool = False
+) -> tuple[int, Optional[bytes], str, Optional[str], Optional[tuple[int, float]]]:
+    """Unidade de trabalho dos pools de preparação (threads ou processos).
+
+    Retorna apenas os bytes JPEG (não o base64) para que o resultado cruze a
+    fronteira do processo uma única vez e com ~25% menos volume; exceções viram
+    mensagens porque nem todas são serializáveis pelo pickle. Com ``fingerprint``,
+    também calcula (dHash, nitidez) da miniatura no próprio worker.
+    """
+    path = Path(image_path)
+    try:
+        raw, mime = encode_image_bytes(path, max_dimension, quality)
+        return idx, raw, mime, None, image_fingerprint(raw) if fingerprint else None
+    except FileNotFoundError:
+        return idx, None, "", f"Arquivo não encontrado: {path}", None
+    except OSError as exc:
+        return idx, None, "", f"Falha ao ler {path}: {exc}", None
+    except Exception as exc:
+        return idx, None, "", f"Erro inesperado processando {path}: {exc}", None
+
+
+def _make_prep_executor(backend: str, max_workers: int):
+    if backend == "process":
+        # fork copiaria threads/locks do host (HTTP, logging) para os workers
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        try:
+            return ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+        except (OSError, NotImplementedError) as exc:
+            logging.warning(f"Pool de processos indisponível ({exc}); usando threads.")
+    elif backend != "thread":
+        raise ValueError(f"backend de preparação inválido: {backend}")
+    return ThreadPoolExecutor(max_workers=max_workers)
+
+
+_prep_executors: dict[tuple[str, int], Executor] = {}
+_prep_executors_lock = threading.Lock()
+
+
+def get_prep_executor(backend: str, max_workers: int) -> Executor:
+    """Pool de preparação reaproveitado durante toda a execução (encerrado na saída)."""
+    key = (backend, max_workers)
+    with _prep_executors_lock:
+        executor = _prep_executors.get(key)
+        if executor is None:
+            executor = _make_prep_executor(backend, max_workers)
+            if not _prep_executors:
+                atexit.register(shutdown_prep_executors)
+            _prep_executors[key] = executor
+        return executor
+
+
+def shutdown_prep_executors() -> None:
+    with _prep_executors_lock:
+        executors = list(_prep_executors.values())
+        _prep_executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _discard_prep_executor(executor: Executor) -> None:
+    """Remove um pool quebrado (worker morto) para que a próxima chamada crie outro."""
+    with _prep_executors_lock:
+        for key, current in list(_prep_executors.items()):
+            if current is executor:
+                del _prep_executors[key]
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
 def prepare_vision_payloads_async(
     images: Iterable[dict], 
     attach_images: bool = True,
     progress_callback: Optional[Callable[[int, int, str], None]] = None,
-    max_workers: int = 4
+    max_workers: Optional[int] = None,
+    backend: str = "thread",
+    fingerprint: bool = False,
 ):
     """
-    Asynchronous version of prepare_vision_payloads using ThreadPoolExecutor.
+    Asynchronous version of prepare_vision_payloads using a worker pool.
     
     Processes multiple images in parallel for better performance on multi-core systems.
     Maintains compatibility with progress callbacks and error handling.
@@ -792,7 +1467,11 @@ def prepare_vision_payloads_async(
         images: Iterable of image dictionaries
         attach_images: Whether to attach images or not
         progress_callback: Optional callback for progress updates (current, total, message)
-        max_workers: Maximum number of worker threads (default: 4)
+        max_workers: Maximum number of workers (default: os.cpu_count())
+        backend: "thread" (ThreadPoolExecutor) or "process" (ProcessPoolExecutor,
+            avoids the GIL while Pillow decodes/encodes large JPEGs)
+        fingerprint: Also compute the perceptual hash/sharpness of each thumbnail
+            (VisionImage.dhash/sharpness), used to collapse burst duplicates
     
     Returns:
         Tuple of (payloads list, errors list)
@@ -809,76 +1488,66 @@ def prepare_vision_payloads_async(
     
     if total_count == 0:
         return payloads, errors
+
+    max_workers = max(1, max_workers or os.cpu_count() or 4)
+    logging.info(
+        f"Preparando {total_count} imagem(ns) para envio ao modelo "
+        f"(async com {max_workers} workers, backend={backend})..."
+    )
     
-    logging.info(f"Preparando {total_count} imagem(ns) para envio ao modelo (async com {max_workers} workers)...")
-    
-    # Thread-safe counter and list
-    completed_lock = threading.Lock()
-    completed_count = [0]  # Use list to allow modification in nested function
-    total_b64_size = [0]
-    
-    def process_single_image(idx: int, img: dict):
-        """Process a single image and return result."""
-        image_path = Path(img.get("path", "")) / str(img.get("filename", ""))
-        
-        # Get original file size
-        try:
-            original_size_mb = image_path.stat().st_size / (1024 * 1024)
-        except:
-            original_size_mb = 0
-        
-        try:
-            b64, data_url = encode_image_to_base64(image_path)
-            b64_size_kb = len(b64) / 1024
-            
-            # Thread-safe updates
-            with completed_lock:
-                completed_count[0] += 1
-                total_b64_size[0] += len(b64)
-                current = completed_count[0]
-            
-            # Log every 10 images or if it's a large set, log less frequently
-            # Log sempre na primeira, última e a cada 3 imagens
-            if idx % 3 == 0 or idx == 1 or idx == total_count:
-                logging.info(
-                    f"Processando imagem {idx}/{total_count}: {image_path.name} "
-                    f"({original_size_mb:.1f} MB → {b64_size_kb:.0f} KB base64)"
-                )
-            # Callback sempre na primeira, última e a cada 3 imagens
-            if progress_callback and (current % 3 == 0 or current == 1 or current == total_count):
-                progress_callback(current, total_count, "Preparando imagens")
-            
-            return (idx, VisionImage(
-                meta=img,
-                path=image_path,
-                b64=b64,
-                data_url=data_url,
-            ), None)
-            
-        except FileNotFoundError:
-            error_msg = f"Arquivo não encontrado: {image_path}"
-            return (idx, None, error_msg)
-        except OSError as exc:
-            error_msg = f"Falha ao ler {image_path}: {exc}"
-            return (idx, None, error_msg)
-        except Exception as exc:
-            error_msg = f"Erro inesperado processando {image_path}: {exc}"
-            return (idx, None, error_msg)
+    image_paths = {
+        idx: Path(img.get("path", "")) / str(img.get("filename", ""))
+        for idx, img in enumerate(images_list, 1)
+    }
+    total_b64_size = 0
+    completed = 0
     
     # Process images in parallel
     results = {}  # idx -> (VisionImage or None, error or None)
     
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # Submit all tasks
-        futures = {
-            executor.submit(process_single_image, idx, img): idx 
-            for idx, img in enumerate(images_list, 1)
-        }
-        
-        # Collect results as they complete
-        for future in as_completed(futures):
-            idx, payload, error = future.result()
-            results[idx] = (payload, error)
+    executor = get_prep_executor(backend, max_workers)
+    try:
+        futures = [
+            executor.submit(_encode_image_job, idx, str(image_path), fingerprint=fingerprint)
+            for idx, image_path in image_paths.items()
+        ]
+    except BrokenExecutor:
+        _discard_prep_executor(executor)
+        raise
+
+    # Collect results as they complete (callbacks run on the caller thread)
+    for future in as_completed(futures):
+        try:
+            idx, raw, mime, error, fp = future.result()
+        except BrokenExecutor:
+            _discard_prep_executor(executor)
+            raise
+        completed += 1
+        if error:
+            results[idx] = (None, error)
+            continue
+
+        image_path = image_paths[idx]
+        payload = VisionImage(meta=images_list[idx - 1], path=image_path, data=raw, mime=mime)
+        if fp:
+            payload.dhash, payload.sharpness = fp
+        total_b64_size += payload.b64_size
+
+        # Log sempre na primeira, última e a cada 3 imagens
+        if idx % 3 == 0 or idx == 1 or idx == total_count:
+            try:
+                original_size_mb = image_path.stat().st_size / (1024 * 1024)
+            except OSError:
+                original_size_mb = 0
+            logging.info(
+                f"Processando imagem {idx}/{total_count}: {image_path.name} "
+                f"({original_size_mb:.1f} MB → {payload.b64_size / 1024:.0f} KB base64)"
+            )
+        # Callback sempre na primeira, última e a cada 3 imagens
+        if progress_callback and (completed % 3 == 0 or completed == 1 or completed == total_count):
+            progress_callback(completed, total_count, "Preparando imagens")
+
+        results[idx] = (payload, None)
     
     # Reconstruct payloads in original order
     for idx in sorted(results.keys()):
@@ -889,7 +1558,7 @@ def prepare_vision_payloads_async(
             payloads.append(payload)
     
     if payloads:
-        total_mb = total_b64_size[0] / (1024 * 1024)
+        total_mb = total_b64_size / (1024 * 1024)
         logging.info(f"{len(payloads)} imagem(ns) preparada(s) ({total_mb:.1f} MB total em base64)")
     
     return payloads, errors
@@ -900,7 +1569,216 @@ def fallback_user_prompt(sample: list[dict]) -> str:
     return "Lista (amostra) de imagens do darktable:\n" + json.dumps(sample, ensure_ascii=False)
 
 
-def fetch_images(client: McpClient, args) -> list[dict]:
+IMAGE_PAGE_SIZE = 500
+# Ordem dos bits de colorlabels no formato colunar do servidor
+COLORLABEL_BITS = ("red", "yellow", "green", "blue", "purple")
+
+
+class ColumnarImages(Sequence):
+    """
+    Página no formato colunar (format="columnar") vista como lista de dicts.
+    Cada dict é montado só quando acessado, com as mesmas chaves do formato rows.
+    """
+
+    def __init__(self, payload: dict):
+        self._paths = payload.get("paths") or []
+        self._columns = payload.get("columns") or {}
+        self._count = payload.get("count", len(self._columns.get("id") or []))
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        cols = self._columns
+        return {
+            "id": cols["id"][index],
+            "path": self._paths[cols["path"][index]],
+            "filename": cols["filename"][index],
+            "rating": cols["rating"][index],
+            "is_raw": cols["is_raw"][index],
+            "colorlabels": colorlabel_names(cols["colorlabels"][index]),
+        }
+
+
+def colorlabel_names(mask: int) -> list[str]:
+    return [name for bit, name in enumerate(COLORLABEL_BITS) if mask & (1 << bit)]
+
+
+def decode_image_list(payload):
+    """Aceita tanto a lista de objetos (rows) quanto o formato colunar."""
+    if isinstance(payload, dict) and payload.get("format") == "columnar":
+        return ColumnarImages(payload)
+    return payload
+
+
+class CatalogSnapshot:
+    """Cópia local (SQLite) dos metadados do catálogo.
+
+    ``sync`` manda o token guardado para ``catalog_changes`` e aplica só o
+    delta devolvido (ou recria tudo quando o servidor responde ``full``);
+    ``query``/``count`` respondem as listagens sem transferir o catálogo.
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), timeout=10, check_same_thread=False)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS images (
+                id INTEGER PRIMARY KEY, path TEXT, filename TEXT, rating INTEGER,
+                is_raw INTEGER, colorlabels INTEGER, mtime INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS images_path ON images(path);
+            CREATE TABLE IF NOT EXISTS image_tags (tag TEXT, id INTEGER, PRIMARY KEY (tag, id));
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            """
+        )
+
+    @property
+    def token(self) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'token'").fetchone()
+        return row[0] if row else None
+
+    def sync(self, client, page_size: int = CATALOG_SYNC_PAGE) -> bool:
+        """
+        Atualiza a cópia local página a página (cursor do servidor); o token só
+        é gravado depois da última página. False se o servidor não suporta
+        catalog_changes ou não consegue gerar token.
+        """
+        with self._lock:
+            params = {"limit": page_size}
+            if self.token:
+                params["since"] = self.token
+            pages = []
+            while True:
+                try:
+                    result = client.call_tool("catalog_changes", params)
+                except RuntimeError as exc:
+                    error = exc.args[0] if exc.args else None
+                    if isinstance(error, dict) and error.get("code") == -32601:
+                        return False
+                    raise
+                changes = _result_json(result)
+                if not changes.get("token") or not isinstance(changes.get("images"), dict):
+                    return False
+                if pages and changes.get("mode") != pages[0].get("mode"):
+                    # catálogo mudou no meio da cópia: fica para a próxima execução
+                    logging.warning("[snapshot] catálogo alterado durante a sincronização")
+                    return False
+                pages.append(changes)
+                if not result.get("nextCursor"):
+                    break
+                params["cursor"] = result["nextCursor"]
+            self._apply(pages)
+            return True
+
+    def _apply(self, pages: list[dict]) -> None:
+        first = pages[0]
+        with self._conn:
+            if first.get("mode") == "full":
+                self._conn.execute("DELETE FROM images")
+                self._conn.execute("DELETE FROM image_tags")
+            for changes in pages:
+                self._apply_page(changes)
+            # token da primeira página: mudanças durante a cópia voltam na próxima
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('token', ?)", (first["token"],)
+            )
+        logging.debug(
+            f"[snapshot] {first.get('mode')}: "
+            f"{sum(len(p['images']['columns']['id']) for p in pages)} imagem(ns) em {len(pages)} página(s)"
+        )
+
+    def _apply_page(self, changes: dict) -> None:
+        images = changes["images"]
+        cols, paths = images["columns"], images["paths"]
+        ids = cols["id"]
+        rows = [
+            (
+                ids[i], paths[cols["path"][i]], cols["filename"][i], cols["rating"][i],
+                int(bool(cols["is_raw"][i])), cols["colorlabels"][i], cols["mtime"][i],
+            )
+            for i in range(len(ids))
+        ]
+        tags = [(tag, ids[i]) for i in range(len(ids)) for tag in cols["tags"][i]]
+
+        if changes.get("mode") != "full":
+            self._conn.executemany("DELETE FROM image_tags WHERE id = ?", [(i,) for i in ids])
+        self._conn.executemany("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        self._conn.executemany("INSERT OR IGNORE INTO image_tags VALUES (?, ?)", tags)
+
+    def _where(self, args) -> tuple[str, list]:
+        # Mesmos filtros das ferramentas de listagem do servidor
+        tool_name, params = _list_tool_params(args)
+        clauses = ["rating >= ?"]
+        values: list = [params["min_rating"] if params["min_rating"] is not None else -2]
+        if params["only_raw"]:
+            clauses.append("is_raw = 1")
+        substring = params.get("collection_path") or params.get("path_contains")
+        if substring:
+            clauses.append("instr(path, ?) > 0")
+            values.append(substring)
+        if tool_name == "list_by_tag":
+            clauses.append("id IN (SELECT id FROM image_tags WHERE tag = ?)")
+            values.append(params["tag"])
+        return " AND ".join(clauses), values
+
+    def query(self, args, limit: Optional[int] = None) -> list[dict]:
+        where, values = self._where(args)
+        sql = f"SELECT id, path, filename, rating, is_raw, colorlabels FROM images WHERE {where} ORDER BY id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            values.append(limit)
+        with self._lock:
+            rows = self._conn.execute(sql, values).fetchall()
+        return [
+            {
+                "id": image_id,
+                "path": path,
+                "filename": filename,
+                "rating": rating,
+                "is_raw": bool(is_raw),
+                "colorlabels": colorlabel_names(colorlabels or 0),
+            }
+            for image_id, path, filename, rating, is_raw, colorlabels in rows
+        ]
+
+    def count(self, args) -> int:
+        where, values = self._where(args)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM images WHERE {where}", values).fetchone()[0]
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+_catalog_snapshot: Optional[CatalogSnapshot] = None
+
+
+def get_catalog_snapshot() -> Optional[CatalogSnapshot]:
+    """Snapshot usado por fetch_images/probe; opt-in via DT_MCP_CATALOG_CACHE=1."""
+    global _catalog_snapshot
+    if os.environ.get("DT_MCP_CATALOG_CACHE", "0") != "1":
+        return None
+    if _catalog_snapshot is None:
+        path = Path(os.environ.get("DT_MCP_CATALOG_CACHE_PATH") or CATALOG_SNAPSHOT_PATH)
+        try:
+            _catalog_snapshot = CatalogSnapshot(path)
+        except (OSError, sqlite3.Error) as exc:
+            logging.warning(f"Snapshot do catálogo indisponível ({path}): {exc}")
+            return None
+    return _catalog_snapshot
+
+
+def _list_tool_params(args) -> tuple[str, dict]:
     params = {
         "min_rating": args.min_rating,
         "only_raw": bool(args.only_raw),
@@ -926,9 +1804,62 @@ def fetch_images(client: McpClient, args) -> list[dict]:
     else:
         raise ValueError(f"source inválido: {args.source}")
 
+    return tool_name, params
+
+
+def fetch_image_page(
+    client: McpClient,
+    args,
+    *,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    order_by: Optional[str] = None,
+) -> tuple[list[dict], Optional[str], Optional[int]]:
+    """Busca uma página da listagem; retorna (imagens, nextCursor, total)."""
+    tool_name, params = _list_tool_params(args)
+    if limit is not None:
+        params["limit"] = limit
+    if cursor:
+        params["cursor"] = cursor
+    if order_by:
+        params["order_by"] = order_by
+    # Servidores sem suporte ignoram o parâmetro e respondem em rows
+    params["format"] = "columnar"
+
     result = client.call_tool(tool_name, params)
-    images = result["content"][0]["json"]
-    return images
+    images = decode_image_list(result["content"][0]["json"])
+    return images, result.get("nextCursor"), result.get("total")
+
+
+def iter_images(
+    client: McpClient,
+    args,
+    *,
+    limit: Optional[int] = None,
+    page_size: int = IMAGE_PAGE_SIZE,
+    order_by: Optional[str] = None,
+) -> Iterable[dict]:
+    """Percorre a listagem página a página, sem materializar o catálogo inteiro."""
+    remaining = limit
+    cursor = None
+    while remaining is None or remaining > 0:
+        size = page_size if remaining is None else min(page_size, remaining)
+        images, cursor, _ = fetch_image_page(client, args, limit=size, cursor=cursor, order_by=order_by)
+        # Servidores sem paginação devolvem tudo de uma vez (sem nextCursor)
+        if remaining is not None:
+            images = images[:remaining]
+            remaining -= len(images)
+        yield from images
+        if not cursor or not images:
+            break
+
+
+def fetch_images(client: McpClient, args, limit: Optional[int] = None) -> list[dict]:
+    # Com snapshot local, só o delta desde a última execução passa pelo MCP
+    snapshot = get_catalog_snapshot()
+    if snapshot is not None and snapshot.sync(client):
+        return snapshot.query(args, limit=limit)
+    return list(iter_images(client, args, limit=limit))
 
 
 
@@ -976,7 +1907,8 @@ def probe_darktable_state(
             DT_SERVER_CMD, 
             protocol_version, 
             client_info, 
-            appimage_path=appimage_path
+            appimage_path=appimage_path,
+            socket_path=find_running_daemon(),
         )
         
         # Precisamos conectar startar o processo
@@ -1005,8 +1937,13 @@ def probe_darktable_state(
             tag=None,
             collection=None,
         )
-        images = fetch_images(client, probe_args)
-        sample = images[: max(1, min(sample_limit, len(images)))]
+        snapshot = get_catalog_snapshot()
+        if snapshot is not None and snapshot.sync(client):
+            sample = snapshot.query(probe_args, limit=max(1, sample_limit))
+            total = snapshot.count(probe_args)
+        else:
+            sample, _, total = fetch_image_page(client, probe_args, limit=max(1, sample_limit))
+            sample = sample[: max(1, sample_limit)]
 
         result.update(
             {
@@ -1014,7 +1951,7 @@ def probe_darktable_state(
                 "tools": tool_names,
                 "collections": collections_sorted,
                 "sample_images": sample,
-                "image_total": len(images),
+                "image_total": total if total is not None else _probe_total(collections_sorted, probe_args, sample),
             }
         )
         return result
@@ -1025,43 +1962,325 @@ def probe_darktable_state(
         client.close()
 
 
-def save_log(mode: str, source: str, images: list[dict], model_answer: str, extra=None):
+def _probe_total(collections: list[dict], args, sample: list[dict]) -> int:
+    """Total quando o servidor para cedo (limit pushdown) e não informa ``total``."""
+    if args.min_rating <= -1 and not args.only_raw:
+        return sum(c.get("image_count", 0) for c in collections)
+    return len(sample)
+
+
+@dataclass(frozen=True)
+class RunLogRef:
+    """Referência a uma execução gravada no diário (arquivo + run_id)."""
+    path: Path
+    run_id: str
+
+    def __str__(self) -> str:
+        return f"{self.path}#{self.run_id}"
+
+
+_JOURNAL_SUFFIXES = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+# path -> (inode, tamanho lido, {id: digest}): o que este processo já leu do diário
+_journal_seen: dict[Path, tuple[int, int, dict]] = {}
+_journal_pruned = False
+_journal_lock = threading.Lock()
+
+
+@contextmanager
+def locked_file(path: Path):
+    """Lock exclusivo entre processos num arquivo .lock ao lado de ``path``."""
+    if fcntl is None:
+        yield
+        return
+    with open(path.with_name(path.name + ".lock"), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _journal_compression() -> str:
+    codec = os.environ.get("DT_MCP_RUN_LOG_COMPRESS", "gzip").lower()
+    if codec == "zstd" and zstandard is None:
+        logging.warning("zstandard não instalado; diário de execuções usará gzip")
+        codec = "gzip"
+    return codec if codec in _JOURNAL_SUFFIXES else "gzip"
+
+
+def _journal_path(day: str) -> Path:
+    return LOG_DIR / f"runs-{day}.jsonl{_JOURNAL_SUFFIXES[_journal_compression()]}"
+
+
+def _compress_member(path: Path, data: bytes) -> bytes:
+    # Cada append vira um membro/frame próprio; gzip e zstd leem a concatenação
+    if path.suffix == ".gz":
+        return gzip.compress(data)
+    if path.suffix == ".zst":
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+
+def read_run_journal(path: Path, offset: int = 0) -> Iterable[dict]:
+    """
+    Itera os registros de um runs-*.jsonl[.gz|.zst], ignorando linhas corrompidas.
+    ``offset`` (fim de um append anterior) lê só os membros acrescentados depois.
+    """
+    path = Path(path)
+    try:
+        raw = open(path, "rb")
+    except FileNotFoundError:
+        return
+    raw.seek(offset)
+    try:
+        if path.suffix == ".gz":
+            f = io.TextIOWrapper(gzip.GzipFile(fileobj=raw, mode="rb"), encoding="utf-8")
+        elif path.suffix == ".zst":
+            if zstandard is None:
+                raise OSError("zstandard não instalado")
+            reader = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+            f = io.TextIOWrapper(reader, encoding="utf-8")
+        else:
+            f = io.TextIOWrapper(raw, encoding="utf-8")
+    except Exception:
+        raw.close()
+        raise
+    with raw, f:
+        try:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+        except (EOFError, OSError) as exc:  # último membro truncado
+            logging.warning(f"Diário {path.name} truncado: {exc}")
+
+
+def _image_digest(meta: dict) -> str:
+    return hashlib.sha1(json.dumps(meta, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+def prune_run_logs(days: Optional[float] = None, max_mb: Optional[float] = None, keep: Optional[Path] = None) -> list[Path]:
+    """
+    Retenção dos logs de execução (diários runs-* e os batch-*.json antigos):
+    remove os mais velhos que ``days`` e depois os mais antigos até caber em ``max_mb``.
+    """
+    days = float(os.environ.get("DT_MCP_RUN_LOG_DAYS", RUN_LOG_RETENTION_DAYS)) if days is None else days
+    max_mb = float(os.environ.get("DT_MCP_RUN_LOG_MB", RUN_LOG_MAX_MB)) if max_mb is None else max_mb
+    files = []
+    for pattern in ("runs-*.jsonl*", "batch-*.json"):
+        for p in LOG_DIR.glob(pattern):
+            if p.suffix == ".lock" or p == keep:
+                continue
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, p))
+    files.sort()
+
+    cutoff = time.time() - days * 86400
+    budget = max_mb * 1024 * 1024
+    total = sum(size for _, size, _ in files)
+    removed = []
+    for mtime, size, p in files:
+        if mtime >= cutoff and total <= budget:
+            break
+        try:
+            p.unlink()
+            p.with_name(p.name + ".lock").unlink(missing_ok=True)
+        except OSError:
+            continue
+        total -= size
+        removed.append(p)
+    if removed:
+        logging.info(f"Retenção de logs: {len(removed)} arquivo(s) removido(s)")
+    return removed
+
+
+def _write_journal(path: Path, records: list[dict]) -> None:
+    """Grava um membro com os registros (chamado com o lock do arquivo)."""
+    data = "".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in records).encode("utf-8")
+    with path.open("ab") as f:
+        f.write(_compress_member(path, data))
+
+
+def _append_journal(path: Path, records: list[dict]) -> None:
+    with locked_file(path):
+        _write_journal(path, records)
+
+
+def _journal_image_digests(path: Path) -> dict:
+    """
+    {id: digest} dos registros ``image`` do arquivo (chamado com o lock). Outros
+    processos também acrescentam ao diário: só os membros gravados depois da
+    última leitura deste processo são lidos; arquivo trocado é relido inteiro.
+    """
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        _journal_seen.pop(path, None)
+        return {}
+    inode, offset, seen = _journal_seen.get(path, (st.st_ino, 0, {}))
+    if inode != st.st_ino or offset > st.st_size:
+        offset, seen = 0, {}
+    if offset < st.st_size:
+        for record in read_run_journal(path, offset):
+            if record.get("type") == "image":
+                seen[record.get("id")] = record.get("digest")
+    _journal_seen[path] = (st.st_ino, st.st_size, seen)
+    return seen
+
+
+def save_log(mode: str, source: str, images: list[dict], model_answer: str, extra=None) -> RunLogRef:
+    """
+    Acrescenta a execução ao diário do dia (logs/runs-AAAAMMDD.jsonl.gz).
+    O registro da execução guarda só os ids; os metadados de cada imagem entram
+    como registro ``image`` apenas quando mudam desde a última vez no arquivo.
+    """
+    global _journal_pruned
     _ensure_paths()
     ts = time.strftime("%Y%m%d-%H%M%S")
-    log_file = LOG_DIR / f"batch-{mode}-{ts}.json"
-
-    data = {
-        "timestamp": ts,
-        "mode": mode,
-        "source": source,
-        "images_sample": images,
-        "model_answer": model_answer,
-    }
-    if extra:
-        data["extra"] = extra
+    path = _journal_path(ts[:8])
+    run_id = f"{ts}-{mode}-{os.getpid()}-{random.randrange(16**4):04x}"
+
+    with _journal_lock:
+        if not _journal_pruned:
+            _journal_pruned = True
+            prune_run_logs(keep=path)
+
+    # Decide quais metadados gravar sob o lock do arquivo, a partir do próprio
+    # diário: outro host pode ter gravado a mesma imagem com outro digest
+    with _journal_lock, locked_file(path):
+        seen = _journal_image_digests(path)
+        records = []
+        image_ids = []
+        for img in images:
+            meta = dict(img)
+            image_id = meta.get("id")
+            image_ids.append(image_id)
+            digest = _image_digest(meta)
+            if seen.get(image_id) != digest:
+                seen[image_id] = digest
+                records.append({"type": "image", "id": image_id, "digest": digest, "meta": meta})
+
+        run = {
+            "type": "run",
+            "run_id": run_id,
+            "timestamp": ts,
+            "mode": mode,
+            "source": source,
+            "image_ids": image_ids,
+            "model_answer": model_answer,
+        }
+        if extra:
+            run["extra"] = extra
+        records.append(run)
+        _write_journal(path, records)
+        _journal_image_digests(path)
+
+    return RunLogRef(path, run_id)
 
-    with log_file.open("w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
 
-    return log_file
+def append_export_result_to_log(log_ref: RunLogRef, export_result: dict) -> RunLogRef:
+    """Acrescenta o resultado do export ao diário, sem reescrever o arquivo."""
+    _append_journal(log_ref.path, [{
+        "type": "export_result",
+        "run_id": log_ref.run_id,
+        "timestamp": time.strftime("%Y%m%d-%H%M%S"),
+        "result": export_result,
+    }])
+    return log_ref
 
 
-def append_export_result_to_log(log_file: Path, export_result: dict) -> Path:
+def load_runs(paths: Optional[Iterable[Path]] = None, mode: Optional[str] = None) -> list[dict]:
+    """
+    Reconstrói as execuções no formato dos antigos batch-*.json
+    (images_sample com os metadados e extra.export_result).
+    """
+    if paths is None:
+        paths = sorted(p for p in LOG_DIR.glob("runs-*.jsonl*") if p.suffix != ".lock")
+    runs: dict[str, dict] = {}
+    for path in paths:
+        images: dict = {}
+        for record in read_run_journal(path):
+            kind = record.get("type")
+            if kind == "image":
+                images[record.get("id")] = record.get("meta")
+            elif kind == "run" and (mode is None or record.get("mode") == mode):
+                run = {k: v for k, v in record.items() if k not in ("type", "image_ids")}
+                run["images_sample"] = [images.get(i, {"id": i}) for i in record.get("image_ids", [])]
+                runs[record["run_id"]] = run
+            elif kind == "export_result" and record.get("run_id") in runs:
+                run = runs[record["run_id"]]
+                run.setdefault("extra", {})["export_result"] = record.get("result")
+    return list(runs.values())
+
+
+def _result_json(result_payload: dict) -> dict:
+    for part in result_payload.get("content", []):
+        if isinstance(part, dict) and isinstance(part.get("json"), dict):
+            return part["json"]
+    return {}
+
+
+def run_export_job(
+    client,
+    params: dict,
+    progress_callback: Optional[Callable[[int, int, str], None]] = None,
+    poll_interval: float = EXPORT_POLL_INTERVAL,
+) -> dict:
+    """
+    Exporta via export_start + polling de export_status, sem segurar um tools/call
+    pela exportação inteira. Ctrl+C cancela o job no servidor. Servidores sem
+    suporte a jobs caem no export_collection bloqueante.
+    Retorna o último resultado de export_status (texto + json com as contagens/erros).
+    """
     try:
-        existing = json.loads(log_file.read_text(encoding="utf-8"))
-    except Exception:
-        existing = None
-
-    if isinstance(existing, dict):
-        extra = existing.get("extra") or {}
-        extra["export_result"] = export_result
-        existing["extra"] = extra
-        log_file.write_text(json.dumps(existing, ensure_ascii=False, indent=2), encoding="utf-8")
-        return log_file
-
-    fallback = LOG_DIR / f"{log_file.stem}-export-result{log_file.suffix}"
-    fallback.write_text(json.dumps(export_result, ensure_ascii=False, indent=2), encoding="utf-8")
-    return fallback
+        started = client.call_tool("export_start", params)
+    except RuntimeError as exc:
+        error = exc.args[0] if exc.args else None
+        if isinstance(error, dict) and error.get("code") == -32601:
+            logging.info("[export] Servidor sem export_start; usando export_collection")
+            return client.call_tool("export_collection", params)
+        raise
+    job_id = _result_json(started).get("job_id")
+    if started.get("isError") or not job_id:
+        return started
+
+    try:
+        while True:
+            result = client.call_tool("export_status", {"job_id": job_id})
+            status = _result_json(result)
+            if progress_callback:
+                done = status.get("exported", 0) + status.get("failed", 0)
+                progress_callback(
+                    done,
+                    status.get("total", 0),
+                    f"Exportando ({status.get('images_per_sec', 0)} img/s)",
+                )
+            if status.get("state") != "running":
+                return result
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        client.call_tool("export_cancel", {"job_id": job_id})
+        raise
+
+
+def format_progress_line(current: int, total: int, message: str) -> str:
+    """Linha de progresso no stdout do host, lida pela GUI (ver parse_progress_line)."""
+    return f"{PROGRESS_PREFIX} {current}/{total} {message}"
+
+
+def parse_progress_line(line: str):
+    """Retorna (current, total, message) de uma linha de progresso, ou None."""
+    if not line.startswith(PROGRESS_PREFIX + " "):
+        return None
+    counts, _, message = line[len(PROGRESS_PREFIX) + 1:].partition(" ")
+    current, sep, total = counts.partition("/")
+    if not sep or not current.isdigit() or not total.isdigit():
+        return None
+    return int(current), int(total), message.strip()
 
 
 def extract_export_errors(result_payload: dict):
@@ -18,19 +18,28 @@ class ILLMProvider(ABC):
         pass
 from __future__ import annotations
 
+import asyncio
+import inspect
 import json
+import re
 import time
-import requests
 from abc import ABC, abstractmethod
 
 
 class LLMProviderBase(ABC):
         # Implementa ILLMProvider para polimorfismo e mocks
     """Interface base para providers LLM. Permite mocks e extensão futura."""
-    def __init__(self, url: str, model: str, timeout: float = 60.0):
+    def __init__(self, url: str, model: str, timeout: float = 60.0, stream: bool = False):
         self.url = url.rstrip("/")
         self.model = model
         self.timeout = timeout
+        # Em modo stream a resposta é consumida em pedaços (NDJSON/SSE)
+        self.stream = stream
+        # Conexões keep-alive reaproveitadas entre chamadas (sub-lotes, retries)
+        self.session = make_http_session()
+
+    def close(self) -> None:
+        self.session.close()
 
     @abstractmethod
     def chat(self, messages: list[dict]) -> tuple[str, dict]:
@@ -40,36 +49,162 @@ class LLMProviderBase(ABC):
         """
         pass
 
+    async def achat(self, messages: list[dict], executor: Optional[Executor] = None) -> tuple[str, dict]:
+        """
+        Variante assíncrona de ``chat``. A chamada HTTP roda em uma thread do
+        executor, reaproveitando o pool keep-alive da Session.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, self.chat, messages)
+
     @abstractmethod
     def check_vision_support(self, text_only: bool = False) -> None:
         pass
+from concurrent.futures import Executor, ThreadPoolExecutor
 from typing import Iterator, Optional
 
 import logging
-from common import post_json_with_retries
+from common import make_http_session, post_json_with_retries
 
 
 # Alias para compatibilidade retroativa
 LLMProvider = LLMProviderBase
 
 
+async def achat_many(provider, message_lists: list, max_concurrency: int = 4) -> list[tuple[str, dict]]:
+    """
+    Envia várias conversas com no máximo ``max_concurrency`` em voo, para
+    servidores com decodificação paralela (OLLAMA_NUM_PARALLEL, batch do LM Studio).
+    Os resultados seguem a ordem de ``message_lists``; o primeiro erro é propagado.
+    Um item pode ser uma função que monta as mensagens: ela só é chamada quando a
+    conversa ganha vaga, então no máximo ``max_concurrency`` payloads ficam em memória.
+    """
+    max_concurrency = max(1, max_concurrency)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    achat = getattr(provider, "achat", None)
+    loop = asyncio.get_running_loop()
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        async def one(messages):
+            async with semaphore:
+                if callable(messages):
+                    messages = messages()
+                if inspect.iscoroutinefunction(achat):
+                    return await achat(messages, executor=executor)
+                # Providers só síncronos (mocks, ILLMProvider)
+                return await loop.run_in_executor(executor, provider.chat, messages)
+
+        return await asyncio.gather(*(one(messages) for messages in message_lists))
+
+
+def chat_many(provider, message_lists: list, max_concurrency: int = 4) -> list[tuple[str, dict]]:
+    """Ponte síncrona para ``achat_many`` (não usar dentro de um event loop ativo)."""
+    return asyncio.run(achat_many(provider, message_lists, max_concurrency))
+
+
+# Texto aceito antes do plano: espaços e, opcionalmente, uma cerca ```json
+_PLAN_LEAD = re.compile(r"\s*(?:```(?:json)?\s*)?")
+_PLAN_LEAD_PREFIX = re.compile(r"\s*(?:`{1,3}|```j|```js|```jso|```json\s*|```\s+)?")
+
+
+class JsonPlanWatcher:
+    """
+    Acompanha o texto recebido em stream e indica quando o objeto/array JSON de
+    nível superior foi fechado, para que o plano possa ser usado sem esperar o
+    fim da conexão. Só acompanha respostas que começam pelo JSON (ou por uma
+    cerca ```json); com texto livre antes, nunca encerra cedo, já que colchetes
+    na prosa não são o plano. Chaves dentro de strings são ignoradas.
+    ``plan()`` recorta do texto acumulado só o JSON (sem a cerca, que ficaria
+    sem o fechamento quando o stream é encerrado cedo).
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.started = False
+        self.closed = False
+        self.disabled = False
+        self.in_string = False
+        self.escaped = False
+        self._lead = ""
+        self._fed = 0
+        self._end = 0
+
+    def feed(self, text: str) -> bool:
+        if self.closed:
+            return True
+        for ch in text:
+            self._fed += 1
+            if self.disabled:
+                return False
+            if not self.started:
+                if ch in "{[" and _PLAN_LEAD.fullmatch(self._lead):
+                    self.started = True
+                    self.depth = 1
+                    continue
+                self._lead += ch
+                self.disabled = not _PLAN_LEAD_PREFIX.fullmatch(self._lead)
+                continue
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+                continue
+            if ch in "{[":
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.closed = True
+                    self._end = self._fed
+                    return True
+            elif ch == '"':
+                self.in_string = True
+        return False
+
+    def plan(self, text: str) -> str:
+        """JSON do plano dentro de ``text`` (tudo o que foi passado a feed); sem plano, o texto."""
+        if not self.closed:
+            return text
+        return text[len(self._lead):self._end]
+
+
+def _stream_meta(started: float, first_token_at: Optional[float], finished: float, tokens: int) -> dict:
+    """Métricas de streaming: tempo até o primeiro token e tokens/s na geração."""
+    meta = {"streamed": True, "ttft_ms": None, "tokens_per_sec": None}
+    if first_token_at is not None:
+        meta["ttft_ms"] = int((first_token_at - started) * 1000)
+        gen_seconds = finished - first_token_at
+        if tokens and gen_seconds > 0:
+            meta["tokens_per_sec"] = round(tokens / gen_seconds, 2)
+    return meta
+
+
 class OllamaProvider(LLMProviderBase):
     def chat(self, messages: list[dict]) -> tuple[str, dict]:
         chat_url = f"{self.url}/api/chat"
         payload = {
             "model": self.model,
             "messages": messages,
-            "stream": False,
+            "stream": self.stream,
         }
         started = time.time()
         logging.info(f"[Ollama] Aguardando resposta do modelo {self.model}...")
         try:
             resp, elapsed_ms = post_json_with_retries(
-                chat_url, payload, timeout=self.timeout, retries=2, retry_delay=2.0, description="Ollama chat"
+                chat_url, payload, timeout=self.timeout, retries=2, retry_delay=2.0,
+                description="Ollama chat", stream=self.stream, session=self.session,
             )
             resp.raise_for_status()
-            data = resp.json()
-            content = data["message"]["content"]
+            if self.stream:
+                content, data, stream_meta = self._consume_stream(resp, started)
+                elapsed_ms = int((time.time() - started) * 1000)
+            else:
+                data = resp.json()
+                content = data["message"]["content"]
+                stream_meta = {}
             meta = {
                 "provider": "ollama",
                 "model": self.model,
@@ -78,6 +213,7 @@ class OllamaProvider(LLMProviderBase):
                 "latency_ms": elapsed_ms,
                 "eval_count": data.get("eval_count"),
                 "eval_duration": data.get("eval_duration"),
+                **stream_meta,
             }
             logging.info(f"[Ollama] Status: {resp.status_code}, Time: {elapsed_ms}ms")
             return content, meta
@@ -91,6 +227,47 @@ class OllamaProvider(LLMProviderBase):
             })
             raise LLMProviderError(f"[Ollama] Erro na chamada ao modelo: {e}") from e
 
+    def _consume_stream(self, resp, started: float) -> tuple[str, dict, dict]:
+        """Lê o NDJSON do /api/chat; encerra assim que o plano JSON fecha."""
+        parts: list[str] = []
+        watcher = JsonPlanWatcher()
+        first_token_at = None
+        tokens = 0
+        final: dict = {}
+        stopped_early = False
+        try:
+            for line in resp.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("error"):
+                    raise LLMProviderError(f"[Ollama] Erro no stream: {chunk['error']}")
+                piece = (chunk.get("message") or {}).get("content") or ""
+                if piece:
+                    if first_token_at is None:
+                        first_token_at = time.time()
+                    tokens += 1
+                    parts.append(piece)
+                    if watcher.feed(piece):
+                        stopped_early = not chunk.get("done")
+                        break
+                if chunk.get("done"):
+                    final = chunk
+                    break
+        finally:
+            # Fechar a conexão cedo faz o Ollama interromper a geração restante
+            resp.close()
+
+        finished = time.time()
+        stream_meta = _stream_meta(started, first_token_at, finished, tokens)
+        stream_meta["stopped_early"] = stopped_early
+        if final.get("eval_count") and final.get("eval_duration"):
+            stream_meta["tokens_per_sec"] = round(final["eval_count"] / (final["eval_duration"] / 1e9), 2)
+        logging.info(
+            f"[Ollama] Stream: TTFT {stream_meta['ttft_ms']}ms, {stream_meta['tokens_per_sec']} tokens/s"
+        )
+        return watcher.plan("".join(parts)), final, stream_meta
+
     def check_vision_support(self, text_only: bool = False) -> None:
         if text_only:
             return
@@ -101,7 +278,7 @@ class OllamaProvider(LLMProviderBase):
     def download_model(self, model: str) -> Iterator[str]:
         pull_url = f"{self.url}/api/pull"
         try:
-            resp = requests.post(pull_url, json={"model": model}, stream=True, timeout=10)
+            resp = self.session.post(pull_url, json={"model": model}, stream=True, timeout=10)
             resp.raise_for_status()
             for line in resp.iter_lines():
                 if not line:
@@ -138,23 +315,31 @@ class OpenAICompatProvider(LLMProviderBase):
         payload = {
             "model": self.model,
             "messages": messages,
-            "stream": False,
+            "stream": self.stream,
         }
         started = time.time()
         try:
             resp, elapsed_ms = post_json_with_retries(
-                endpoint, payload, timeout=self.timeout, retries=2, retry_delay=2.0, description="OpenAICompat chat"
+                endpoint, payload, timeout=self.timeout, retries=2, retry_delay=2.0,
+                description="OpenAICompat chat", stream=self.stream, session=self.session,
             )
             resp.raise_for_status()
-            data = resp.json()
-            content = data["choices"][0]["message"]["content"]
+            if self.stream:
+                content, usage, stream_meta = self._consume_stream(resp, started)
+                elapsed_ms = int((time.time() - started) * 1000)
+            else:
+                data = resp.json()
+                content = data["choices"][0]["message"]["content"]
+                usage = data.get("usage")
+                stream_meta = {}
             meta = {
                 "provider": "openai-compat",
                 "model": self.model,
                 "url": self.url,
                 "status_code": resp.status_code,
                 "latency_ms": elapsed_ms,
-                "usage": data.get("usage"),
+                "usage": usage,
+                **stream_meta,
             }
             logging.info(f"[OpenAICompat] Status: {resp.status_code}, Time: {elapsed_ms}ms")
             return content, meta
@@ -168,5 +353,44 @@ class OpenAICompatProvider(LLMProviderBase):
             })
             raise LLMProviderError(f"[OpenAICompat] Erro na chamada ao modelo: {e}") from e
 
+    def _consume_stream(self, resp, started: float) -> tuple[str, Optional[dict], dict]:
+        """Lê os eventos SSE (``data: {...}``); encerra assim que o plano JSON fecha."""
+        parts: list[str] = []
+        watcher = JsonPlanWatcher()
+        first_token_at = None
+        tokens = 0
+        usage = None
+        stopped_early = False
+        try:
+            for line in resp.iter_lines():
+                if not line or not line.startswith(b"data:"):
+                    continue
+                data = line[len(b"data:"):].strip()
+                if data == b"[DONE]":
+                    break
+                chunk = json.loads(data)
+                usage = chunk.get("usage") or usage
+                choices = chunk.get("choices") or [{}]
+                piece = (choices[0].get("delta") or {}).get("content") or ""
+                if piece:
+                    if first_token_at is None:
+                        first_token_at = time.time()
+                    tokens += 1
+                    parts.append(piece)
+                    if watcher.feed(piece):
+                        stopped_early = choices[0].get("finish_reason") is None
+                        break
+        finally:
+            resp.close()
+
+        if usage and usage.get("completion_tokens"):
+            tokens = usage["completion_tokens"]
+        stream_meta = _stream_meta(started, first_token_at, time.time(), tokens)
+        stream_meta["stopped_early"] = stopped_early
+        logging.info(
+            f"[OpenAICompat] Stream: TTFT {stream_meta['ttft_ms']}ms, {stream_meta['tokens_per_sec']} tokens/s"
+        )
+        return watcher.plan("".join(parts)), usage, stream_meta
+
     def check_vision_support(self, text_only: bool = False) -> None:
         pass
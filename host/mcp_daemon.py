@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Daemon MCP: mantém um único servidor Lua (dt_mcp_server.lua) inicializado e o
+expõe por um socket Unix, para que hosts e GUI não paguem a detecção de paths,
+montagem de AppImage e inicialização da libdarktable a cada ação.
+
+Cada conexão fala o mesmo JSON-RPC por linhas do stdio. Os ids dos clientes são
+remapeados para o servidor Lua via McpClient; ``initialize`` é respondido com o
+resultado guardado na inicialização do daemon.
+
+Uso:
+    python host/mcp_daemon.py [--socket PATH]
+    python host/mcp_daemon.py --stop
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import stat
+import sys
+import threading
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from common import (
+    DAEMON_SOCKET_PATH,
+    DT_SERVER_CMD,
+    McpClient,
+    _find_appimage,
+    ensure_private_dir,
+    find_running_daemon,
+    setup_logging,
+)
+
+PROTOCOL_VERSION = "2024-11-05"
+CLIENT_INFO = {"name": "darktable-mcp-daemon", "version": "0.3.0"}
+SHUTDOWN_METHOD = "daemon/shutdown"
+
+
+class _ConnectionHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        server: McpDaemonServer = self.server  # type: ignore[assignment]
+        write_lock = threading.Lock()
+
+        def reply(payload: dict) -> None:
+            data = (json.dumps(payload) + "\n").encode("utf-8")
+            with write_lock:
+                try:
+                    self.wfile.write(data)
+                    self.wfile.flush()
+                except OSError:
+                    pass  # cliente desconectou antes da resposta
+
+        for raw in self.rfile:
+            line = raw.decode("utf-8").strip()
+            if not line:
+                continue
+            try:
+                req = json.loads(line)
+            except json.JSONDecodeError as exc:
+                reply({"jsonrpc": "2.0", "id": None, "error": {"code": -32700, "message": f"Parse error: {exc}"}})
+                continue
+            server.dispatch(req, reply)
+
+
+class McpDaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: Path, upstream: McpClient, init_result: dict):
+        self.socket_path = socket_path
+        self.upstream = upstream
+        self.init_result = init_result
+        # umask antes do bind: o socket já nasce 0600, sem janela com permissão aberta
+        previous_umask = os.umask(0o177)
+        try:
+            super().__init__(str(socket_path), _ConnectionHandler)
+        finally:
+            os.umask(previous_umask)
+
+    def dispatch(self, req: dict, reply) -> None:
+        req_id = req.get("id")
+        method = req.get("method")
+        if method == "initialize":
+            reply({"jsonrpc": "2.0", "id": req_id, "result": self.init_result})
+            return
+        if method == SHUTDOWN_METHOD:
+            reply({"jsonrpc": "2.0", "id": req_id, "result": {"ok": True}})
+            threading.Thread(target=self.shutdown, daemon=True).start()
+            return
+        if req_id is None:
+            return  # notificações não são repassadas
+
+        try:
+            future = self.upstream.request_async(method, req.get("params"))
+        except RuntimeError as exc:
+            reply({"jsonrpc": "2.0", "id": req_id, "error": {"code": -32603, "message": str(exc)}})
+            return
+
+        def done(fut):
+            exc = fut.exception()
+            if exc is None:
+                reply({"jsonrpc": "2.0", "id": req_id, "result": fut.result()})
+                return
+            error = exc.args[0] if exc.args and isinstance(exc.args[0], dict) else {
+                "code": -32603, "message": str(exc)
+            }
+            reply({"jsonrpc": "2.0", "id": req_id, "error": error})
+
+        future.add_done_callback(done)
+
+
+def _pump_stderr(client: McpClient) -> None:
+    """Consome o stderr do Lua continuamente (um pipe cheio travaria o servidor)."""
+    stream = client.proc.stderr if client.proc else None
+    if stream is None:
+        return
+    for line in stream:
+        logging.info(f"[lua] {line.rstrip()}")
+
+
+def _socket_accepts(socket_path: Path) -> bool:
+    """True se algum processo aceita conexões no socket (mesmo de outro usuário)."""
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.settimeout(0.5)
+        probe.connect(str(socket_path))
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+
+def serve(socket_path: Path) -> int:
+    if find_running_daemon(socket_path):
+        print(f"[daemon] Já existe um daemon em {socket_path}")
+        return 1
+    try:
+        if socket_path.parent == DAEMON_SOCKET_PATH.parent:
+            ensure_private_dir(socket_path.parent)
+        else:
+            socket_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    except (OSError, RuntimeError) as exc:
+        print(f"[daemon] Diretório do socket inseguro ou inacessível: {exc}")
+        return 1
+    try:
+        st = os.lstat(socket_path)
+    except FileNotFoundError:
+        st = None
+    if st is not None:
+        # Só remove um socket órfão; qualquer outro arquivo no caminho é erro do usuário
+        if not stat.S_ISSOCK(st.st_mode):
+            print(f"[daemon] {socket_path} existe e não é um socket; escolha outro caminho")
+            return 1
+        if _socket_accepts(socket_path):
+            print(f"[daemon] {socket_path} já está em uso por outro processo")
+            return 1
+        socket_path.unlink()  # socket órfão de uma execução anterior
+
+    upstream = McpClient(DT_SERVER_CMD, PROTOCOL_VERSION, CLIENT_INFO, appimage_path=_find_appimage())
+    with upstream:
+        # Respostas lentas (export) não devem derrubar a inicialização
+        upstream.response_timeout = max(upstream.response_timeout, 120.0)
+        init_result = upstream.initialize()
+        threading.Thread(target=_pump_stderr, args=(upstream,), daemon=True).start()
+
+        server = McpDaemonServer(socket_path, upstream, init_result)
+
+        def watch_upstream():
+            upstream.proc.wait()
+            logging.error("[daemon] Servidor Lua encerrou; finalizando daemon")
+            server.shutdown()
+
+        threading.Thread(target=watch_upstream, daemon=True).start()
+        signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown, daemon=True).start())
+
+        print(f"[daemon] Servidor MCP pronto em {socket_path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            try:
+                socket_path.unlink()
+            except FileNotFoundError:
+                pass
+    return 0
+
+
+def stop(socket_path: Path) -> int:
+    if not find_running_daemon(socket_path):
+        print(f"[daemon] Nenhum daemon em {socket_path}")
+        return 1
+    with McpClient([], PROTOCOL_VERSION, CLIENT_INFO, socket_path=str(socket_path)) as client:
+        client.request(SHUTDOWN_METHOD)
+    print("[daemon] Daemon encerrado")
+    return 0
+
+
+def main():
+    p = argparse.ArgumentParser(description="Daemon MCP darktable via socket Unix")
+    p.add_argument(
+        "--socket",
+        default=os.environ.get("DT_MCP_SOCKET") or str(DAEMON_SOCKET_PATH),
+        help="Caminho do socket Unix",
+    )
+    p.add_argument("--stop", action="store_true", help="Encerra o daemon em execução")
+    p.add_argument("--verbose", action="store_true")
+    args = p.parse_args()
+
+    setup_logging(args.verbose)
+    socket_path = Path(args.socket)
+    sys.exit(stop(socket_path) if args.stop else serve(socket_path))
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,7 @@ from __future__ import annotations
 from host.i18n import i18n
 
 import re
+import signal
 import subprocess
 import sys
 import threading
@@ -45,7 +46,7 @@ from PySide6.QtWidgets import (
     QSpinBox,
 )
 
-from common import probe_darktable_state
+from common import parse_progress_line, probe_darktable_state
 from interactive_cli import DEFAULT_LIMIT, DEFAULT_MIN_RATING, RunConfig
 from mcp_host_ollama import (
     APP_VERSION as HOST_APP_VERSION,
@@ -173,6 +174,7 @@ class MCPGui(QMainWindow):
         self._apply_window_icon()
         self._current_thread: Optional[threading.Thread] = None
         self._stop_requested = False
+        self._current_proc: Optional[subprocess.Popen] = None
         self._current_image_path: Optional[Path] = None
         self._current_pixmap: Optional[QPixmap] = None
         self._image_path_pattern = re.compile(
@@ -181,13 +183,14 @@ class MCPGui(QMainWindow):
         )
 
         # Fábricas para injeção de dependências (testes/mocks)
-        from common import McpClient, DT_SERVER_CMD
+        from common import McpClient, DT_SERVER_CMD, find_running_daemon
         from mcp_host_ollama import OLLAMA_MODEL, OLLAMA_URL, PROTOCOL_VERSION as MCP_PROTOCOL_VERSION
         self._mcp_client_factory = mcp_client_factory or (
             lambda: McpClient(
                 DT_SERVER_CMD,
                 MCP_PROTOCOL_VERSION,
                 GUI_CLIENT_INFO,
+                socket_path=find_running_daemon(),
             )
         )
         # LLMProvider será injetado em patch posterior
@@ -1385,6 +1388,17 @@ class MCPGui(QMainWindow):
             self._stop_requested = True
             self._append_log("[sistema] Interrupção solicitada. Aguardando conclusão da operação atual...")
             self.status_signal.emit("Interrupção solicitada...")
+            self._interrupt_host()
+
+    def _interrupt_host(self) -> None:
+        """Ctrl+C no host em execução (cancela o job de export no servidor), sem esperar saída."""
+        proc = self._current_proc
+        if proc is None or proc.poll() is not None:
+            return
+        try:
+            proc.send_signal(signal.SIGINT)
+        except (OSError, ValueError) as exc:
+            self._append_log(f"[sistema] Falha ao interromper o host: {exc}")
 
     def _append_log(self, text: str) -> None:
         self.log_signal.emit(text)
@@ -1496,12 +1510,26 @@ class MCPGui(QMainWindow):
                     text=True,
                 )
                 assert proc.stdout is not None
+                self._current_proc = proc
+                if self._stop_requested:
+                    # Parar antes do processo existir
+                    self._interrupt_host()
 
-                for line in proc.stdout:
-                    self._append_log(line.rstrip())
+                try:
+                    for line in proc.stdout:
+                        progress = parse_progress_line(line.rstrip())
+                        if progress:
+                            self.progress_update_signal.emit(*progress)
+                            continue
+                        self._append_log(line.rstrip())
+                    ret = proc.wait()
+                finally:
+                    self._current_proc = None
 
-                ret = proc.wait()
                 if ret != 0:
+                    if self._stop_requested:
+                        self._append_log(f"Execução interrompida pelo usuário (código {ret}).")
+                        return
                     raise RuntimeError(f"Processo retornou código de erro {ret}")
             except (PromptValidationError, LLMProviderError) as exc:
                 self.error_signal.emit(str(exc))
@@ -11,6 +11,7 @@ sys.path.append(str(Path(__file__).parent))
 from common import (
     DT_SERVER_CMD,
     McpClient,
+    find_running_daemon,
     check_dependencies,
     probe_darktable_state,
     list_available_collections,
@@ -46,15 +47,33 @@ def parse_args():
     p.add_argument("--dry-run", action="store_true")
     p.add_argument("--limit", type=int, default=200)
     p.add_argument("--target-dir", help="Para export")
+    p.add_argument("--export-parallel", type=int, help="Processos darktable-cli simultâneos no export (padrão: metade dos núcleos)")
+    p.add_argument("--export-batch", type=int, help="Imagens por invocação do darktable-cli no export (1 = uma por processo; padrão 16)")
     
     # LLM
     p.add_argument("--model", help="Modelo LM Studio", default="local-model")
     p.add_argument("--lm-url", default=DEFAULT_LM_URL)
     p.add_argument("--timeout", type=float, default=60.0)
     p.add_argument("--text-only", action="store_true")
+    p.add_argument("--stream", action="store_true", help="Consome a resposta do LLM em stream (TTFT e tokens/s nos logs)")
     p.add_argument("--prompt-file")
     p.add_argument("--prompt-variant", default="basico")
-    p.add_argument("--max-payload-mb", type=float, default=12.0, help="Limite máximo do payload enviado ao LLM")
+    p.add_argument("--max-payload-mb", type=float, default=12.0, help="Limite máximo de cada requisição ao LLM (lotes maiores são divididos)")
+    p.add_argument("--max-inflight", type=int, default=1, help="Sub-lotes enviados ao LLM em paralelo")
+    p.add_argument(
+        "--prep-backend",
+        choices=["thread", "process"],
+        default="process",
+        help="Pool usado para preparar as imagens (process evita o GIL do Pillow)",
+    )
+    p.add_argument("--prep-workers", type=int, help="Workers da preparação de imagens (padrão: nº de CPUs)")
+    p.add_argument(
+        "--dedupe-threshold",
+        type=int,
+        default=0,
+        help="Agrupa quadros de rajada cujo hash perceptual difere em até N bits (de 64) e envia só um por grupo (0 = desligado; 6 é um bom início)",
+    )
+    p.add_argument("--dedupe-best", action="store_true", help="Representante de cada grupo é o quadro mais nítido, não o primeiro")
     
     # Utils
     p.add_argument("--check-deps", action="store_true")
@@ -85,10 +104,10 @@ def main():
         return
 
     # Provider OpenAI/LMStudio
-    provider = OpenAICompatProvider(args.lm_url, args.model, args.timeout)
+    provider = OpenAICompatProvider(args.lm_url, args.model, args.timeout, stream=args.stream)
 
     try:
-        with McpClient(DT_SERVER_CMD, PROTOCOL_VERSION, CLIENT_INFO) as client:
+        with McpClient(DT_SERVER_CMD, PROTOCOL_VERSION, CLIENT_INFO, socket_path=find_running_daemon()) as client:
             client.initialize()
             
             if args.list_collections:
@@ -103,6 +122,8 @@ def main():
     except Exception as e:
         print(f"Erro fatal: {e}")
         sys.exit(1)
+    finally:
+        provider.close()
 
 if __name__ == "__main__":
     main()
@@ -11,6 +11,7 @@ sys.path.append(str(Path(__file__).parent))
 from common import (
     DT_SERVER_CMD,
     McpClient,
+    find_running_daemon,
     check_dependencies,
     probe_darktable_state,
     list_available_collections,
@@ -46,15 +47,33 @@ def parse_args():
     p.add_argument("--dry-run", action="store_true")
     p.add_argument("--limit", type=int, default=200)
     p.add_argument("--target-dir", help="Para export")
+    p.add_argument("--export-parallel", type=int, help="Processos darktable-cli simultâneos no export (padrão: metade dos núcleos)")
+    p.add_argument("--export-batch", type=int, help="Imagens por invocação do darktable-cli no export (1 = uma por processo; padrão 16)")
     
     # LLM
     p.add_argument("--model", help="Modelo Ollama")
     p.add_argument("--ollama-url", default=DEFAULT_OLLAMA_URL)
     p.add_argument("--timeout", type=float, default=600.0)
     p.add_argument("--text-only", action="store_true")
+    p.add_argument("--stream", action="store_true", help="Consome a resposta do LLM em stream (TTFT e tokens/s nos logs)")
     p.add_argument("--prompt-file")
     p.add_argument("--prompt-variant", default="basico")
-    p.add_argument("--max-payload-mb", type=float, default=12.0, help="Limite máximo do payload enviado ao LLM")
+    p.add_argument("--max-payload-mb", type=float, default=12.0, help="Limite máximo de cada requisição ao LLM (lotes maiores são divididos)")
+    p.add_argument("--max-inflight", type=int, default=1, help="Sub-lotes enviados ao LLM em paralelo")
+    p.add_argument(
+        "--prep-backend",
+        choices=["thread", "process"],
+        default="process",
+        help="Pool usado para preparar as imagens (process evita o GIL do Pillow)",
+    )
+    p.add_argument("--prep-workers", type=int, help="Workers da preparação de imagens (padrão: nº de CPUs)")
+    p.add_argument(
+        "--dedupe-threshold",
+        type=int,
+        default=0,
+        help="Agrupa quadros de rajada cujo hash perceptual difere em até N bits (de 64) e envia só um por grupo (0 = desligado; 6 é um bom início)",
+    )
+    p.add_argument("--dedupe-best", action="store_true", help="Representante de cada grupo é o quadro mais nítido, não o primeiro")
     
     # Utils
     p.add_argument("--check-deps", action="store_true")
@@ -91,7 +110,7 @@ def main():
         return
 
     # 2. Setup Provider
-    provider = OllamaProvider(args.ollama_url, args.model or "qwen2.5vl:7b", args.timeout)
+    provider = OllamaProvider(args.ollama_url, args.model or "qwen2.5vl:7b", args.timeout, stream=args.stream)
     
     if args.download_model:
         print(f"Baixando {args.download_model}...")
@@ -106,7 +125,10 @@ def main():
         if appimage:
             print(f"[ollama-host] Usando AppImage: {appimage}")
 
-        with McpClient(DT_SERVER_CMD, PROTOCOL_VERSION, CLIENT_INFO, appimage_path=appimage) as client:
+        with McpClient(
+            DT_SERVER_CMD, PROTOCOL_VERSION, CLIENT_INFO,
+            appimage_path=appimage, socket_path=find_running_daemon(),
+        ) as client:
             client.initialize()
             
             if args.list_collections:
@@ -121,6 +143,8 @@ def main():
     except Exception as e:
         print(f"Erro fatal: {e}")
         sys.exit(1)
+    finally:
+        provider.close()
 
 if __name__ == "__main__":
     main()
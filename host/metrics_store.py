@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Métricas dos modos do host em JSONL append-only (logs/metrics.jsonl).
+
+Cada métrica é uma linha JSON. O ``MetricsWriter`` acumula as linhas em memória
+e as grava com um único ``write`` em modo append (flush por quantidade, por
+tempo e na saída do processo), então hosts concorrentes não se sobrescrevem.
+Entradas mais antigas que ``retention_days`` são descartadas sob ``flock`` (sem
+perder linhas de outro processo) quando a primeira linha do arquivo passa da
+retenção com folga de ``METRICS_COMPACT_SLACK_DAYS`` ou quando o arquivo cresceu
+``compact_bytes`` desde a última compactação (tamanho guardado em
+``metrics.jsonl.compacted``), então cada compactação é paga por dados novos.
+
+Uso:
+    python host/metrics_store.py [--days N]   # resumo por modo
+"""
+from __future__ import annotations
+
+import argparse
+import atexit
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Optional
+
+sys.path.append(str(Path(__file__).parent))
+
+from common import LOG_DIR, locked_file
+
+METRICS_PATH = LOG_DIR / "metrics.jsonl"
+LEGACY_METRICS_PATH = LOG_DIR / "metrics.json"
+METRICS_FLUSH_EVERY = 32
+METRICS_FLUSH_SECONDS = 5.0
+METRICS_COMPACT_BYTES = 16 * 1024 * 1024
+METRICS_RETENTION_DAYS = 180
+METRICS_COMPACT_SLACK_DAYS = 1
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+def _parse_timestamp(value) -> Optional[float]:
+    try:
+        return time.mktime(time.strptime(value, TIMESTAMP_FORMAT))
+    except (TypeError, ValueError):
+        return None
+
+
+def read_metrics(path: Path = METRICS_PATH) -> Iterable[dict]:
+    """Itera as entradas gravadas, ignorando linhas corrompidas."""
+    try:
+        f = open(path, "r", encoding="utf-8")
+    except FileNotFoundError:
+        return
+    with f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+class MetricsWriter:
+    def __init__(
+        self,
+        path: Path = METRICS_PATH,
+        flush_every: int = METRICS_FLUSH_EVERY,
+        flush_seconds: float = METRICS_FLUSH_SECONDS,
+        compact_bytes: int = METRICS_COMPACT_BYTES,
+        retention_days: float = METRICS_RETENTION_DAYS,
+    ):
+        self.path = Path(path)
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self.compact_bytes = compact_bytes
+        self.retention_days = retention_days
+        self._buffer: list[str] = []
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def record(self, entry: dict) -> None:
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            self._buffer.append(line)
+            due = (
+                len(self._buffer) >= self.flush_every
+                or time.monotonic() - self._last_flush >= self.flush_seconds
+            )
+        if due:
+            self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+            self._last_flush = time.monotonic()
+        if not lines:
+            return
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with locked_file(self.path):
+                self._migrate_legacy()
+                fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, data)
+                finally:
+                    os.close(fd)
+                if self._compaction_due(self.path.stat().st_size):
+                    self._compact()
+        except OSError as e:
+            logging.warning(f"Falha ao gravar métricas: {e}")
+
+    def _migrate_legacy(self) -> None:
+        """Converte o logs/metrics.json antigo (array JSON) uma única vez."""
+        legacy = self.path.with_name(LEGACY_METRICS_PATH.name)
+        if not legacy.exists() or self.path.exists():
+            return
+        try:
+            entries = json.loads(legacy.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            entries = []
+        if isinstance(entries, list) and entries:
+            lines = "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in entries if isinstance(e, dict))
+            self.path.write_text(lines, encoding="utf-8")
+        legacy.rename(legacy.with_suffix(".json.migrated"))
+
+    @property
+    def _compacted_path(self) -> Path:
+        return self.path.with_name(self.path.name + ".compacted")
+
+    def _compaction_due(self, size: int) -> bool:
+        """Crescimento desde a última compactação ou primeira entrada vencida (com o lock)."""
+        try:
+            base = int(self._compacted_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            base = 0
+        if size - base > self.compact_bytes:
+            return True
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                oldest = _parse_timestamp(json.loads(f.readline()).get("timestamp"))
+        except (OSError, ValueError, AttributeError):
+            return False
+        slack = (self.retention_days + METRICS_COMPACT_SLACK_DAYS) * 86400
+        return oldest is not None and oldest < time.time() - slack
+
+    def _compact(self) -> None:
+        """Reescreve o arquivo sem as entradas fora da retenção (chamado com o lock)."""
+        cutoff = time.time() - self.retention_days * 86400
+        kept = [
+            e for e in read_metrics(self.path)
+            if (_parse_timestamp(e.get("timestamp")) or cutoff) >= cutoff
+        ]
+        tmp = self.path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            for e in kept:
+                f.write(json.dumps(e, ensure_ascii=False) + "\n")
+        os.replace(tmp, self.path)
+        self._compacted_path.write_text(str(self.path.stat().st_size), encoding="utf-8")
+
+
+_writer: Optional[MetricsWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_metrics_writer() -> MetricsWriter:
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = MetricsWriter(Path(os.environ.get("DT_MCP_METRICS_PATH") or METRICS_PATH))
+            atexit.register(_writer.flush)
+    return _writer
+
+
+def record_metric(mode: str, success: bool, duration: float, extra: Optional[dict] = None) -> None:
+    entry = {
+        "timestamp": time.strftime(TIMESTAMP_FORMAT),
+        "mode": mode,
+        "success": success,
+        "duration": round(duration, 3),
+    }
+    if extra:
+        entry.update(extra)
+    get_metrics_writer().record(entry)
+
+
+def _percentile(values: list[float], q: float) -> Optional[float]:
+    """Percentil com interpolação linear (values já ordenado)."""
+    if not values:
+        return None
+    pos = (len(values) - 1) * q
+    low = int(pos)
+    high = min(low + 1, len(values) - 1)
+    return round(values[low] + (values[high] - values[low]) * (pos - low), 3)
+
+
+def summarize_metrics(entries: Optional[Iterable[dict]] = None, since: Optional[float] = None) -> dict:
+    """
+    Agrega por modo: total, taxa de sucesso e percentis (p50/p90/p99) de duração.
+    ``since`` (epoch) filtra pelo timestamp; sem ``entries``, lê o arquivo padrão.
+    """
+    if entries is None:
+        get_metrics_writer().flush()
+        entries = read_metrics(get_metrics_writer().path)
+
+    by_mode: dict[str, dict] = {}
+    for e in entries:
+        if since is not None and (_parse_timestamp(e.get("timestamp")) or 0) < since:
+            continue
+        stats = by_mode.setdefault(e.get("mode", "?"), {"count": 0, "ok": 0, "durations": []})
+        stats["count"] += 1
+        stats["ok"] += 1 if e.get("success") else 0
+        if isinstance(e.get("duration"), (int, float)):
+            stats["durations"].append(float(e["duration"]))
+
+    summary = {}
+    for mode, stats in sorted(by_mode.items()):
+        durations = sorted(stats["durations"])
+        summary[mode] = {
+            "count": stats["count"],
+            "success_rate": round(stats["ok"] / stats["count"], 3),
+            "p50": _percentile(durations, 0.5),
+            "p90": _percentile(durations, 0.9),
+            "p99": _percentile(durations, 0.99),
+        }
+    return summary
+
+
+def main():
+    p = argparse.ArgumentParser(description="Resumo das métricas dos hosts")
+    p.add_argument("--days", type=float, help="Só os últimos N dias")
+    args = p.parse_args()
+
+    since = time.time() - args.days * 86400 if args.days else None
+    summary = summarize_metrics(since=since)
+    if not summary:
+        print("[metrics] Nenhuma métrica registrada")
+        return
+    print(f"{'modo':<12} {'n':>6} {'sucesso':>8} {'p50':>8} {'p90':>8} {'p99':>8}")
+    for mode, s in summary.items():
+        cells = [f"{s[k]:.3f}" if s[k] is not None else "-" for k in ("p50", "p90", "p99")]
+        print(f"{mode:<12} {s['count']:>6} {s['success_rate']:>8.1%} " + " ".join(f"{c:>8}" for c in cells))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+Extração do JPEG de preview embutido em arquivos RAW.
+
+A maioria dos RAWs (CR2, NEF, ARW, DNG, ORF, PEF...) é um container TIFF cujos
+IFDs apontam para uma ou mais prévias JPEG; o RAF da Fuji guarda o offset do
+JPEG no próprio cabeçalho. Aqui lemos apenas os cabeçalhos/IFDs e os bytes do
+preview escolhido, sem binários externos e sem carregar o RAW inteiro.
+"""
+from __future__ import annotations
+
+import struct
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+RAW_EXTENSIONS = {
+    ".cr2", ".nef", ".nrw", ".arw", ".srf", ".sr2", ".dng", ".raf",
+    ".orf", ".pef", ".rw2", ".3fr", ".erf", ".kdc", ".mef", ".mos", ".iiq",
+}
+
+# Tags TIFF relevantes
+_TAG_COMPRESSION = 0x0103
+_TAG_STRIP_OFFSETS = 0x0111
+_TAG_ORIENTATION = 0x0112
+_TAG_STRIP_BYTE_COUNTS = 0x0117
+_TAG_SUB_IFDS = 0x014A
+_TAG_JPEG_OFFSET = 0x0201
+_TAG_JPEG_LENGTH = 0x0202
+_TAG_EXIF_IFD = 0x8769
+
+# tipo TIFF -> (formato struct, tamanho)
+_TYPE_FORMATS = {1: ("B", 1), 3: ("H", 2), 4: ("I", 4), 7: ("B", 1), 9: ("i", 4), 13: ("I", 4)}
+
+# Magics de TIFF e variantes (ORF: "RO"/"SR", RW2: 0x55)
+_TIFF_MAGICS = {42, 0x4F52, 0x5352, 0x55}
+
+# SOF aceitos pelo Pillow (baseline, extended, progressive); exclui JPEG lossless
+_DECODABLE_SOF = {0xC0, 0xC1, 0xC2}
+
+_MAX_IFDS = 32
+_MAX_ENTRIES = 512
+_SOF_SCAN_BYTES = 64 * 1024
+
+
+@dataclass
+class RawPreview:
+    data: bytes
+    width: int
+    height: int
+    # None: orientação no EXIF do próprio JPEG (RAF), lida ao decodificar
+    orientation: Optional[int] = 1
+
+
+def is_raw_file(path: Path) -> bool:
+    return path.suffix.lower() in RAW_EXTENSIONS
+
+
+def _jpeg_dimensions(head: bytes) -> Optional[tuple[int, int]]:
+    """Lê (largura, altura) do segmento SOF; None se não for JPEG decodificável."""
+    if not head.startswith(b"\xff\xd8"):
+        return None
+    pos = 2
+    while pos + 4 <= len(head):
+        if head[pos] != 0xFF:
+            return None
+        marker = head[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            pos += 2
+            continue
+        (seg_len,) = struct.unpack(">H", head[pos + 2:pos + 4])
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            if marker not in _DECODABLE_SOF or pos + 9 > len(head):
+                return None
+            height, width = struct.unpack(">HH", head[pos + 5:pos + 9])
+            return width, height
+        pos += 2 + seg_len
+    return None
+
+
+class _TiffReader:
+    def __init__(self, fh: BinaryIO, base: int = 0):
+        self.fh = fh
+        self.base = base
+        fh.seek(base)
+        header = fh.read(8)
+        if len(header) < 8 or header[:2] not in (b"II", b"MM"):
+            raise ValueError("cabeçalho TIFF inválido")
+        self.endian = "<" if header[:2] == b"II" else ">"
+        magic, self.first_ifd = struct.unpack(self.endian + "HI", header[2:8])
+        if magic not in _TIFF_MAGICS:
+            raise ValueError(f"magic TIFF desconhecido: {magic:#x}")
+
+    def _read(self, offset: int, size: int) -> bytes:
+        self.fh.seek(self.base + offset)
+        return self.fh.read(size)
+
+    def read_ifd(self, offset: int) -> tuple[dict[int, list[int]], int]:
+        """Retorna ({tag: valores inteiros}, offset do próximo IFD)."""
+        raw_count = self._read(offset, 2)
+        if len(raw_count) < 2:
+            return {}, 0
+        (count,) = struct.unpack(self.endian + "H", raw_count)
+        count = min(count, _MAX_ENTRIES)
+        block = self._read(offset + 2, count * 12 + 4)
+        entries: dict[int, list[int]] = {}
+        for i in range(count):
+            entry = block[i * 12:(i + 1) * 12]
+            if len(entry) < 12:
+                break
+            tag, typ, n = struct.unpack(self.endian + "HHI", entry[:8])
+            fmt = _TYPE_FORMATS.get(typ)
+            if not fmt or n == 0 or n > 1024:
+                continue
+            size = fmt[1] * n
+            payload = entry[8:8 + size] if size <= 4 else None
+            if payload is None:
+                (value_offset,) = struct.unpack(self.endian + "I", entry[8:12])
+                payload = self._read(value_offset, size)
+            if len(payload) < size:
+                continue
+            entries[tag] = list(struct.unpack(f"{self.endian}{n}{fmt[0]}", payload[:size]))
+        next_ifd = 0
+        tail = block[count * 12:count * 12 + 4]
+        if len(tail) == 4:
+            (next_ifd,) = struct.unpack(self.endian + "I", tail)
+        return entries, next_ifd
+
+    def candidates(self) -> tuple[list[tuple[int, int]], int]:
+        """Percorre IFD0→IFDn, SubIFDs e EXIF; retorna ([(offset, tamanho)], orientação)."""
+        found: list[tuple[int, int]] = []
+        orientation = 1
+        queue = [self.first_ifd]
+        visited: set[int] = set()
+        while queue and len(visited) < _MAX_IFDS:
+            offset = queue.pop(0)
+            if not offset or offset in visited:
+                continue
+            visited.add(offset)
+            entries, next_ifd = self.read_ifd(offset)
+            if offset == self.first_ifd and _TAG_ORIENTATION in entries:
+                orientation = entries[_TAG_ORIENTATION][0]
+
+            if _TAG_JPEG_OFFSET in entries and _TAG_JPEG_LENGTH in entries:
+                found.append((entries[_TAG_JPEG_OFFSET][0], entries[_TAG_JPEG_LENGTH][0]))
+            compression = entries.get(_TAG_COMPRESSION, [0])[0]
+            strips = entries.get(_TAG_STRIP_OFFSETS, [])
+            counts = entries.get(_TAG_STRIP_BYTE_COUNTS, [])
+            if compression in (6, 7) and len(strips) == 1 and len(counts) == 1:
+                found.append((strips[0], counts[0]))
+
+            queue.extend(entries.get(_TAG_SUB_IFDS, []))
+            queue.extend(entries.get(_TAG_EXIF_IFD, []))
+            queue.append(next_ifd)
+        return found, orientation
+
+
+def _select(fh: BinaryIO, base: int, spans: list[tuple[int, int]], max_dimension: int,
+            orientation: Optional[int]) -> Optional[RawPreview]:
+    """Escolhe o menor preview que cubra max_dimension (ou o maior disponível)."""
+    measured = []
+    for offset, length in set(spans):
+        if length < 4:
+            continue
+        fh.seek(base + offset)
+        dims = _jpeg_dimensions(fh.read(min(length, _SOF_SCAN_BYTES)))
+        if dims:
+            measured.append((dims, offset, length))
+    if not measured:
+        return None
+
+    big_enough = [m for m in measured if max(m[0]) >= max_dimension]
+    if big_enough:
+        (width, height), offset, length = min(big_enough, key=lambda m: m[2])
+    else:
+        (width, height), offset, length = max(measured, key=lambda m: m[0][0] * m[0][1])
+
+    fh.seek(base + offset)
+    data = fh.read(length)
+    if len(data) < length:
+        return None
+    return RawPreview(data=data, width=width, height=height, orientation=orientation)
+
+
+def extract_raw_preview(path: Path, max_dimension: int = 1600) -> Optional[RawPreview]:
+    """Extrai o JPEG embutido de um RAW; None se o formato não tiver preview utilizável."""
+    with open(path, "rb") as fh:
+        head = fh.read(96)
+        if head.startswith(b"FUJIFILMCCD-RAW"):
+            if len(head) < 92:
+                return None
+            jpeg_offset, jpeg_length = struct.unpack(">II", head[84:92])
+            # O JPEG do RAF é um arquivo completo com EXIF próprio; a orientação
+            # vem de lá (encode_image_bytes lê o EXIF ao decodificar)
+            return _select(fh, 0, [(jpeg_offset, jpeg_length)], max_dimension, None)
+
+        try:
+            reader = _TiffReader(fh)
+        except (ValueError, struct.error):
+            return None
+        try:
+            spans, orientation = reader.candidates()
+        except struct.error:
+            return None
+        return _select(fh, 0, spans, max_dimension, orientation)
@@ -11,9 +11,16 @@ import json
 import sys
 import time
 
+held = None
 for line in sys.stdin:
     data = json.loads(line)
     method = data.get("method")
+    if method == "later":
+        # Responde só depois da próxima requisição (fora de ordem)
+        held = {"jsonrpc": "2.0", "id": data["id"], "result": {"later": data.get("params")}}
+        continue
+    if method == "exit":
+        sys.exit(0)
     if method == "delay":
         sys.stderr.write("delayed response\\n")
         sys.stderr.flush()
@@ -25,6 +32,9 @@ for line in sys.stdin:
         payload = {"jsonrpc": "2.0", "id": data["id"], "error": {"message": "unknown"}}
 
     sys.stdout.write(json.dumps(payload) + "\\n")
+    if held:
+        sys.stdout.write(json.dumps(held) + "\\n")
+        held = None
     sys.stdout.flush()
 """
 
@@ -82,6 +92,33 @@ class McpClientTests(unittest.TestCase):
 
         self.assertEqual(result["echo"], {"foo": "bar"})
 
+    def test_out_of_order_responses_matched_by_id(self):
+        with self._new_client() as client:
+            later = client.request_async("later", {"n": 1})
+            result = client.request("echo", {"n": 2})
+            self.assertEqual(later.result(timeout=5), {"later": {"n": 1}})
+
+        self.assertEqual(result["echo"], {"n": 2})
+
+    def test_pipelined_requests(self):
+        with self._new_client() as client:
+            futures = [client.request_async("echo", {"i": i}) for i in range(10)]
+            results = [f.result(timeout=5) for f in futures]
+
+        self.assertEqual([r["echo"]["i"] for r in results], list(range(10)))
+
+    def test_request_before_start_leaves_nothing_pending(self):
+        client = self._new_client()
+        with self.assertRaises(RuntimeError):
+            client.request_async("echo")
+        self.assertEqual(client._pending, {})
+
+    def test_pending_requests_fail_when_server_exits(self):
+        with self._new_client() as client:
+            future = client.request_async("exit")
+            with self.assertRaises(RuntimeError):
+                future.result(timeout=5)
+
 
 if __name__ == "__main__":
     unittest.main()
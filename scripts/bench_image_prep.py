@@ -0,0 +1,102 @@
+"""
+Micro-benchmark da preparação de imagens para o LLM.
+
+Compara o caminho antigo (decode completo + thumbnail) com o atual
+(`encode_image_bytes`, que usa draft/reduce do Pillow) em JPEGs sintéticos
+de 6000x4000. Cada medição roda em um processo separado para que o pico de
+memória (ru_maxrss) reflita apenas aquele caminho.
+
+Uso:
+    python scripts/bench_image_prep.py [--images 5] [--max-dimension 1600]
+"""
+import argparse
+import io
+import multiprocessing
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "host"))
+
+from PIL import Image  # noqa: E402
+
+from common import encode_image_bytes  # noqa: E402
+
+
+def make_synthetic_jpeg(path: Path, size=(6000, 4000), seed: int = 0) -> None:
+    # Ruído + gradiente para que o JPEG tenha conteúdo realista (não comprime a nada)
+    noise = Image.effect_noise((size[0] // 8, size[1] // 8), 64 + seed).resize(size)
+    gradient = Image.linear_gradient("L").resize(size)
+    img = Image.merge("RGB", (noise, gradient, noise.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    img.save(path, "JPEG", quality=92)
+
+
+def legacy_encode(path: Path, max_dimension: int) -> bytes:
+    """Reprodução do encoder anterior: decodifica tudo e só depois reduz."""
+    with Image.open(path) as img:
+        img.load()
+        if img.mode in ("RGBA", "P"):
+            img = img.convert("RGB")
+        w, h = img.size
+        if w > max_dimension or h > max_dimension:
+            img.thumbnail((max_dimension, max_dimension), reducing_gap=None)
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=85)
+        return buffer.getvalue()
+
+
+def current_encode(path: Path, max_dimension: int) -> bytes:
+    raw, _ = encode_image_bytes(path, max_dimension, use_cache=False)
+    return raw
+
+
+def _run(variant: str, paths: list, max_dimension: int, queue) -> None:
+    fn = legacy_encode if variant == "legacy" else current_encode
+    started = time.perf_counter()
+    total_bytes = sum(len(fn(p, max_dimension)) for p in paths)
+    elapsed = time.perf_counter() - started
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    queue.put((elapsed, peak_mb, total_bytes))
+
+
+def measure(variant: str, paths: list, max_dimension: int):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_run, args=(variant, paths, max_dimension, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark da preparação de imagens (draft vs decode completo)")
+    p.add_argument("--images", type=int, default=5)
+    p.add_argument("--max-dimension", type=int, default=1600)
+    args = p.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [Path(tmp) / f"synthetic_{i}.jpg" for i in range(args.images)]
+        # Gera as imagens em outro processo: ru_maxrss é herdado no fork/exec,
+        # então o processo pai precisa continuar pequeno
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(1) as pool:
+            pool.starmap(make_synthetic_jpeg, [(path, (6000, 4000), i) for i, path in enumerate(paths)])
+
+        print(f"{args.images} JPEG(s) 6000x4000, max_dimension={args.max_dimension}")
+        results = {}
+        for variant in ("legacy", "current"):
+            elapsed, peak_mb, total_bytes = measure(variant, paths, args.max_dimension)
+            results[variant] = elapsed
+            print(
+                f"  {variant:8s} {elapsed / args.images * 1000:7.1f} ms/imagem  "
+                f"pico RSS {peak_mb:7.1f} MB  saída {total_bytes / 1024:.0f} KB"
+            )
+        if results["current"] > 0:
+            print(f"  speedup: {results['legacy'] / results['current']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
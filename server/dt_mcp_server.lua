@@ -9,6 +9,8 @@
 -- - set_colorlabel_batch
 -- - tag_batch
 -- - export_collection (com suporte a ids)
+-- - export_start / export_status / export_cancel (export em background)
+-- - catalog_changes (deltas para o snapshot local do host)
 --------------------------------------------------
 
 local function get_script_dir()
@@ -22,7 +24,8 @@ end
 local script_dir = get_script_dir()
 package.path = package.path .. ";" .. script_dir .. "?.lua"
 
-local json   = require "dkjson"
+local json   = require "json_codec"
+local export_pool = require "export_pool"
 local package = require "package"
 
 local function command_exists(cmd)
@@ -399,14 +402,56 @@ io.stderr:write(string.format(
   tostring(DARKTABLE_CLI_SOURCE),
   tostring(DARKTABLE_CLI_CMD)
 ))
+io.stderr:write(string.format("[init] json backend=%s\n", json.name))
 
 --------------------------------------------------
 -- 2. Helpers JSON-RPC / MCP
 --------------------------------------------------
 
+-- Listas grandes: o array marcado com stream_array é escrito item a item por
+-- send_response, sem montar todos os registros nem codificar tudo de uma vez.
+local STREAM_ARRAY = {}
+local STREAM_PLACEHOLDER = "__dt_mcp_stream_array__"
+local STREAM_CHUNK = 256
+
+local function stream_array(count, item_at)
+  return setmetatable({ count = count, item_at = item_at }, STREAM_ARRAY)
+end
+
+local function take_stream(obj)
+  local content = type(obj.result) == "table" and obj.result.content
+  if type(content) ~= "table" then return nil end
+  for _, part in ipairs(content) do
+    if getmetatable(part.json) == STREAM_ARRAY then
+      local stream = part.json
+      part.json = STREAM_PLACEHOLDER
+      return stream
+    end
+  end
+  return nil
+end
+
 local function send_response(obj)
-  local s = json.encode(obj, { indent = false })
-  io.stdout:write(s, "\n")
+  local stream = take_stream(obj)
+  local s = json.encode(obj)
+  if not stream then
+    io.stdout:write(s, "\n")
+    io.stdout:flush()
+    return
+  end
+
+  local quoted = '"' .. STREAM_PLACEHOLDER .. '"'
+  local at = s:find(quoted, 1, true)
+  io.stdout:write(s:sub(1, at - 1), "[")
+  local chunk = {}
+  for i = 1, stream.count do
+    chunk[#chunk + 1] = json.encode(stream.item_at(i))
+    if #chunk == STREAM_CHUNK or i == stream.count then
+      io.stdout:write(i > #chunk and "," or "", table.concat(chunk, ","))
+      chunk = {}
+    end
+  end
+  io.stdout:write("]", s:sub(at + #quoted), "\n")
   io.stdout:flush()
 end
 
@@ -482,13 +527,517 @@ local function run_command_capture(cmd)
   return success, exit_code, output, reason
 end
 
+--------------------------------------------------
+-- 3b. Índices em memória (path, tag, rating, raw)
+--------------------------------------------------
+-- Construídos na primeira listagem e mantidos pelas ferramentas que alteram
+-- rating/tags, para que as consultas custem proporcional ao resultado e não
+-- ao tamanho do catálogo. Se o número de imagens mudar, o índice é refeito.
+
+local index = {}
+
+local function film_roll_name(img)
+  if not img.film then return nil end
+  local ok, name = pcall(function() return img.film.roll_name end)
+  if ok and name then return name end
+  return tostring(img.film)
+end
+
+local function set_add(map, key, id, counts)
+  local set = map[key]
+  if not set then
+    set = {}
+    map[key] = set
+  end
+  if counts and not set[id] then
+    counts[key] = (counts[key] or 0) + 1
+  end
+  set[id] = true
+end
+
+local function index_reset()
+  index = {
+    built      = false,
+    count      = 0,
+    db_mtime   = nil, -- assinatura do library.db quando o índice foi montado
+    images     = {},  -- id -> img
+    ids        = {},  -- todos os ids em ordem crescente (varredura com parada antecipada)
+    path       = {},  -- id -> path
+    rating     = {},  -- id -> rating
+    is_raw     = {},  -- id -> boolean
+    filename   = {},  -- id -> filename (ordenação)
+    by_path    = {},  -- path -> { [id] = true }
+    path_count = {},  -- path -> quantidade
+    path_film  = {},  -- path -> nome do film roll
+    by_rating  = {},  -- rating -> { [id] = true }
+    by_tag     = {},  -- nome da tag -> { [id] = true }
+    tag_count  = {},  -- nome da tag -> quantidade
+  }
+end
+
+local function index_add_image(img)
+  local id     = img.id
+  local rating = img.rating or 0
+  local path   = img.path or ""
+
+  index.images[id] = img
+  index.path[id] = path
+  table.insert(index.ids, id)
+  index.rating[id] = rating
+  index.is_raw[id] = img.is_raw and true or false
+  index.filename[id] = img.filename or ""
+  set_add(index.by_rating, rating, id)
+
+  if not index.by_path[path] then
+    index.path_count[path] = 0
+    index.path_film[path] = film_roll_name(img)
+  end
+  set_add(index.by_path, path, id)
+  index.path_count[path] = index.path_count[path] + 1
+  index.count = index.count + 1
+end
+
+local function index_tags()
+  -- Cada dt_lua_tag_t é iterável pelas imagens que a possuem: custo por
+  -- associação tag/imagem, sem chamar get_tags para todo o catálogo.
+  local ok = pcall(function()
+    for _, tag in ipairs(dt.tags) do
+      local name = tag.name
+      for _, img in ipairs(tag) do
+        set_add(index.by_tag, name, img.id, index.tag_count)
+      end
+    end
+  end)
+  if ok then return end
+
+  index.by_tag = {}
+  index.tag_count = {}
+  for id, img in pairs(index.images) do
+    for _, t in ipairs(dt.tags.get_tags(img)) do
+      set_add(index.by_tag, t.name, id, index.tag_count)
+    end
+  end
+end
+
+local function database_size()
+  local ok, n = pcall(function() return #dt.database end)
+  return ok and n or nil
+end
+
+--------------------------------------------------
+-- 3b'. Token de mudanças do catálogo (catalog_changes)
+--------------------------------------------------
+-- Hosts guardam uma cópia local dos metadados e pedem só o que mudou desde o
+-- token anterior. O token é o estado persistente do catálogo (assinatura do
+-- library.db, maior id e contagem), então continua válido entre execuções do
+-- servidor. Alterações feitas por este servidor ficam em catalog.touched
+-- (id -> geração) e catalog.states lembra em que geração cada estado foi
+-- visto; mudanças externas reconstroem o índice e zeram os dois (cópia completa).
+
+math.randomseed(os.time())
+
+local catalog = {
+  generation = 0,
+  touched    = {},  -- id -> geração da última alteração feita por este servidor
+  states     = {},  -- estado do catálogo -> geração em que foi observado
+}
+
+-- LuaFileSystem (opcional) lê mtime/tamanho sem subprocesso; sem ela o stat
+-- via popen é limitado a uma vez por LIBRARY_CHECK_SECONDS
+local has_lfs, lfs = pcall(require, "lfs")
+if not has_lfs then lfs = nil end
+local LIBRARY_CHECK_SECONDS = 1
+local library_cache = { checked_at = nil, signature = nil }
+
+local function library_stats(paths)
+  if not lfs then
+    return export_pool.stat_files(paths)
+  end
+  local stats = {}
+  for _, path in ipairs(paths) do
+    local attr = lfs.attributes(path)
+    if attr then
+      stats[path] = { mtime = attr.modification, size = attr.size }
+    end
+  end
+  return stats
+end
+
+-- "mtime:tamanho" do library.db e do -wal (nil se não der para ler):
+-- muda a cada escrita no catálogo, inclusive as feitas pela GUI do darktable.
+-- fresh ignora o limite de frequência (depois das nossas próprias escritas).
+local function library_mtime(fresh)
+  local now = os.time()
+  if not lfs and not fresh and library_cache.checked_at
+      and now - library_cache.checked_at < LIBRARY_CHECK_SECONDS then
+    return library_cache.signature
+  end
+  local ok, dir = pcall(function() return dt.configuration.config_dir end)
+  if not ok or not dir then return nil end
+  local db, wal = dir .. "/library.db", dir .. "/library.db-wal"
+  local stats = library_stats({ db, wal })
+  local signature = nil
+  if stats[db] then
+    local parts = {}
+    for _, path in ipairs({ db, wal }) do
+      local st = stats[path]
+      table.insert(parts, st and string.format("%d.%d", st.mtime, st.size) or "-")
+    end
+    signature = table.concat(parts, ":")
+  end
+  library_cache.checked_at, library_cache.signature = now, signature
+  return signature
+end
+
+local function catalog_touch(id)
+  catalog.generation = catalog.generation + 1
+  catalog.touched[id] = catalog.generation
+end
+
+-- Estado persistente usado como token (nil se o library.db não puder ser lido)
+local function catalog_state()
+  if not index.db_mtime then return nil end
+  return string.format("%s|%d|%d", index.db_mtime, index.ids[#index.ids] or 0, index.count)
+end
+
+-- Primeira geração em que o estado atual foi visto: escritas posteriores a ela
+-- ainda não estão refletidas em tokens com esse estado
+local function catalog_remember_state()
+  local state = catalog_state()
+  if state and catalog.states[state] == nil then
+    catalog.states[state] = catalog.generation
+  end
+  return state
+end
+
+-- Depois das nossas escritas o novo mtime do library.db não é mudança externa
+-- (o índice já foi atualizado por index_set_rating/index_attach_tag)
+local function catalog_absorb_own_writes()
+  if not index.built then return end
+  index.db_mtime = library_mtime(true)
+  catalog_remember_state()
+end
+
+-- Reconstrói o índice quando o número de imagens muda ou quando o library.db
+-- foi alterado por outro processo (rating/tags editados na GUI do darktable)
+local function ensure_index()
+  local size = database_size()
+  local mtime = library_mtime()
+  if index.built and (size == nil or size == index.count)
+      and (mtime == nil or mtime == index.db_mtime) then
+    return
+  end
+
+  local started = os.clock()
+  index_reset()
+  for _, img in ipairs(dt.database) do
+    index_add_image(img)
+  end
+  table.sort(index.ids)
+  index_tags()
+  index.built = true
+  index.db_mtime = mtime
+  -- mudança externa: deltas guardados não valem mais
+  catalog.touched, catalog.states = {}, {}
+  io.stderr:write(string.format(
+    "[index] %d imagens indexadas em %.2fs\n", index.count, os.clock() - started
+  ))
+end
+
+local function index_set_rating(img, rating)
+  catalog_touch(img.id)
+  if not index.built then return end
+  local id  = img.id
+  local old = index.rating[id]
+  if old ~= nil and index.by_rating[old] then
+    index.by_rating[old][id] = nil
+  end
+  index.rating[id] = rating
+  set_add(index.by_rating, rating, id)
+end
+
+local function index_attach_tag(name, img)
+  catalog_touch(img.id)
+  if index.built then
+    set_add(index.by_tag, name, img.id, index.tag_count)
+  end
+end
+
+-- Retorna (conjuntos, paths aceitos, total de candidatos)
+local function sets_by_path(path_contains)
+  local sets, paths, count = {}, {}, 0
+  for path, set in pairs(index.by_path) do
+    if path:find(path_contains, 1, true) then
+      table.insert(sets, set)
+      paths[path] = true
+      count = count + index.path_count[path]
+    end
+  end
+  return sets, paths, count
+end
+
+local function sets_by_rating(min_rating)
+  local sets = {}
+  for rating, set in pairs(index.by_rating) do
+    if rating >= min_rating then
+      table.insert(sets, set)
+    end
+  end
+  return sets
+end
+
+-- União de conjuntos disjuntos filtrada por rating/raw (ids, sem ordem)
+local function index_select(sets, min_rating, only_raw)
+  local ids = {}
+  for _, set in ipairs(sets) do
+    for id in pairs(set) do
+      if index.rating[id] >= min_rating and (not only_raw or index.is_raw[id]) then
+        table.insert(ids, id)
+      end
+    end
+  end
+  return ids
+end
+
+--------------------------------------------------
+-- 3c. Paginação (limit / cursor / order_by)
+--------------------------------------------------
+-- O cursor é "<order_by>:<id>:<chave>" do último item entregue; a página
+-- seguinte começa no primeiro item estritamente depois dele na ordenação,
+-- então mudanças de rating entre páginas não pulam nem repetem imagens.
+
+local ORDER_BY = { id = true, ["-id"] = true, rating = true, filename = true }
+local LIST_FORMATS = { rows = true, columnar = true }
+
+local function sort_key(order_by, id)
+  if order_by == "rating" then return -(index.rating[id] or 0) end
+  if order_by == "filename" then return index.filename[id] or "" end
+  if order_by == "-id" then return -id end
+  return id
+end
+
+local function encode_cursor(order_by, id, key)
+  return string.format("%s:%d:%s", order_by, id, tostring(key))
+end
+
+local function decode_cursor(cursor, order_by)
+  local ord, id, key = cursor:match("^([%-%w]+):(%-?%d+):(.*)$")
+  if ord ~= order_by then
+    return nil
+  end
+  if order_by ~= "filename" then
+    key = tonumber(key)
+    if key == nil then return nil end
+  end
+  return key, tonumber(id)
+end
+
+local function validate_page_args(args)
+  if args.limit ~= nil and (type(args.limit) ~= "number" or args.limit < 1 or args.limit % 1 ~= 0) then
+    return mcp_error("limit deve ser um inteiro positivo", "invalid_limit", "limit")
+  end
+  if args.cursor ~= nil and type(args.cursor) ~= "string" then
+    return mcp_error("cursor deve ser string", "invalid_cursor", "cursor")
+  end
+  if args.order_by ~= nil and not ORDER_BY[args.order_by] then
+    return mcp_error("order_by deve ser id, -id, rating ou filename", "invalid_order_by", "order_by")
+  end
+  if args.format ~= nil and not LIST_FORMATS[args.format] then
+    return mcp_error("format deve ser rows ou columnar", "invalid_format", "format")
+  end
+  return nil
+end
+
+-- format = "columnar": colunas paralelas em vez de um objeto por imagem, com
+-- os paths deduplicados em "paths" (a coluna path guarda o índice 0-based) e
+-- colorlabels como máscara de bits (red=1, yellow=2, green=4, blue=8, purple=16).
+local COLOR_BITS = { red = 1, yellow = 2, green = 4, blue = 8, purple = 16 }
+
+local function columnar_page(ids, first, last)
+  local paths, path_index = {}, {}
+  local columns = { id = {}, path = {}, filename = {}, rating = {}, is_raw = {}, colorlabels = {} }
+  for i = first, last do
+    local meta = image_to_metadata(index.images[ids[i]])
+    local p = path_index[meta.path]
+    if not p then
+      table.insert(paths, meta.path)
+      p = #paths - 1
+      path_index[meta.path] = p
+    end
+    local mask = 0
+    for _, color in ipairs(meta.colorlabels) do
+      mask = mask + COLOR_BITS[color]
+    end
+    local n = i - first + 1
+    columns.id[n]          = meta.id
+    columns.path[n]        = p
+    columns.filename[n]    = meta.filename
+    columns.rating[n]      = meta.rating
+    columns.is_raw[n]      = meta.is_raw and true or false
+    columns.colorlabels[n] = mask
+  end
+  return { format = "columnar", count = math.max(0, last - first + 1), paths = paths, columns = columns }
+end
+
+-- Valor de content[1].json para ids[first..last]
+local function page_json(ids, first, last, args)
+  if args.format == "columnar" then
+    return columnar_page(ids, first, last)
+  end
+  -- metadados montados durante a escrita da resposta (ver send_response)
+  return stream_array(math.max(0, last - first + 1), function(i)
+    return image_to_metadata(index.images[ids[first + i - 1]])
+  end)
+end
+
+-- Ordena os ids, aplica cursor/limit e só então monta os metadados da página
+local function paginate(ids, args)
+  local order_by = args.order_by or "id"
+  local keys = {}
+  for _, id in ipairs(ids) do
+    keys[id] = sort_key(order_by, id)
+  end
+  table.sort(ids, function(a, b)
+    local ka, kb = keys[a], keys[b]
+    if ka ~= kb then return ka < kb end
+    return a < b
+  end)
+
+  local start = 1
+  if args.cursor then
+    local after_key, after_id = decode_cursor(args.cursor, order_by)
+    if after_key == nil then
+      return nil, mcp_error("cursor inválido para order_by=" .. order_by, "invalid_cursor", "cursor")
+    end
+    -- busca binária pelo primeiro item depois de (after_key, after_id)
+    local lo, hi = 1, #ids + 1
+    while lo < hi do
+      local mid = math.floor((lo + hi) / 2)
+      local k = keys[ids[mid]]
+      if k < after_key or (k == after_key and ids[mid] <= after_id) then
+        lo = mid + 1
+      else
+        hi = mid
+      end
+    end
+    start = lo
+  end
+
+  local last = #ids
+  if args.limit then
+    last = math.min(#ids, start + args.limit - 1)
+  end
+
+  local result = {
+    content = {
+      { type = "json", json = page_json(ids, start, last, args) }
+    },
+    total   = #ids,
+    isError = false
+  }
+  if last < #ids then
+    local last_id = ids[last]
+    result.nextCursor = encode_cursor(order_by, last_id, keys[last_id])
+  end
+  return result
+end
+
+-- Acima de SCAN_FACTOR * limit candidatos, percorrer index.ids em ordem e
+-- parar no limit-ésimo resultado é mais barato que coletar e ordenar tudo.
+local SCAN_FACTOR = 4
+
+local function first_position(ids, after_id, descending)
+  -- busca binária em ids (crescente): primeira posição depois de after_id
+  local lo, hi = 1, #ids + 1
+  while lo < hi do
+    local mid = math.floor((lo + hi) / 2)
+    if ids[mid] <= after_id then
+      lo = mid + 1
+    else
+      hi = mid
+    end
+  end
+  if descending then
+    -- primeira posição (de trás para frente) antes de after_id
+    if lo > 1 and ids[lo - 1] == after_id then
+      return lo - 2
+    end
+    return lo - 1
+  end
+  return lo
+end
+
+-- Limit pushdown: varre em ordem de id e para assim que a página enche.
+-- Não calcula "total" (exigiria varrer tudo).
+local function scan_page(accept, args)
+  local order_by   = args.order_by or "id"
+  local descending = order_by == "-id"
+  local ids        = index.ids
+  local step       = descending and -1 or 1
+  local pos        = descending and #ids or 1
+
+  if args.cursor then
+    local _, after_id = decode_cursor(args.cursor, order_by)
+    if after_id == nil then
+      return mcp_error("cursor inválido para order_by=" .. order_by, "invalid_cursor", "cursor")
+    end
+    pos = first_position(ids, after_id, descending)
+  end
+
+  local page, last_id, has_more = {}, nil, false
+  while pos >= 1 and pos <= #ids do
+    local id = ids[pos]
+    if accept(id) then
+      if #page == args.limit then
+        has_more = true
+        break
+      end
+      table.insert(page, id)
+      last_id = id
+    end
+    pos = pos + step
+  end
+
+  local result = {
+    content = {
+      { type = "json", json = page_json(page, 1, #page, args) }
+    },
+    isError = false
+  }
+  if has_more then
+    result.nextCursor = encode_cursor(order_by, last_id, sort_key(order_by, last_id))
+  end
+  return result
+end
+
+-- query: { sets, min_rating, only_raw, member?: function(id), candidates?: number }
+local function list_page(query, args)
+  local order_by = args.order_by or "id"
+  local min_rating, only_raw, member = query.min_rating, query.only_raw, query.member
+
+  if args.limit and (order_by == "id" or order_by == "-id")
+      and (query.candidates == nil or query.candidates > SCAN_FACTOR * args.limit) then
+    return scan_page(function(id)
+      return index.rating[id] >= min_rating
+        and (not only_raw or index.is_raw[id])
+        and (member == nil or member(id))
+    end, args)
+  end
+
+  local result, err = paginate(index_select(query.sets, min_rating, only_raw), args)
+  return result or err
+end
+
+index_reset()
+
 --------------------------------------------------
 -- 4. Ferramentas MCP (lado darktable)
 --------------------------------------------------
 
 --------------------------------------------------
 -- 4.1 list_collection
--- args: { min_rating?: number, only_raw?: boolean, collection_path?: string }
+-- args: { min_rating?: number, only_raw?: boolean, collection_path?: string,
+--         limit?: number, cursor?: string, order_by?: string }
 --------------------------------------------------
 local function tool_list_collection(args)
   args = args or {}
@@ -504,75 +1053,89 @@ local function tool_list_collection(args)
     return mcp_error("only_raw deve ser booleano", "invalid_only_raw", "only_raw")
   end
 
+  local page_error = validate_page_args(args)
+  if page_error then return page_error end
+
   local min_rating      = args.min_rating or -2
   local only_raw        = args.only_raw or false
   local collection_path = args.collection_path
 
-  local result = {}
-
-  for _, img in ipairs(dt.database) do
-    local path_ok = true
-    if collection_path and img.path then
-      path_ok = img.path:find(collection_path, 1, true) ~= nil
-    end
-
-    if path_ok and (not only_raw or img.is_raw) and (img.rating or 0) >= min_rating then
-      table.insert(result, image_to_metadata(img))
-    end
+  ensure_index()
+  local query = { min_rating = min_rating, only_raw = only_raw }
+  if collection_path then
+    local paths
+    query.sets, paths, query.candidates = sets_by_path(collection_path)
+    query.member = function(id) return paths[index.path[id]] end
+  else
+    query.sets = sets_by_rating(min_rating)
   end
-
-  return {
-    content = {
-      { type = "json", json = result }
-    },
-    isError = false
-  }
+  return list_page(query, args)
 end
 
 --------------------------------------------------
 -- 4.1b list_available_collections
--- args: {}
+-- args: { limit?: number, cursor?: string }  (ordenado por path; cursor = último path)
 --------------------------------------------------
 local function tool_list_available_collections(args)
-  local groups = {}
-
-  for _, img in ipairs(dt.database) do
-    local path = img.path or ""
-    -- "roll_name" pode nao existir em algumas versoes, usamos o path do film
-    local film = img.film and (pcall(function() return img.film.roll_name end) and img.film.roll_name or tostring(img.film)) or nil
-
-    if path ~= "" then
-      if not groups[path] then
-        groups[path] = { count = 0, film = film }
-      end
-      groups[path].count = groups[path].count + 1
-    end
+  args = args or {}
+  if args.limit ~= nil and (type(args.limit) ~= "number" or args.limit < 1 or args.limit % 1 ~= 0) then
+    return mcp_error("limit deve ser um inteiro positivo", "invalid_limit", "limit")
   end
+  if args.cursor ~= nil and type(args.cursor) ~= "string" then
+    return mcp_error("cursor deve ser string", "invalid_cursor", "cursor")
+  end
+
+  ensure_index()
 
   local result = {}
-  for path, meta in pairs(groups) do
-    table.insert(result, {
-      path = path,
-      film_roll = meta.film,
-      image_count = meta.count
-    })
+  for path, count in pairs(index.path_count) do
+    if path ~= "" and count > 0 then
+      table.insert(result, {
+        path = path,
+        film_roll = index.path_film[path],
+        image_count = count
+      })
+    end
   end
 
   table.sort(result, function(a, b)
     return a.path < b.path
   end)
 
+  local total = #result
+  if args.cursor then
+    local after = {}
+    for _, entry in ipairs(result) do
+      if entry.path > args.cursor then
+        table.insert(after, entry)
+      end
+    end
+    result = after
+  end
+
+  local next_cursor = nil
+  if args.limit and #result > args.limit then
+    local page = {}
+    for i = 1, args.limit do
+      page[i] = result[i]
+    end
+    result = page
+    next_cursor = result[#result].path
+  end
+
   return {
     content = {
       { type = "json", json = result }
     },
-    isError = false
+    total      = total,
+    nextCursor = next_cursor,
+    isError    = false
   }
 end
 
 --------------------------------------------------
 -- 4.2 list_by_path
--- args: { path_contains: string, min_rating?: number, only_raw?: boolean }
+-- args: { path_contains: string, min_rating?: number, only_raw?: boolean, limit?, cursor?, order_by? }
 --------------------------------------------------
 local function tool_list_by_path(args)
   args = args or {}
@@ -588,32 +1151,27 @@ local function tool_list_by_path(args)
     return mcp_error("only_raw deve ser booleano", "invalid_only_raw", "only_raw")
   end
 
+  local page_error = validate_page_args(args)
+  if page_error then return page_error end
+
   local path_contains = args.path_contains or ""
   local min_rating    = args.min_rating or -2
   local only_raw      = args.only_raw or false
 
-  local result = {}
-
-  for _, img in ipairs(dt.database) do
-    local p = img.path or ""
-    if p:find(path_contains, 1, true) then
-      if (not only_raw or img.is_raw) and (img.rating or 0) >= min_rating then
-        table.insert(result, image_to_metadata(img))
-      end
-    end
-  end
-
-  return {
-    content = {
-      { type = "json", json = result }
-    },
-    isError = false
-  }
+  ensure_index()
+  local sets, paths, candidates = sets_by_path(path_contains)
+  return list_page({
+    sets       = sets,
+    min_rating = min_rating,
+    only_raw   = only_raw,
+    member     = function(id) return paths[index.path[id]] end,
+    candidates = candidates,
+  }, args)
 end
 
 --------------------------------------------------
 -- 4.3 list_by_tag
--- args: { tag: string, min_rating?: number, only_raw?: boolean }
+-- args: { tag: string, min_rating?: number, only_raw?: boolean, limit?, cursor?, order_by? }
 --------------------------------------------------
 local function tool_list_by_tag(args)
   args = args or {}
@@ -629,31 +1187,23 @@ local function tool_list_by_tag(args)
     return mcp_error("only_raw deve ser booleano", "invalid_only_raw", "only_raw")
   end
 
+  local page_error = validate_page_args(args)
+  if page_error then return page_error end
+
   local tag_name   = args.tag
   local min_rating = args.min_rating or -2
   local only_raw   = args.only_raw or false
 
-  -- Fix: dt.tags.get_images não existe. Iterar database.
-  for _, img in ipairs(dt.database) do
-    if (not only_raw or img.is_raw) and (img.rating or 0) >= min_rating then
-      -- Verifica se a imagem possui a tag
-      local img_tags = dt.tags.get_tags(img)
-      for _, t in ipairs(img_tags) do
-        -- Comparação exata de string (nome da tag)
-        if t.name == tag_name then
-          table.insert(result, image_to_metadata(img))
-          break
-        end
-      end
-    end
-  end
-
-  return {
-    content = {
-      { type = "json", json = result }
-    },
-    isError = false
-  }
+  -- Comparação exata do nome da tag, via índice tag -> ids
+  ensure_index()
+  local tagged = index.by_tag[tag_name] or {}
+  return list_page({
+    sets       = { tagged },
+    min_rating = min_rating,
+    only_raw   = only_raw,
+    member     = function(id) return tagged[id] end,
+    candidates = index.tag_count[tag_name] or 0,
+  }, args)
 end
 
 --------------------------------------------------
@@ -691,6 +1241,7 @@ local function tool_apply_batch_edits(args)
       if img then
         if e.rating ~= nil then
           img.rating = e.rating
+          index_set_rating(img, e.rating)
         end
         updated = updated + 1
       end
@@ -754,6 +1305,7 @@ local function tool_set_colorlabel_batch(args)
         end
       end
       img.colorlabels[idx] = true
+      catalog_touch(e.id)
       updated = updated + 1
     end
   end
@@ -826,6 +1378,7 @@ local function tool_apply_style(args)
     local img = dt.database[id]
     if img then
         dt.styles.apply(style, img)
+        catalog_touch(id)
         count = count + 1
     end
   end
@@ -861,6 +1414,7 @@ local function tool_tag_batch(args)
     local img = dt.database[id]
     if img then
       dt.tags.attach(tag, img)
+      index_attach_tag(args.tag, img)
       count = count + 1
     end
   end
@@ -879,9 +1433,13 @@ end
 --   target_dir: string,
 --   ids?: [ number ],
 --   format?: string,
---   overwrite?: boolean
+--   overwrite?: boolean,    (reexporta tudo, ignorando o manifesto)
+--   max_parallel?: number   (padrão: metade dos núcleos ou DT_MCP_EXPORT_PARALLEL)
+--   batch_size?: number     (imagens por darktable-cli; padrão 16 ou DT_MCP_EXPORT_BATCH)
 -- }
 -- OBS: usa darktable-cli externo, ajuste o comando se necessário.
+-- Saídas sem mudança na origem/XMP desde o último export são puladas
+-- (manifesto em <target_dir>/.dt_mcp_export.json, ver export_pool.lua).
 --------------------------------------------------
 local ALLOWED_EXPORT_FORMATS = { "jpg", "jpeg", "tif", "tiff", "png", "webp" }
 local ALLOWED_EXPORT_FORMATS_SET = {}
@@ -889,19 +1447,21 @@ for _, fmt in ipairs(ALLOWED_EXPORT_FORMATS) do
   ALLOWED_EXPORT_FORMATS_SET[fmt] = true
 end
 
-local function tool_export_collection(args)
+-- Valida os args e monta os jobs { order, id, input, output, cmd } a exportar.
+-- Retorna (plan, nil) ou (nil, resultado de erro MCP).
+local function prepare_export(args)
   args = args or {}
   local target_dir = args.target_dir
   if not target_dir then
-    return mcp_error("target_dir is required", "missing_target_dir", "target_dir")
+    return nil, mcp_error("target_dir is required", "missing_target_dir", "target_dir")
   end
 
   if type(target_dir) ~= "string" or target_dir == "" then
-    return mcp_error("target_dir deve ser string não vazia", "invalid_target_dir", "target_dir")
+    return nil, mcp_error("target_dir deve ser string não vazia", "invalid_target_dir", "target_dir")
   end
 
   if target_dir:find("\n") or target_dir:find("\r") then
-    return mcp_error(
+    return nil, mcp_error(
       "target_dir não pode conter quebras de linha",
       "invalid_target_dir",
       "target_dir"
@@ -909,7 +1469,7 @@ local function tool_export_collection(args)
   end
 
   if target_dir:find("%.%.", 1, true) then
-    return mcp_error(
+    return nil, mcp_error(
       "target_dir não pode conter '..'",
       "invalid_target_dir",
       "target_dir"
@@ -917,7 +1477,7 @@ local function tool_export_collection(args)
   end
 
   if target_dir:match("[><|;&%$`]") or target_dir:find("$(", 1, true) then
-    return mcp_error(
+    return nil, mcp_error(
       "target_dir não pode conter redirecionamentos ou caracteres de shell",
       "invalid_target_dir",
       "target_dir"
@@ -926,7 +1486,7 @@ local function tool_export_collection(args)
 
   -- Rejeitar paths absolutos para prevenir escrita fora do workspace
   if target_dir:sub(1, 1) == "/" then
-    return mcp_error(
+    return nil, mcp_error(
       "target_dir não pode ser um caminho absoluto",
       "invalid_target_dir",
       "target_dir"
@@ -937,11 +1497,11 @@ local function tool_export_collection(args)
   local overwrite = args.overwrite or false
 
   if not format:match("^[%w]+$") then
-    return mcp_error("format deve conter apenas letras/números", "invalid_format", "format")
+    return nil, mcp_error("format deve conter apenas letras/números", "invalid_format", "format")
   end
 
   if not ALLOWED_EXPORT_FORMATS_SET[format] then
-    return mcp_error(
+    return nil, mcp_error(
       "format não é suportado",
       "invalid_format",
       "format",
@@ -950,7 +1510,7 @@ local function tool_export_collection(args)
   end
 
   if not DARKTABLE_CLI_CMD then
-    return {
+    return nil, {
       content = {
         {
           type = "text",
@@ -961,19 +1521,28 @@ local function tool_export_collection(args)
     }
   end
 
+  if args.max_parallel ~= nil and (type(args.max_parallel) ~= "number" or args.max_parallel < 1
+      or args.max_parallel % 1 ~= 0) then
+    return nil, mcp_error("max_parallel deve ser um inteiro positivo", "invalid_max_parallel", "max_parallel")
+  end
+
+  if args.batch_size ~= nil and (type(args.batch_size) ~= "number" or args.batch_size < 1
+      or args.batch_size % 1 ~= 0) then
+    return nil, mcp_error("batch_size deve ser um inteiro positivo", "invalid_batch_size", "batch_size")
+  end
+
   if args.ids ~= nil then
     if type(args.ids) ~= "table" then
-      return mcp_error("ids deve ser uma lista de números", "invalid_ids", "ids")
+      return nil, mcp_error("ids deve ser uma lista de números", "invalid_ids", "ids")
     end
 
     for idx, id in ipairs(args.ids) do
       if type(id) ~= "number" then
-        return mcp_error("ids deve conter apenas números", "invalid_ids", "ids", { index = idx })
+        return nil, mcp_error("ids deve conter apenas números", "invalid_ids", "ids", { index = idx })
       end
     end
   end
 
-  -- garantir que target_dir existe
   -- garantir que target_dir existe
   os.execute(string.format('mkdir -p %s', shell_escape(target_dir)))
 
@@ -994,8 +1563,7 @@ local function tool_export_collection(args)
     end
   end
 
-  local exported = 0
-  local errors = {}
+  local entries = {}
   for _, img in ipairs(to_export) do
     local input = img.path .. "/" .. img.filename
 
@@ -1003,45 +1571,79 @@ local function tool_export_collection(args)
     local base = img.filename:gsub("%.[^%.]+$", "") -- tira extensão
     local out  = string.format("%s/%s.%s", target_dir, base, format)
 
+    -- histórico de edição fica no XMP (img.sidecar; padrão <arquivo>.xmp)
+    local has_sidecar, sidecar = pcall(function() return img.sidecar end)
+    table.insert(entries, {
+      img = img,
+      input = input,
+      output = out,
+      key = export_pool.manifest_key(out),
+      sidecar = (has_sidecar and sidecar) or (input .. ".xmp"),
+    })
+  end
+
+  -- Export incremental: pula saídas cujo fingerprint (origem + XMP) não mudou.
+  -- Sem manifesto (primeiro export com ele), saídas existentes são adotadas
+  -- como atuais, igual ao comportamento anterior de pular o que já existe.
+  local manifest, has_manifest = export_pool.load_manifest(target_dir)
+  local fingerprints = export_pool.fingerprint(entries, manifest.images)
+  local jobs, skipped, manifest_dirty = {}, 0, false
+  for _, e in ipairs(entries) do
+    local fp = fingerprints[e.key]
+    local old = manifest.images[e.key]
     local skip = false
-    if not overwrite then
-      local f = io.open(out, "r")
-      if f then
-        f:close()
-        -- pula se já existe
+    if not overwrite and file_exists(e.output) then
+      if not has_manifest then
+        skip = true
+      elseif export_pool.fingerprint_unchanged(old, fp) then
         skip = true
       end
     end
 
-    if not skip then
-      -- usar shell_escape para garantir que nomes com espaços ou caracteres especiais funcionem
-      local cmd = string.format('%s %s %s', DARKTABLE_CLI_CMD, shell_escape(input), shell_escape(out))
-      local success, exit_code, stderr_output, exit_reason = run_command_capture(cmd)
-
-      if success then
-        exported = exported + 1
-      else
-        table.insert(errors, {
-          id = img.id,
-          input = input,
-          output = out,
-          command = cmd,
-          exit = exit_code,
-          exit_reason = exit_reason,
-          stderr = stderr_output,
-        })
-        io.stderr:write(string.format(
-          "[export_collection] falha exportando id=%s exit=%s motivo=%s stderr=%s\n",
-          tostring(img.id),
-          tostring(exit_code),
-          tostring(exit_reason),
-          (stderr_output or ""):gsub("\n", " ")
-        ))
+    if skip then
+      skipped = skipped + 1
+      if not old or old.xmp_mtime ~= fp.xmp_mtime or old.xmp_size ~= fp.xmp_size then
+        -- evita recalcular o cksum do XMP no próximo export
+        manifest.images[e.key] = fp
+        manifest_dirty = true
       end
+    else
+      -- saída antiga (overwrite ou fingerprint alterado) é removida em run_export
+      -- usar shell_escape para garantir que nomes com espaços ou caracteres especiais funcionem
+      local cmd = string.format('%s %s %s', DARKTABLE_CLI_CMD, shell_escape(e.input), shell_escape(e.output))
+      table.insert(jobs, {
+        order = #jobs + 1, id = e.img.id, input = e.input, output = e.output, cmd = cmd, fingerprint = fp,
+      })
     end
   end
+  if manifest_dirty then
+    export_pool.save_manifest(target_dir, manifest)
+  end
+
+  return {
+    jobs         = jobs,
+    skipped      = skipped,
+    cli          = DARKTABLE_CLI_CMD,
+    target_dir   = target_dir,
+    format       = format,
+    overwrite    = overwrite,
+    max_parallel = args.max_parallel or export_pool.default_parallel(),
+    batch_size   = args.batch_size or export_pool.default_batch(),
+  }
+end
 
-  local summary = string.format("Exportadas %d imagens para %s", exported, target_dir)
+local function tool_export_collection(args)
+  local plan, err = prepare_export(args)
+  if not plan then
+    return err
+  end
+
+  local exported, errors = export_pool.run_export(plan.jobs, plan)
+
+  local summary = string.format("Exportadas %d imagens para %s", exported, plan.target_dir)
+  if plan.skipped > 0 then
+    summary = string.format("%s (%d sem alterações)", summary, plan.skipped)
+  end
   if #errors > 0 then
     summary = string.format("%s (%d falharam)", summary, #errors)
   end
@@ -1059,6 +1661,310 @@ local function tool_export_collection(args)
   }
 end
 
+--------------------------------------------------
+-- 4.8 export_start / export_status / export_cancel
+-- Mesmo export_collection, mas num processo worker (export_worker.lua):
+-- export_start retorna um job_id na hora e o progresso é lido de
+-- <job_dir>/status.json, sem segurar o tools/call pela exportação inteira.
+--------------------------------------------------
+-- Diretório por usuário ($XDG_RUNTIME_DIR ou cache em $HOME), nunca um /tmp compartilhado
+local function default_export_jobs_dir()
+  local runtime = os.getenv("XDG_RUNTIME_DIR")
+  if runtime and runtime ~= "" then
+    return runtime .. "/dt-mcp/export-jobs"
+  end
+  local cache = os.getenv("XDG_CACHE_HOME")
+  if not cache or cache == "" then
+    cache = (os.getenv("HOME") or ".") .. "/.cache"
+  end
+  return cache .. "/dt-mcp/export-jobs"
+end
+
+local EXPORT_JOBS_DIR = os.getenv("DT_MCP_EXPORT_JOBS_DIR") or default_export_jobs_dir()
+local EXPORT_JOBS_KEEP_DAYS = 1
+
+-- Mesmo interpretador que roda este servidor (arg[-1] em `lua script.lua`)
+local function lua_interpreter()
+  if not arg then return "lua" end
+  local i = -1
+  while arg[i - 1] do
+    i = i - 1
+  end
+  return arg[i] or "lua"
+end
+
+local function process_alive(pid)
+  if not pid then return false end
+  -- zumbi (Z) conta como encerrado: nem todo init recolhe órfãos na hora
+  local ok = os.execute(string.format("ps -o stat= -p %d 2>/dev/null | grep -qv Z", pid))
+  if type(ok) == "number" then
+    return ok == 0
+  end
+  return ok == true
+end
+
+local function export_job_dir(args)
+  local job_id = (args or {}).job_id
+  if type(job_id) ~= "string" or not job_id:match("^[%w%-]+$") then
+    return nil, mcp_error("job_id inválido", "invalid_job_id", "job_id")
+  end
+  local dir = EXPORT_JOBS_DIR .. "/" .. job_id
+  if not file_exists(dir .. "/spec.json") then
+    return nil, mcp_error("job não encontrado: " .. job_id, "unknown_job", "job_id")
+  end
+  return dir, job_id
+end
+
+local function read_export_status(dir, job_id)
+  local status = json.decode(export_pool.read_file(dir .. "/status.json") or "")
+  if type(status) ~= "table" then
+    -- worker ainda não gravou o primeiro status
+    local spec = json.decode(export_pool.read_file(dir .. "/spec.json") or "") or {}
+    local total = #(spec.jobs or {})
+    status = {
+      job_id = job_id, state = "running", total = total, exported = 0,
+      failed = 0, remaining = total, images_per_sec = 0, errors = {},
+    }
+  end
+
+  if status.state == "running" then
+    local pid = tonumber(export_pool.read_file(dir .. "/pid") or "")
+    if not process_alive(pid) then
+      -- o worker pode ter terminado entre as duas leituras
+      local final = json.decode(export_pool.read_file(dir .. "/status.json") or "")
+      if type(final) == "table" and final.state ~= "running" then
+        return final
+      end
+      status.state = "failed"
+      status.message = "worker de exportação encerrou inesperadamente"
+    end
+  end
+  return status
+end
+
+-- Remove jobs antigos já encerrados (done/cancelled/failed ou worker morto);
+-- um job ainda rodando nunca é apagado, por mais longo que seja.
+local function prune_export_jobs()
+  local handle = io.popen(string.format(
+    "find %s -mindepth 1 -maxdepth 1 -type d -mtime +%d 2>/dev/null",
+    shell_escape(EXPORT_JOBS_DIR), EXPORT_JOBS_KEEP_DAYS
+  ))
+  if not handle then return end
+  local old = {}
+  for dir in handle:lines() do
+    table.insert(old, dir)
+  end
+  handle:close()
+
+  for _, dir in ipairs(old) do
+    local job_id = dir:match("([^/]+)$")
+    if not file_exists(dir .. "/spec.json") or read_export_status(dir, job_id).state ~= "running" then
+      os.execute("rm -rf " .. shell_escape(dir))
+    end
+  end
+end
+
+local function tool_export_start(args)
+  local plan, err = prepare_export(args)
+  if not plan then
+    return err
+  end
+
+  os.execute("umask 077 && mkdir -p " .. shell_escape(EXPORT_JOBS_DIR))
+  prune_export_jobs()
+
+  -- mkdir sem -p falha se o diretório existir: garante id único entre servidores
+  local job_id, dir
+  for _ = 1, 10 do
+    job_id = string.format("%s-%06x", os.date("%Y%m%d%H%M%S"), math.random(0, 0xffffff))
+    dir = EXPORT_JOBS_DIR .. "/" .. job_id
+    local ok = os.execute("mkdir " .. shell_escape(dir) .. " 2>/dev/null")
+    if ok == true or ok == 0 then
+      break
+    end
+    dir = nil
+  end
+
+  local f = dir and io.open(dir .. "/spec.json", "w")
+  if not f then
+    return mcp_error("não foi possível criar o job em " .. EXPORT_JOBS_DIR, "job_dir_unwritable")
+  end
+  f:write(json.encode(plan))
+  f:close()
+
+  os.execute(string.format(
+    "%s %s %s < /dev/null > %s 2>&1 & echo $! > %s",
+    shell_escape(lua_interpreter()),
+    shell_escape(script_dir .. "export_worker.lua"),
+    shell_escape(dir),
+    shell_escape(dir .. "/worker.log"),
+    shell_escape(dir .. "/pid")
+  ))
+
+  return {
+    content = {
+      {
+        type = "text",
+        text = string.format(
+          "Job %s iniciado: %d imagens para %s (%d sem alterações)",
+          job_id, #plan.jobs, plan.target_dir, plan.skipped
+        )
+      },
+      { type = "json", json = { job_id = job_id, total = #plan.jobs, skipped = plan.skipped } }
+    },
+    isError = false
+  }
+end
+
+local function tool_export_status(args)
+  local dir, job_id = export_job_dir(args)
+  if not dir then
+    return job_id
+  end
+
+  local status = read_export_status(dir, job_id)
+  local text = string.format(
+    "Job %s (%s): %d exportadas, %d falharam, %d restantes de %d (%.2f img/s)",
+    job_id, tostring(status.state), status.exported or 0, status.failed or 0,
+    status.remaining or 0, status.total or 0, status.images_per_sec or 0
+  )
+  return {
+    content = {
+      { type = "text", text = text },
+      { type = "json", json = status }
+    },
+    isError = status.state == "failed" or (status.failed or 0) > 0
+  }
+end
+
+local function tool_export_cancel(args)
+  local dir, job_id = export_job_dir(args)
+  if not dir then
+    return job_id
+  end
+
+  local status = read_export_status(dir, job_id)
+  if status.state ~= "running" then
+    return {
+      content = {
+        { type = "text", text = string.format("Job %s já terminou (%s)", job_id, tostring(status.state)) }
+      },
+      isError = false
+    }
+  end
+
+  local f = io.open(dir .. "/cancel", "w")
+  if f then f:close() end
+  return {
+    content = {
+      { type = "text", text = string.format("Cancelamento solicitado para o job %s", job_id) }
+    },
+    isError = false
+  }
+end
+
+--------------------------------------------------
+-- 4.9 catalog_changes
+-- args: { since?: string, cursor?: string, limit?: number }
+-- Sem since (ou com token de um estado desconhecido) devolve o catálogo
+-- inteiro (mode = "full"); senão só as imagens alteradas por este servidor
+-- desde o token (mode = "delta"). As imagens vêm em páginas de até
+-- CATALOG_PAGE_SIZE (nextCursor), em formato colunar com tags e mtime; o host
+-- repete since em todas as páginas e guarda o token da primeira.
+--------------------------------------------------
+local CATALOG_PAGE_SIZE = 2000
+
+-- { [id] = { nomes } } só para os ids em wanted (ou todos, se wanted == nil)
+local function tags_by_image(wanted)
+  local tags = {}
+  for name, set in pairs(index.by_tag) do
+    for id in pairs(set) do
+      if wanted == nil or wanted[id] then
+        local list = tags[id]
+        if not list then
+          list = {}
+          tags[id] = list
+        end
+        table.insert(list, name)
+      end
+    end
+  end
+  return tags
+end
+
+local function tool_catalog_changes(args)
+  args = args or {}
+  if args.since ~= nil and type(args.since) ~= "string" then
+    return mcp_error("since deve ser string", "invalid_since", "since")
+  end
+  local err = validate_page_args(args)
+  if err then return err end
+
+  ensure_index()
+  local state = catalog_remember_state()
+  local base = args.since and catalog.states[args.since]
+  if base == nil and args.since ~= nil and args.since == state then
+    -- token de outra execução do servidor com o catálogo inalterado
+    base = 0
+  end
+  local full = base == nil
+
+  local ids = index.ids
+  if not full then
+    ids = {}
+    for id, generation in pairs(catalog.touched) do
+      if generation > base and index.images[id] then
+        table.insert(ids, id)
+      end
+    end
+    table.sort(ids)
+  end
+
+  local first = 1
+  if args.cursor then
+    local _, after_id = decode_cursor(args.cursor, "id")
+    if after_id == nil then
+      return mcp_error("cursor inválido", "invalid_cursor", "cursor")
+    end
+    first = first_position(ids, after_id, false)
+  end
+  local last = math.min(#ids, first + (args.limit or CATALOG_PAGE_SIZE) - 1)
+
+  -- tags só das imagens desta página
+  local page = {}
+  for i = first, last do
+    page[ids[i]] = true
+  end
+  local images = columnar_page(ids, first, last)
+  local tags = tags_by_image(page)
+  images.columns.tags, images.columns.mtime = {}, {}
+  for n, id in ipairs(images.columns.id) do
+    local img = index.images[id]
+    local ok, changed = pcall(function() return img.change_timestamp end)
+    images.columns.tags[n] = tags[id] or {}
+    images.columns.mtime[n] = (ok and tonumber(changed)) or 0
+  end
+
+  local result = {
+    content = {
+      {
+        type = "text",
+        text = string.format("%s: %d imagens", full and "Catálogo completo" or "Alterações", #ids)
+      },
+      {
+        type = "json",
+        json = { mode = full and "full" or "delta", token = state, images = images }
+      }
+    },
+    total   = #ids,
+    isError = false
+  }
+  if last < #ids then
+    result.nextCursor = encode_cursor("id", ids[last], ids[last])
+  end
+  return result
+end
+
 --------------------------------------------------
 -- 5. Despacho MCP
 --------------------------------------------------
@@ -1090,7 +1996,74 @@ local function handle_initialize(req)
   }
 end
 
+-- Parâmetros de paginação comuns às ferramentas de listagem
+local function with_page_properties(properties)
+  properties.limit = {
+    type        = "number",
+    description = "Máximo de itens nesta página (sem limit, retorna tudo)."
+  }
+  properties.cursor = {
+    type        = "string",
+    description = "Valor de nextCursor da página anterior."
+  }
+  properties.order_by = {
+    type        = "string",
+    enum        = { "id", "-id", "rating", "filename" },
+    description = "Ordenação (padrão: id). O cursor só vale para a mesma ordenação."
+  }
+  properties.format = {
+    type        = "string",
+    enum        = { "rows", "columnar" },
+    description = "rows (padrão): um objeto por imagem; columnar: arrays paralelos com paths deduplicados."
+  }
+  return properties
+end
+
 local function handle_tools_list(req)
+  local export_schema = {
+    type       = "object",
+    required   = { "target_dir" },
+    properties = {
+      target_dir = {
+        type        = "string",
+        description = "Diretório de destino."
+      },
+      ids = {
+        type  = "array",
+        items = {
+          type        = "number",
+          description = "IDs das imagens a exportar (opcional)."
+        }
+      },
+      format = {
+        type        = "string",
+        description = "Extensão de saída (jpg, tif, etc)."
+      },
+      overwrite = {
+        type        = "boolean",
+        description = "Se true, sobrescreve arquivos existentes."
+      },
+      max_parallel = {
+        type        = "number",
+        description = "Processos darktable-cli simultâneos (padrão: metade dos núcleos)."
+      },
+      batch_size = {
+        type        = "number",
+        description = "Imagens por invocação do darktable-cli (1 = uma por processo). Padrão: 16."
+      }
+    }
+  }
+  local job_schema = {
+    type       = "object",
+    required   = { "job_id" },
+    properties = {
+      job_id = {
+        type        = "string",
+        description = "Id retornado por export_start."
+      }
+    }
+  }
+
   local tools = {
     {
       name        = "list_collection",
@@ -1098,7 +2071,7 @@ local function handle_tools_list(req)
       description = "Lista imagens da biblioteca com filtros simples (min_rating, only_raw, collection_path).",
       inputSchema = {
         type       = "object",
-        properties = {
+        properties = with_page_properties({
           min_rating = {
             type        = "number",
             description = "Rating mínimo (0–5, -1 rejeitado)."
@@ -1111,7 +2084,7 @@ local function handle_tools_list(req)
             type        = "string",
             description = "Filtra por um caminho de coleção (match direto em img.path)."
           }
-        }
+        })
       }
     },
     {
@@ -1120,7 +2093,10 @@ local function handle_tools_list(req)
       description = "Retorna caminhos de coleção/folder conhecidos e o número de imagens em cada um.",
       inputSchema = {
         type = "object",
-        properties = {}
+        properties = {
+          limit  = { type = "number", description = "Máximo de coleções nesta página." },
+          cursor = { type = "string", description = "Valor de nextCursor da página anterior." }
+        }
       }
     },
     {
@@ -1130,7 +2106,7 @@ local function handle_tools_list(req)
       inputSchema = {
         type       = "object",
         required   = { "path_contains" },
-        properties = {
+        properties = with_page_properties({
           path_contains = {
             type        = "string",
             description = "Trecho do caminho (ex.: '2024-viagem-mg')."
@@ -1143,7 +2119,7 @@ local function handle_tools_list(req)
             type        = "boolean",
             description = "Apenas RAW."
           }
-        }
+        })
       }
     },
     {
@@ -1153,7 +2129,7 @@ local function handle_tools_list(req)
       inputSchema = {
         type       = "object",
         required   = { "tag" },
-        properties = {
+        properties = with_page_properties({
           tag = {
             type        = "string",
             description = "Nome da tag (ex.: 'job:cliente-x')."
@@ -1166,7 +2142,7 @@ local function handle_tools_list(req)
             type        = "boolean",
             description = "Apenas RAW."
           }
-        }
+        })
       }
     },
     {
@@ -1246,31 +2222,47 @@ local function handle_tools_list(req)
       name        = "export_collection",
       title       = "Exportar coleção",
       description = "Exporta imagens para um diretório (toda a coleção ou apenas ids específicos).",
+      inputSchema = export_schema
+    },
+    {
+      name        = "catalog_changes",
+      title       = "Alterações do catálogo",
+      description = "Metadados (colunar, com tags) alterados desde o token 'since'; sem token, o catálogo inteiro, em páginas.",
       inputSchema = {
         type       = "object",
-        required   = { "target_dir" },
         properties = {
-          target_dir = {
+          since = {
             type        = "string",
-            description = "Diretório de destino."
+            description = "Token retornado pela sincronização anterior (repetir em todas as páginas)."
           },
-          ids = {
-            type  = "array",
-            items = {
-              type        = "number",
-              description = "IDs das imagens a exportar (opcional)."
-            }
-          },
-          format = {
+          cursor = {
             type        = "string",
-            description = "Extensão de saída (jpg, tif, etc)."
+            description = "Valor de nextCursor da página anterior."
           },
-          overwrite = {
-            type        = "boolean",
-            description = "Se true, sobrescreve arquivos existentes."
+          limit = {
+            type        = "number",
+            description = "Máximo de imagens nesta página (padrão 2000)."
           }
         }
       }
+    },
+    {
+      name        = "export_start",
+      title       = "Iniciar exportação em background",
+      description = "Mesmos argumentos de export_collection; retorna um job_id imediatamente.",
+      inputSchema = export_schema
+    },
+    {
+      name        = "export_status",
+      title       = "Progresso da exportação",
+      description = "Estado do job (running, done, cancelled, failed), contagens e img/s.",
+      inputSchema = job_schema
+    },
+    {
+      name        = "export_cancel",
+      title       = "Cancelar exportação",
+      description = "Encerra os processos darktable-cli do job.",
+      inputSchema = job_schema
     }
   }
 
@@ -1284,11 +2276,22 @@ local function handle_tools_list(req)
   }
 end
 
+-- Ferramentas que escrevem no library.db (ver catalog_absorb_own_writes)
+local CATALOG_WRITERS = {
+  apply_batch_edits = true, set_colorlabel_batch = true, tag_batch = true, apply_style = true,
+}
+
 local function handle_tools_call(req)
   local params = req.params or {}
   local name   = params.name
   local args   = params.arguments or {}
 
+  -- mudança externa anterior a esta escrita precisa reconstruir o índice antes
+  local writes_catalog = CATALOG_WRITERS[name]
+  if writes_catalog then
+    ensure_index()
+  end
+
   local result
 
   if name == "list_collection" then
@@ -1307,15 +2310,27 @@ local function handle_tools_call(req)
     result = tool_tag_batch(args)
   elseif name == "export_collection" then
     result = tool_export_collection(args)
+  elseif name == "export_start" then
+    result = tool_export_start(args)
+  elseif name == "export_status" then
+    result = tool_export_status(args)
+  elseif name == "export_cancel" then
+    result = tool_export_cancel(args)
   elseif name == "import_style" then
     result = tool_import_style(args)
   elseif name == "apply_style" then
     result = tool_apply_style(args)
+  elseif name == "catalog_changes" then
+    result = tool_catalog_changes(args)
   else
     send_error(req.id, -32601, "Unknown tool: " .. tostring(name))
     return
   end
 
+  if writes_catalog then
+    catalog_absorb_own_writes()
+  end
+
   send_response{
     jsonrpc = "2.0",
     id      = req.id,
@@ -1341,7 +2356,7 @@ end
 
 for line in io.lines() do
   if line ~= "" then
-    local req, pos, err = json.decode(line, 1, nil)
+    local req, err = json.decode(line)
     if not req then
       send_error(nil, -32700, "Parse error: " .. tostring(err))
     else
@@ -0,0 +1,428 @@
+--------------------------------------------------
+-- Pool de exportação via darktable-cli
+-- Usado pelo servidor (export_collection) e pelo worker dos jobs assíncronos
+-- (export_worker.lua), que roda fora do processo com a libdarktable.
+--------------------------------------------------
+
+local json = require "dkjson"
+
+local M = {}
+
+-- Imagens por invocação do darktable-cli (1 = um processo por imagem)
+M.DEFAULT_BATCH = 16
+
+local function shell_escape(s)
+  if not s then return "''" end
+  -- POSIX single-quote escape: ' -> '\''
+  return "'" .. tostring(s):gsub("'", "'\\''") .. "'"
+end
+M.shell_escape = shell_escape
+
+local function file_exists(path)
+  local f = io.open(path, "r")
+  if f then
+    f:close()
+    return true
+  end
+  return false
+end
+M.file_exists = file_exists
+
+function M.read_file(path)
+  local f = io.open(path, "r")
+  if not f then return nil end
+  local data = f:read("*a")
+  f:close()
+  return data
+end
+
+function M.cpu_count()
+  local ok, handle = pcall(io.popen, "nproc 2>/dev/null || getconf _NPROCESSORS_ONLN 2>/dev/null")
+  if not ok or not handle then return 1 end
+  local n = tonumber(handle:read("*l") or "")
+  handle:close()
+  return (n and n > 0) and n or 1
+end
+
+-- darktable-cli já usa várias threads por imagem: metade dos núcleos por padrão
+function M.default_parallel()
+  local override = tonumber(os.getenv("DT_MCP_EXPORT_PARALLEL") or "")
+  if override and override >= 1 then
+    return math.floor(override)
+  end
+  return math.max(1, math.floor(M.cpu_count() / 2))
+end
+
+function M.default_batch()
+  return tonumber(os.getenv("DT_MCP_EXPORT_BATCH") or "") or M.DEFAULT_BATCH
+end
+
+--------------------------------------------------
+-- Manifesto de export incremental
+--------------------------------------------------
+-- <target_dir>/.dt_mcp_export.json guarda, por arquivo de saída, mtime/tamanho
+-- da origem e mtime/tamanho/cksum do XMP (onde o darktable grava o histórico).
+-- Uma imagem só é reexportada se a origem ou o histórico mudou desde o export
+-- anterior. O cksum só é recalculado quando o mtime/tamanho do XMP mudou.
+
+M.MANIFEST_NAME = ".dt_mcp_export.json"
+
+-- Arquivos por invocação de stat/cksum (limite de tamanho da linha de comando)
+local FILES_PER_CALL = 200
+
+local function read_command_lines(cmd, on_line)
+  local ok, handle = pcall(io.popen, cmd)
+  if not ok or not handle then return end
+  for line in handle:lines() do
+    on_line(line)
+  end
+  handle:close()
+end
+
+local function for_chunks(paths, fn)
+  for first = 1, #paths, FILES_PER_CALL do
+    local args = {}
+    for i = first, math.min(first + FILES_PER_CALL - 1, #paths) do
+      table.insert(args, shell_escape(paths[i]))
+    end
+    fn(table.concat(args, " "))
+  end
+end
+
+-- { [path] = { mtime = n, size = n } } para os arquivos que existem
+function M.stat_files(paths)
+  local stats = {}
+  for_chunks(paths, function(args)
+    read_command_lines("stat -c '%Y %s %n' -- " .. args .. " 2>/dev/null", function(line)
+      local mtime, size, path = line:match("^(%d+) (%d+) (.*)$")
+      if path then
+        stats[path] = { mtime = tonumber(mtime), size = tonumber(size) }
+      end
+    end)
+  end)
+  return stats
+end
+
+-- { [path] = "crc" } via cksum (POSIX, sem dependências extras)
+function M.checksum_files(paths)
+  local sums = {}
+  for_chunks(paths, function(args)
+    read_command_lines("cksum -- " .. args .. " 2>/dev/null", function(line)
+      local crc, path = line:match("^(%d+) %d+ (.*)$")
+      if path then
+        sums[path] = crc
+      end
+    end)
+  end)
+  return sums
+end
+
+function M.manifest_key(output)
+  return output:match("([^/]+)$")
+end
+
+-- Retorna o manifesto ({ version, images = { [saída] = fingerprint } }) e se ele já existia
+function M.load_manifest(target_dir)
+  local data = M.read_file(target_dir .. "/" .. M.MANIFEST_NAME)
+  local manifest = data and json.decode(data)
+  if type(manifest) ~= "table" or type(manifest.images) ~= "table" then
+    return { version = 1, images = {} }, false
+  end
+  return manifest, true
+end
+
+function M.save_manifest(target_dir, manifest)
+  local path = target_dir .. "/" .. M.MANIFEST_NAME
+  local f = io.open(path .. ".tmp", "w")
+  if not f then return false end
+  f:write(json.encode(manifest))
+  f:close()
+  return os.rename(path .. ".tmp", path)
+end
+
+-- entries: { { key, input, sidecar } }; previous: manifest.images do export anterior.
+-- Retorna { [key] = { source_mtime, source_size, xmp_mtime, xmp_size, xmp_hash } }.
+function M.fingerprint(entries, previous)
+  local paths = {}
+  for _, e in ipairs(entries) do
+    table.insert(paths, e.input)
+    if e.sidecar then table.insert(paths, e.sidecar) end
+  end
+  local stats = M.stat_files(paths)
+
+  local fingerprints, to_hash = {}, {}
+  for _, e in ipairs(entries) do
+    local src = stats[e.input] or {}
+    local xmp = e.sidecar and stats[e.sidecar]
+    local fp = { source_mtime = src.mtime, source_size = src.size }
+    if xmp then
+      fp.xmp_mtime, fp.xmp_size = xmp.mtime, xmp.size
+      local old = previous[e.key]
+      if old and old.xmp_mtime == xmp.mtime and old.xmp_size == xmp.size then
+        fp.xmp_hash = old.xmp_hash
+      else
+        table.insert(to_hash, e.sidecar)
+      end
+    end
+    fingerprints[e.key] = fp
+  end
+
+  if #to_hash > 0 then
+    local sums = M.checksum_files(to_hash)
+    for _, e in ipairs(entries) do
+      local fp = fingerprints[e.key]
+      if e.sidecar and fp.xmp_mtime and not fp.xmp_hash then
+        fp.xmp_hash = sums[e.sidecar]
+      end
+    end
+  end
+  return fingerprints
+end
+
+-- mtime do XMP pode mudar sem alterar o histórico (darktable regrava o sidecar)
+function M.fingerprint_unchanged(old, new)
+  return old ~= nil
+    and new.source_mtime ~= nil
+    and old.source_mtime == new.source_mtime
+    and old.source_size == new.source_size
+    and old.xmp_hash == new.xmp_hash
+end
+
+-- Grava no manifesto os jobs exportados com sucesso (job.fingerprint)
+local function record_exports(target_dir, jobs)
+  if #jobs == 0 then return end
+  local manifest = M.load_manifest(target_dir)
+  for _, job in ipairs(jobs) do
+    manifest.images[M.manifest_key(job.output)] = job.fingerprint
+  end
+  M.save_manifest(target_dir, manifest)
+end
+
+-- Encerra o subshell do job e todos os descendentes (darktable-cli incluso).
+-- A árvore é coletada antes do kill para que os filhos não sejam reparentados.
+local function kill_tree(pid)
+  os.execute(string.format(
+    'tree() { echo "$1"; for c in $(pgrep -P "$1" 2>/dev/null); do tree "$c"; done; }; ' ..
+    "kill -TERM $(tree %d) 2>/dev/null",
+    pid
+  ))
+end
+
+-- Executa jobs ({ cmd = string, ... }) com até max_parallel processos ao mesmo
+-- tempo. Cada job roda em background num subshell que grava stdout+stderr e o
+-- código de saída em arquivos próprios; o laço faz polling desses arquivos e
+-- reabastece o pool conforme as vagas liberam. on_done(job, ok, exit, output, reason)
+-- é chamado na thread Lua, na ordem de término. Se should_stop() retornar true,
+-- os processos em andamento são encerrados e a função retorna false.
+function M.run_commands_parallel(jobs, max_parallel, on_done, should_stop)
+  if #jobs == 0 then return true end
+
+  local workdir = os.tmpname()
+  os.remove(workdir)
+  os.execute("mkdir -p " .. shell_escape(workdir))
+
+  local next_job, running_count, finished = 1, 0, 0
+  local running = {}
+  local completed = true
+
+  while finished < #jobs do
+    if should_stop and should_stop() then
+      for _, r in pairs(running) do
+        local pid = tonumber(M.read_file(r.pid) or "")
+        if pid then kill_tree(pid) end
+      end
+      completed = false
+      break
+    end
+
+    while next_job <= #jobs and running_count < max_parallel do
+      local prefix = string.format("%s/%d", workdir, next_job)
+      local log, status, pid = prefix .. ".log", prefix .. ".status", prefix .. ".pid"
+      -- stdin de /dev/null: o stdin do servidor é o canal JSON-RPC
+      os.execute(string.format(
+        "( ( %s ) < /dev/null > %s 2>&1; echo $? > %s.tmp && mv %s.tmp %s ) 2>/dev/null & echo $! > %s",
+        jobs[next_job].cmd,
+        shell_escape(log),
+        shell_escape(status), shell_escape(status), shell_escape(status),
+        shell_escape(pid)
+      ))
+      running[next_job] = { log = log, status = status, pid = pid }
+      running_count = running_count + 1
+      next_job = next_job + 1
+    end
+
+    local progressed = false
+    for i, r in pairs(running) do
+      local code_text = M.read_file(r.status)
+      if code_text then
+        local exit_code = tonumber(code_text:match("%-?%d+")) or -1
+        local output = M.read_file(r.log) or ""
+        os.remove(r.status)
+        os.remove(r.log)
+        os.remove(r.pid)
+        running[i] = nil
+        running_count = running_count - 1
+        finished = finished + 1
+        progressed = true
+        local reason = exit_code > 128 and "signal" or "exit"
+        on_done(jobs[i], exit_code == 0, exit_code, output, reason)
+      end
+    end
+
+    if not progressed then
+      os.execute("sleep 0.1")
+    end
+  end
+
+  os.execute("rm -rf " .. shell_escape(workdir))
+  return completed
+end
+
+-- Remove saídas antigas dos jobs (reexport forçado por overwrite ou fingerprint
+-- alterado): com o arquivo no lugar o darktable-cli gravaria <nome>_01.<ext> e a
+-- saída antiga passaria por exportada. Retorna os jobs prontos e erros dos que
+-- não puderam ser liberados.
+local function clear_outputs(jobs)
+  local ready, errors = {}, {}
+  for _, job in ipairs(jobs) do
+    local ok, err = os.remove(job.output)
+    if not ok and file_exists(job.output) then
+      table.insert(errors, {
+        order = job.order,
+        id = job.id,
+        input = job.input,
+        output = job.output,
+        command = job.cmd,
+        exit_reason = "stale_output",
+        stderr = tostring(err),
+      })
+    else
+      table.insert(ready, job)
+    end
+  end
+  return ready, errors
+end
+
+-- Mesma ordem da lista de entrada, independente da ordem de término
+local function ordered_errors(errors)
+  table.sort(errors, function(a, b) return a.order < b.order end)
+  for _, e in ipairs(errors) do
+    e.order = nil
+  end
+  return errors
+end
+
+-- Exporta os jobs ({ order, id, input, output, cmd, fingerprint? }) já filtrados;
+-- os que têm fingerprint entram no manifesto de target_dir ao serem exportados.
+-- opts: { cli, target_dir, format, overwrite, max_parallel, batch_size }
+-- hooks (opcional): { on_progress(exported, failed), should_stop() }
+-- Retorna exported, errors (na ordem de entrada) e cancelled.
+function M.run_export(jobs, opts, hooks)
+  hooks = hooks or {}
+  local on_progress = hooks.on_progress or function() end
+  local should_stop = hooks.should_stop
+  local max_parallel = opts.max_parallel or M.default_parallel()
+  local batch_size = opts.batch_size or M.default_batch()
+
+  local exported = 0
+  local done_jobs = {}
+  -- saída ausente antes do run: existir depois significa arquivo novo
+  local errors
+  jobs, errors = clear_outputs(jobs)
+  local function mark_exported(job)
+    exported = exported + 1
+    if job.fingerprint then
+      table.insert(done_jobs, job)
+    end
+  end
+
+  -- Fase 1: lotes com várias entradas por darktable-cli (saída em diretório +
+  -- --out-ext), amortizando a inicialização. O que não aparecer no destino
+  -- volta para a fase 2, um processo por imagem, com erro atribuído exato.
+  if batch_size > 1 and #jobs > 1 then
+    local batches, single, seen_outputs = {}, {}, {}
+    local current = nil
+    for _, job in ipairs(jobs) do
+      if seen_outputs[job.output] then
+        -- mesmo nome de saída: em lote o darktable renomearia (_01)
+        table.insert(single, job)
+      else
+        seen_outputs[job.output] = true
+        if not current or #current.members == batch_size then
+          current = { members = {} }
+          table.insert(batches, current)
+        end
+        table.insert(current.members, job)
+      end
+    end
+
+    for _, batch in ipairs(batches) do
+      local inputs = {}
+      for _, job in ipairs(batch.members) do
+        table.insert(inputs, shell_escape(job.input))
+      end
+      -- $(FILE_NAME) é expandido pelo darktable-cli (aspas simples evitam o shell)
+      batch.cmd = string.format(
+        "%s %s %s --out-ext %s",
+        opts.cli,
+        table.concat(inputs, " "),
+        shell_escape(opts.target_dir .. "/$(FILE_NAME)"),
+        shell_escape(opts.format)
+      )
+    end
+
+    local completed = M.run_commands_parallel(batches, max_parallel, function(batch, success, exit_code)
+      for _, job in ipairs(batch.members) do
+        if file_exists(job.output) then
+          mark_exported(job)
+        else
+          table.insert(single, job)
+        end
+      end
+      if not success then
+        io.stderr:write(string.format(
+          "[export] lote de %d falhou (exit=%s); refazendo pendentes individualmente\n",
+          #batch.members, tostring(exit_code)
+        ))
+      end
+      on_progress(exported, #errors)
+    end, should_stop)
+    if not completed then
+      record_exports(opts.target_dir, done_jobs)
+      return exported, ordered_errors(errors), true
+    end
+
+    table.sort(single, function(a, b) return a.order < b.order end)
+    jobs = single
+  end
+
+  local completed = M.run_commands_parallel(jobs, max_parallel, function(job, success, exit_code, output, exit_reason)
+    if success then
+      mark_exported(job)
+    else
+      table.insert(errors, {
+        order = job.order,
+        id = job.id,
+        input = job.input,
+        output = job.output,
+        command = job.cmd,
+        exit = exit_code,
+        exit_reason = exit_reason,
+        stderr = output,
+      })
+      io.stderr:write(string.format(
+        "[export] falha exportando id=%s exit=%s motivo=%s stderr=%s\n",
+        tostring(job.id),
+        tostring(exit_code),
+        tostring(exit_reason),
+        (output or ""):gsub("\n", " ")
+      ))
+    end
+    on_progress(exported, #errors)
+  end, should_stop)
+
+  record_exports(opts.target_dir, done_jobs)
+  return exported, ordered_errors(errors), not completed
+end
+
+return M
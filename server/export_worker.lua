@@ -0,0 +1,91 @@
+#!/usr/bin/env lua
+
+--------------------------------------------------
+-- Worker de exportação assíncrona (export_start)
+-- Uso: lua export_worker.lua <job_dir>
+--
+-- Lê <job_dir>/spec.json (montado pelo servidor), roda o pool de
+-- darktable-cli e mantém <job_dir>/status.json atualizado a cada imagem.
+-- A existência de <job_dir>/cancel encerra os processos em andamento.
+--------------------------------------------------
+
+local function get_script_dir()
+  local source = debug.getinfo(1, "S").source
+  if source:sub(1, 1) == "@" then
+    return source:sub(2):match("(.*/)") or "./"
+  end
+  return "./"
+end
+
+package.path = package.path .. ";" .. get_script_dir() .. "?.lua"
+
+local json        = require "dkjson"
+local export_pool = require "export_pool"
+
+local job_dir = arg and arg[1]
+if not job_dir then
+  io.stderr:write("uso: export_worker.lua <job_dir>\n")
+  os.exit(2)
+end
+
+local started = os.time()
+local status = {
+  job_id   = job_dir:match("([^/]+)/*$"),
+  state    = "running",
+  total    = 0,
+  exported = 0,
+  failed   = 0,
+  errors   = {},
+}
+
+local function write_status()
+  local now = os.time()
+  local elapsed = os.difftime(now, started)
+  status.remaining = status.total - status.exported - status.failed
+  status.elapsed_s = elapsed
+  status.images_per_sec = elapsed > 0
+    and math.floor((status.exported + status.failed) / elapsed * 100 + 0.5) / 100
+    or 0
+  status.updated_at = now
+
+  -- rename atômico: export_status nunca lê um arquivo pela metade
+  local tmp = job_dir .. "/status.json.tmp"
+  local f = assert(io.open(tmp, "w"))
+  f:write(json.encode(status))
+  f:close()
+  os.rename(tmp, job_dir .. "/status.json")
+end
+
+local ok, err = pcall(function()
+  local spec, _, decode_err = json.decode(export_pool.read_file(job_dir .. "/spec.json") or "")
+  if type(spec) ~= "table" then
+    error("spec.json inválido: " .. tostring(decode_err))
+  end
+
+  status.total = #spec.jobs
+  status.target_dir = spec.target_dir
+  write_status()
+
+  local cancel_file = job_dir .. "/cancel"
+  local exported, errors, cancelled = export_pool.run_export(spec.jobs, spec, {
+    on_progress = function(exported, failed)
+      status.exported, status.failed = exported, failed
+      write_status()
+    end,
+    should_stop = function()
+      return export_pool.file_exists(cancel_file)
+    end,
+  })
+
+  status.exported = exported
+  status.failed = #errors
+  status.errors = errors
+  status.state = cancelled and "cancelled" or "done"
+end)
+
+if not ok then
+  status.state = "failed"
+  status.message = tostring(err)
+  io.stderr:write("[export_worker] " .. tostring(err) .. "\n")
+end
+write_status()
@@ -0,0 +1,96 @@
+--------------------------------------------------
+-- Codec JSON do servidor MCP
+-- Usa lua-cjson ou lua-rapidjson quando instalados (em C, bem mais rápidos
+-- em listagens grandes) e cai para o dkjson.lua puro caso contrário.
+-- DT_MCP_JSON=cjson|rapidjson|dkjson força um backend.
+--
+-- Interface comum: encode(value) -> string; decode(s) -> value | nil, erro.
+-- JSON null é decodificado como nil (mesmo comportamento do dkjson usado antes).
+--------------------------------------------------
+
+local M = {}
+
+local function strip_nulls(value, null)
+  if value == null then return nil end
+  if type(value) == "table" then
+    for k, v in pairs(value) do
+      if v == null then
+        value[k] = nil
+      else
+        strip_nulls(v, null)
+      end
+    end
+  end
+  return value
+end
+
+local backends = {}
+
+function backends.cjson()
+  local ok, cjson = pcall(require, "cjson")
+  if not ok then return nil end
+  local c = cjson.new and cjson.new() or cjson
+  -- Sem esta opção (extensão do OpenResty), listas vazias sairiam como {}
+  if not pcall(c.encode_empty_table_as_object, false) then
+    return nil
+  end
+  c.encode_sparse_array(true)
+  pcall(c.encode_escape_forward_slash, false)
+  return {
+    encode = c.encode,
+    decode = function(s)
+      local ok_decode, value = pcall(c.decode, s)
+      if not ok_decode then return nil, value end
+      return strip_nulls(value, c.null)
+    end,
+  }
+end
+
+function backends.rapidjson()
+  local ok, rapidjson = pcall(require, "rapidjson")
+  if not ok then return nil end
+  local encode_opts = { empty_table_as_array = true }
+  return {
+    encode = function(value)
+      return rapidjson.encode(value, encode_opts)
+    end,
+    decode = function(s)
+      local value, err = rapidjson.decode(s)
+      if value == nil then return nil, err end
+      return strip_nulls(value, rapidjson.null)
+    end,
+  }
+end
+
+function backends.dkjson()
+  local dkjson = require "dkjson"
+  local encode_opts = { indent = false }
+  return {
+    encode = function(value)
+      return dkjson.encode(value, encode_opts)
+    end,
+    decode = function(s)
+      local value, _, err = dkjson.decode(s, 1, nil)
+      if err then return nil, err end
+      return value
+    end,
+  }
+end
+
+local order = { "cjson", "rapidjson", "dkjson" }
+local forced = os.getenv("DT_MCP_JSON")
+if forced and backends[forced] then
+  order = { forced, "dkjson" }
+end
+
+for _, name in ipairs(order) do
+  local backend = backends[name]()
+  if backend then
+    M.name   = name
+    M.encode = backend.encode
+    M.decode = backend.decode
+    break
+  end
+end
+
+return M
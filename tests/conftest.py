@@ -3,12 +3,21 @@ Test fixtures for image testing.
 Provides utility functions and mock images for test suite.
 """
 import io
+import os
 import base64
-from pathlib import Path
 from PIL import Image
 import tempfile
 import pytest
 
+# Testes não devem gravar no cache de miniaturas padrão (BASE_DIR/cache)
+os.environ.setdefault("DT_MCP_THUMB_CACHE", "0")
+# ...nem no snapshot do catálogo (fetch_images listaria pelo SQLite)
+os.environ.setdefault("DT_MCP_CATALOG_CACHE", "0")
+# ...nem em logs/metrics.jsonl
+os.environ.setdefault(
+    "DT_MCP_METRICS_PATH", os.path.join(tempfile.mkdtemp(prefix="dt-mcp-metrics-"), "metrics.jsonl")
+)
+
 
 @pytest.fixture
 def temp_image_path(tmp_path):
@@ -12,6 +12,39 @@ from unittest.mock import Mock, patch, MagicMock
 from batch_processor import build_messages, BatchProcessor
 
 
+def _vision(idx, size=400, dhash=None, sharpness=0.0):
+    """VisionImage sintética; ``size`` = comprimento do base64 (múltiplo de 4)."""
+    from common import VisionImage
+
+    return VisionImage(
+        meta={"id": idx, "filename": f"img_{idx}.jpg", "rating": 0},
+        path=Path(f"/fotos/img_{idx}.jpg"),
+        data=b"\0" * (size * 3 // 4),
+        dhash=dhash,
+        sharpness=sharpness,
+    )
+
+
+@pytest.fixture
+def process_mocks():
+    """Isola _process_common do MCP, do disco e dos prompts; devolve os mocks."""
+    from types import SimpleNamespace
+
+    with patch('batch_processor.fetch_images') as fetch, \
+            patch('batch_processor.prepare_vision_payloads_async') as prepare, \
+            patch('batch_processor.get_prompt', return_value="system"), \
+            patch('batch_processor.save_log') as save:
+        provider = Mock()
+        provider.__class__.__name__ = "OllamaProvider"
+        provider.model = "fake"
+
+        def load(vision):
+            fetch.return_value = [v.meta for v in vision]
+            prepare.return_value = (vision, [])
+
+        yield SimpleNamespace(fetch=fetch, prepare=prepare, save=save, provider=provider, load=load)
+
+
 class TestBuildMessages:
     """Tests for build_messages function."""
     
@@ -37,8 +70,7 @@ class TestBuildMessages:
             VisionImage(
                 meta=mock_image_dict,
                 path=Path("/test/img.jpg"),
-                b64="fakebase64",
-                data_url="data:image/jpeg;base64,fakebase64"
+                data=b"fakejpeg",
             )
         ]
         sample = [mock_image_dict]
@@ -217,3 +249,154 @@ class TestMessageFormatting:
         for msg in messages:
             assert "role" in msg
             assert "content" in msg
+
+
+class TestPayloadChunking:
+    """Tests for chunked multi-request LLM batching."""
+
+    def test_chunks_respect_max_bytes(self):
+        from batch_processor import chunk_vision_images
+
+        images = [_vision(i, 1000) for i in range(5)]
+        chunks = chunk_vision_images(images, 2600)
+
+        assert [len(c) for c in chunks] == [2, 2, 1]
+        assert [item.meta["id"] for c in chunks for item in c] == [0, 1, 2, 3, 4]
+
+    def test_oversized_image_gets_own_chunk(self):
+        from batch_processor import chunk_vision_images
+
+        images = [_vision(0, 100), _vision(1, 5000), _vision(2, 100)]
+        assert [len(c) for c in chunk_vision_images(images, 1000)] == [1, 1, 1]
+
+    def test_text_only_is_single_empty_chunk(self):
+        from batch_processor import chunk_vision_images
+
+        assert chunk_vision_images([], 1000) == [[]]
+
+    def test_merge_plan_answers(self):
+        from batch_processor import merge_plan_answers
+
+        answers = [
+            '{"edits": [{"id": 1, "rating": 3}], "tags": [{"tag": "praia", "ids": [1]}], "ids": [1]}',
+            '```json\n{"edits": [{"id": 2, "rating": 5}], "tags": [{"tag": "praia", "ids": [2]}], "ids": [1, 2]}\n```',
+            "não é json",
+        ]
+        merged, failed = merge_plan_answers(answers)
+
+        assert failed == [3]
+        assert merged["edits"] == [{"id": 1, "rating": 3}, {"id": 2, "rating": 5}]
+        assert merged["tags"] == [{"tag": "praia", "ids": [1, 2]}]
+        assert merged["ids"] == [1, 2]
+
+    def test_process_common_sends_chunks(self, process_mocks):
+        from types import SimpleNamespace
+        import json
+
+        process_mocks.load([_vision(i, 400 * 1024) for i in range(3)])
+        provider = process_mocks.provider
+        provider.chat.side_effect = lambda messages: (
+            json.dumps({"edits": [{"id": m["content"].split()[1].split("=")[1], "rating": 4}
+                                  for m in messages if m.get("images")]}),
+            {"latency_ms": 10},
+        )
+
+        args = SimpleNamespace(
+            source="all", limit=10, text_only=False, prompt_variant="basico",
+            max_payload_mb=0.9, max_inflight=2,
+        )
+        processor = BatchProcessor(client=Mock(), provider=provider)
+        answer, _, sample, _, meta, _ = processor._process_common("rating", args)
+
+        assert provider.chat.call_count == 2
+        assert len(meta["chunks"]) == 2
+        assert [e["id"] for e in json.loads(answer)["edits"]] == ["0", "1", "2"]
+
+
+class TestNearDuplicates:
+    """Tests for burst grouping and fan-out of the model decision."""
+
+    def test_groups_consecutive_frames(self):
+        from batch_processor import group_near_duplicates
+
+        images = [
+            _vision(1, dhash=0b0000), _vision(2, dhash=0b0001), _vision(3, dhash=0b0011),
+            _vision(4, dhash=0b1111_0000), _vision(5, dhash=None), _vision(6, dhash=0b0000),
+        ]
+        groups = group_near_duplicates(images, threshold=2)
+
+        assert [(rep.meta["id"], [m.meta["id"] for m in members]) for rep, members in groups] == [
+            (1, [2, 3]), (4, []), (5, []), (6, []),
+        ]
+
+    def test_pick_sharpest(self):
+        from batch_processor import group_near_duplicates
+
+        images = [
+            _vision(1, dhash=0, sharpness=1.0), _vision(2, dhash=0, sharpness=5.0), _vision(3, dhash=0, sharpness=2.0),
+        ]
+        [(rep, members)] = group_near_duplicates(images, threshold=0, pick_sharpest=True)
+
+        assert rep.meta["id"] == 2
+        assert [m.meta["id"] for m in members] == [1, 3]
+
+    def test_expand_plan_to_groups(self):
+        from batch_processor import expand_plan_to_groups
+
+        plan = {
+            "mode": "rating",
+            "edits": [{"id": "1", "rating": 4}, {"id": 9, "rating": 1}],
+            "tags": [{"tag": "praia", "ids": [1, 9]}],
+            "ids_para_exportar": [1],
+        }
+        expanded = expand_plan_to_groups(plan, {1: [2, 3], 9: []})
+
+        assert expanded["edits"] == [
+            {"id": "1", "rating": 4}, {"id": 2, "rating": 4}, {"id": 3, "rating": 4}, {"id": 9, "rating": 1},
+        ]
+        assert expanded["tags"] == [{"tag": "praia", "ids": [1, 9, 2, 3]}]
+        assert expanded["ids_para_exportar"] == [1, 2, 3]
+        assert expanded["mode"] == "rating"
+
+    def test_expand_plan_with_string_ids(self):
+        from batch_processor import expand_plan_to_groups
+
+        # o modelo devolve ids como string; os grupos vêm do catálogo como int
+        plan = {
+            "edits": [{"id": "12", "rating": 3}],
+            "tags": [{"tag": "festa", "ids": ["12", "13"]}],
+            "ids_para_exportar": ["12", "13"],
+        }
+        expanded = expand_plan_to_groups(plan, {12: [13, 14]})
+
+        assert expanded["edits"] == [
+            {"id": "12", "rating": 3}, {"id": 13, "rating": 3}, {"id": 14, "rating": 3},
+        ]
+        assert expanded["tags"] == [{"tag": "festa", "ids": ["12", "13", 14]}]
+        assert expanded["ids_para_exportar"] == ["12", "13", 14]
+
+    def test_process_common_sends_one_frame_per_burst(self, process_mocks):
+        from types import SimpleNamespace
+        import json
+
+        process_mocks.load([_vision(1, dhash=0), _vision(2, dhash=1), _vision(3, dhash=0xFFFF)])
+        provider = process_mocks.provider
+        provider.chat.return_value = (
+            '{"edits": [{"id": 1, "rating": 5}, {"id": 3, "rating": 2}]}', {"latency_ms": 10},
+        )
+
+        args = SimpleNamespace(
+            source="all", limit=10, text_only=False, prompt_variant="basico",
+            max_payload_mb=12, max_inflight=1, dedupe_threshold=4,
+        )
+        processor = BatchProcessor(client=Mock(), provider=provider)
+        answer, _, _, prepared, _, _ = processor._process_common("rating", args)
+
+        assert process_mocks.prepare.call_args.kwargs["fingerprint"] is True
+        sent = provider.chat.call_args.args[0]
+        assert sum(1 for m in sent if m.get("images")) == 2
+        assert json.loads(answer)["edits"] == [
+            {"id": 1, "rating": 5}, {"id": 2, "rating": 5}, {"id": 3, "rating": 2},
+        ]
+        assert len(prepared) == 3
+        assert process_mocks.save.call_args.kwargs["extra"]["duplicates"] == {1: [2]}
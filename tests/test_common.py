@@ -2,6 +2,7 @@
 Comprehensive tests for common.py module.
 Tests encoding, async processing, logging, and MCP client functionality.
 """
+import json
 import sys
 from pathlib import Path
 import threading
@@ -15,7 +16,27 @@ from common import (
     encode_image_to_base64,
     prepare_vision_payloads,
     prepare_vision_payloads_async,
+    backoff_delay,
+    append_export_result_to_log,
+    CatalogSnapshot,
+    decode_image_list,
+    fetch_images,
+    ImagePayload,
+    iter_images,
+    JsonBody,
+    load_runs,
+    make_http_session,
+    format_progress_line,
+    hamming_distance,
+    image_fingerprint,
+    parse_progress_line,
+    post_json_with_retries,
+    prune_run_logs,
+    read_run_journal,
+    run_export_job,
+    save_log,
     setup_logging,
+    ThumbnailCache,
     VisionImage
 )
 
@@ -40,6 +61,22 @@ class TestImageEncoding:
         # Resized image should be smaller
         assert len(b64_small) < len(b64_original)
     
+    def test_encode_large_jpeg_uses_draft(self, temp_large_image_path):
+        """Test that large JPEGs are decoded at reduced scale via draft()."""
+        import base64
+        import io
+        from PIL import Image, JpegImagePlugin
+
+        with patch.object(
+            JpegImagePlugin.JpegImageFile, "draft", autospec=True,
+            side_effect=JpegImagePlugin.JpegImageFile.draft,
+        ) as draft:
+            b64, _ = encode_image_to_base64(temp_large_image_path, max_dimension=800, use_cache=False)
+
+        assert draft.called
+        with Image.open(io.BytesIO(base64.b64decode(b64))) as out:
+            assert max(out.size) == 800
+
     def test_encode_png_converts_to_jpeg(self, temp_png_image_path):
         """Test that PNG images are converted to JPEG."""
         b64, data_url = encode_image_to_base64(temp_png_image_path)
@@ -64,6 +101,63 @@ class TestImageEncoding:
         assert len(b64_1600) >= len(b64_800)
 
 
+class TestThumbnailCache:
+    """Tests for the on-disk thumbnail cache used by encode_image_to_base64."""
+
+    def test_cache_hit_skips_pillow(self, temp_large_image_path, tmp_path):
+        """Test that a second encode is served from cache without decoding."""
+        cache = ThumbnailCache(tmp_path / "cache")
+        b64_first, _ = encode_image_to_base64(temp_large_image_path, cache=cache)
+
+        with patch("common.Image.open", side_effect=AssertionError("Pillow chamado")):
+            b64_second, data_url = encode_image_to_base64(temp_large_image_path, cache=cache)
+
+        assert b64_second == b64_first
+        assert data_url.startswith("data:image/jpeg;base64,")
+
+    def test_key_changes_with_source_and_params(self, temp_image_path):
+        """Test that mtime, max_dimension and quality are part of the key."""
+        import os
+
+        key = ThumbnailCache.make_key(temp_image_path, 1600, 85)
+        assert key != ThumbnailCache.make_key(temp_image_path, 800, 85)
+        assert key != ThumbnailCache.make_key(temp_image_path, 1600, 70)
+
+        st = temp_image_path.stat()
+        os.utime(temp_image_path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+        assert key != ThumbnailCache.make_key(temp_image_path, 1600, 85)
+
+    def test_missing_source_has_no_key(self, tmp_path):
+        """Test that a missing file yields no key (encode raises normally)."""
+        assert ThumbnailCache.make_key(tmp_path / "missing.jpg", 1600, 85) is None
+
+    def test_eviction_by_total_bytes(self, tmp_path):
+        """Test LRU eviction keeps the cache under max_bytes."""
+        import os
+
+        cache = ThumbnailCache(tmp_path / "cache", max_bytes=2500)
+        for i in range(4):
+            key = f"{i:02d}" + "0" * 62
+            cache.put(key, b"x" * 1000)
+            entry = cache._entry_path(key)
+            os.utime(entry, (1000 + i, 1000 + i))
+
+        total = sum(p.stat().st_size for p in (tmp_path / "cache").glob("*/*.jpg"))
+        assert total <= 2500
+        # A entrada mais recente sobrevive, a mais antiga não
+        assert cache.get("03" + "0" * 62) is not None
+        assert cache.get("00" + "0" * 62) is None
+
+    def test_overwrite_does_not_double_count(self, tmp_path):
+        """Test that rewriting a key replaces its size in the running total."""
+        cache = ThumbnailCache(tmp_path / "cache", max_bytes=10_000)
+        cache.put("aa" + "0" * 62, b"x" * 100)
+        for _ in range(5):
+            cache.put("bb" + "0" * 62, b"x" * 1000)
+
+        assert cache._total_bytes == 1100
+
+
 class TestSyncVisionPayloads:
     """Tests for prepare_vision_payloads (synchronous version)."""
     
@@ -228,6 +322,37 @@ class TestAsyncVisionPayloads:
             expected_id = mock_image_list[i]["id"]
             assert payload.meta["id"] == expected_id
     
+    def test_async_process_backend(self, mock_image_list):
+        """Test that the process pool backend matches the thread backend."""
+        thread_payloads, _ = prepare_vision_payloads_async(
+            mock_image_list, attach_images=True, max_workers=2, backend="thread"
+        )
+        process_payloads, errors = prepare_vision_payloads_async(
+            mock_image_list, attach_images=True, max_workers=2, backend="process"
+        )
+
+        assert errors == []
+        assert [p.meta["id"] for p in process_payloads] == [img["id"] for img in mock_image_list]
+        assert [p.b64 for p in process_payloads] == [p.b64 for p in thread_payloads]
+
+    def test_process_pool_is_reused_and_not_forked(self, mock_image_list):
+        """The process pool is created once per run, without fork."""
+        from common import get_prep_executor
+
+        for _ in range(2):
+            _, errors = prepare_vision_payloads_async(
+                mock_image_list, attach_images=True, max_workers=2, backend="process"
+            )
+            assert errors == []
+        executor = get_prep_executor("process", 2)
+        assert executor is get_prep_executor("process", 2)
+        assert executor._mp_context.get_start_method() != "fork"
+
+    def test_async_invalid_backend(self, mock_image_list):
+        """Test that an unknown backend is rejected."""
+        with pytest.raises(ValueError):
+            prepare_vision_payloads_async(mock_image_list, attach_images=True, backend="gpu")
+
     def test_async_error_handling(self, tmp_path):
         """Test async error handling with missing files."""
         bad_images = [
@@ -250,6 +375,451 @@ class TestAsyncVisionPayloads:
         assert len(errors) == 3
 
 
+class TestHttpRetries:
+    """Tests for post_json_with_retries with pooled sessions and backoff."""
+
+    def test_backoff_is_bounded_exponential(self):
+        for attempt in range(1, 8):
+            delay = backoff_delay(attempt, 1.0, cap=10.0)
+            assert 0 <= delay <= min(10.0, 2 ** (attempt - 1))
+
+    def test_session_reused_and_busy_status_retried(self):
+        busy = MagicMock(status_code=503, headers={"Retry-After": "0"})
+        ok = MagicMock(status_code=200, headers={})
+        session = make_http_session()
+        with patch.object(session, "post", side_effect=[busy, ok]) as post, \
+                patch("common.requests.post") as module_post, patch("common.time.sleep") as sleep:
+            resp, _ = post_json_with_retries("http://x/api", {}, timeout=1, retries=2, session=session)
+
+        assert resp is ok
+        assert post.call_count == 2
+        module_post.assert_not_called()
+        busy.close.assert_called_once()
+        sleep.assert_called_once_with(0.0)
+
+    def test_exception_retry_uses_jittered_backoff(self):
+        import requests
+
+        ok = MagicMock(status_code=200, headers={})
+        with patch("common.requests.post", side_effect=[requests.ConnectionError("x"), ok]), \
+                patch("common.time.sleep") as sleep, patch("common.random.uniform", return_value=0.3) as uniform:
+            resp, _ = post_json_with_retries("http://x/api", {}, timeout=1, retries=1, retry_delay=2.0)
+
+        assert resp is ok
+        uniform.assert_called_once_with(0, 2.0)
+        sleep.assert_called_once_with(0.3)
+
+
+class TestJsonBody:
+    """Tests for the streamed JSON request body."""
+
+    def _messages(self, sizes):
+        images = [VisionImage(meta={}, path=Path(f"/f/{i}.jpg"), data=bytes(range(256)) * (n // 256) + b"x" * (n % 256))
+                  for i, n in enumerate(sizes)]
+        return images, {
+            "model": "m",
+            "stream": False,
+            "messages": [
+                {"role": "system", "content": "Avalie as fotos ✓"},
+                {"role": "user", "content": "img", "images": [ImagePayload(images[0])]},
+                {"role": "user", "content": [
+                    {"type": "image_url", "image_url": {"url": ImagePayload(images[1], data_url=True)}},
+                ]},
+            ],
+            "options": {"temperature": 0.2, "seed": None},
+        }
+
+    def test_matches_json_dumps(self):
+        images, payload = self._messages([200_001, 5])
+        body = b"".join(JsonBody(payload, buffer_size=1000))
+        decoded = json.loads(body)
+
+        assert decoded["messages"][1]["images"] == [images[0].b64]
+        assert decoded["messages"][2]["content"][0]["image_url"]["url"] == images[1].data_url
+        assert decoded["options"] == {"temperature": 0.2, "seed": None}
+        assert len(JsonBody(payload)) == len(body)
+
+    def test_chunks_stay_small(self):
+        _, payload = self._messages([3_000_000, 10])
+        sizes = [len(chunk) for chunk in JsonBody(payload, buffer_size=64 * 1024)]
+        assert sum(sizes) > 4_000_000
+        assert max(sizes) < 64 * 1024 + 48 * 1024 * 2
+
+    def test_sent_with_content_length_and_retried(self):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        received = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                received.append(self.rfile.read(int(self.headers["Content-Length"])))
+                self.send_response(503 if len(received) == 1 else 200)
+                self.send_header("Retry-After", "0")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            images, payload = self._messages([100_000, 10])
+            resp, _ = post_json_with_retries(
+                f"http://127.0.0.1:{server.server_address[1]}/api/chat", payload, timeout=5, retries=1,
+            )
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        assert resp.status_code == 200
+        assert len(received) == 2 and received[0] == received[1]
+        assert json.loads(received[1])["messages"][1]["images"] == [images[0].b64]
+
+
+class TestImagePagination:
+    """Tests for cursor-based iter_images/fetch_images."""
+
+    class FakeClient:
+        def __init__(self, total, paginate=True):
+            self.images = [{"id": i} for i in range(1, total + 1)]
+            self.paginate = paginate
+            self.calls = []
+
+        def call_tool(self, name, params):
+            self.calls.append((name, dict(params)))
+            if not self.paginate:
+                return {"content": [{"type": "json", "json": self.images}]}
+            start = int(params.get("cursor") or 0)
+            page = self.images[start:start + params.get("limit", len(self.images))]
+            end = start + len(page)
+            result = {"content": [{"type": "json", "json": page}], "total": len(self.images)}
+            if end < len(self.images):
+                result["nextCursor"] = str(end)
+            return result
+
+    def _args(self, **overrides):
+        from types import SimpleNamespace
+        base = dict(source="all", min_rating=-2, only_raw=False, path_contains=None, tag=None, collection=None)
+        base.update(overrides)
+        return SimpleNamespace(**base)
+
+    def test_iter_images_follows_cursor(self):
+        client = self.FakeClient(25)
+        ids = [img["id"] for img in iter_images(client, self._args(), page_size=10)]
+
+        assert ids == list(range(1, 26))
+        assert [c[1].get("cursor") for c in client.calls] == [None, "10", "20"]
+
+    def test_limit_only_transfers_needed_pages(self):
+        client = self.FakeClient(1000)
+        images = fetch_images(client, self._args(source="tag", tag="job"), limit=15)
+
+        assert len(images) == 15
+        assert len(client.calls) == 1
+        name, params = client.calls[0]
+        assert name == "list_by_tag" and params["limit"] == 15 and params["tag"] == "job"
+
+    def test_server_without_pagination_is_truncated(self):
+        client = self.FakeClient(50, paginate=False)
+        assert len(fetch_images(client, self._args(), limit=7)) == 7
+        assert len(fetch_images(client, self._args())) == 50
+
+
+class TestExportJobs:
+    """Tests for run_export_job polling and the GUI progress line format."""
+
+    class FakeClient:
+        def __init__(self, states, has_jobs=True):
+            self.states = list(states)
+            self.has_jobs = has_jobs
+            self.calls = []
+
+        def call_tool(self, name, params):
+            self.calls.append(name)
+            if name == "export_start":
+                if not self.has_jobs:
+                    raise RuntimeError({"code": -32601, "message": "Unknown tool: export_start"})
+                return {"content": [{"type": "text", "text": "ok"}, {"type": "json", "json": {"job_id": "j1"}}]}
+            if name == "export_status":
+                state, exported = self.states.pop(0)
+                status = {"state": state, "total": 4, "exported": exported, "failed": 0, "images_per_sec": 2.0}
+                return {"content": [{"type": "text", "text": state}, {"type": "json", "json": status}]}
+            return {"content": [{"type": "text", "text": name}]}
+
+    def test_polls_until_done_and_reports_progress(self):
+        client = self.FakeClient([("running", 1), ("running", 3), ("done", 4)])
+        progress = []
+        result = run_export_job(
+            client, {"target_dir": "out"}, lambda *p: progress.append(p), poll_interval=0
+        )
+
+        assert result["content"][0]["text"] == "done"
+        assert [p[:2] for p in progress] == [(1, 4), (3, 4), (4, 4)]
+        assert client.calls == ["export_start"] + ["export_status"] * 3
+
+    def test_falls_back_to_blocking_export(self):
+        client = self.FakeClient([], has_jobs=False)
+        result = run_export_job(client, {"target_dir": "out"}, poll_interval=0)
+
+        assert result["content"][0]["text"] == "export_collection"
+
+    def test_interrupt_cancels_job(self):
+        client = self.FakeClient([("running", 0)])
+        with patch("common.time.sleep", side_effect=KeyboardInterrupt):
+            with pytest.raises(KeyboardInterrupt):
+                run_export_job(client, {"target_dir": "out"})
+
+        assert client.calls[-1] == "export_cancel"
+
+    def test_progress_line_roundtrip(self):
+        line = format_progress_line(3, 10, "Exportando (1.5 img/s)")
+        assert parse_progress_line(line) == (3, 10, "Exportando (1.5 img/s)")
+        assert parse_progress_line("[export] Resultado: ok") is None
+        assert parse_progress_line("[progress] x/10 oi") is None
+
+
+class TestColumnarImages:
+    """Tests for the columnar list format decoder."""
+
+    PAYLOAD = {
+        "format": "columnar",
+        "count": 3,
+        "paths": ["/fotos/a", "/fotos/b"],
+        "columns": {
+            "id": [1, 2, 3],
+            "path": [0, 0, 1],
+            "filename": ["1.cr2", "2.cr2", "3.jpg"],
+            "rating": [1, 5, 0],
+            "is_raw": [True, True, False],
+            "colorlabels": [0, 5, 16],
+        },
+    }
+
+    def test_expands_to_rows(self):
+        images = decode_image_list(self.PAYLOAD)
+
+        assert len(images) == 3
+        assert images[1] == {
+            "id": 2, "path": "/fotos/a", "filename": "2.cr2", "rating": 5,
+            "is_raw": True, "colorlabels": ["red", "green"],
+        }
+        assert images[-1]["path"] == "/fotos/b"
+        assert images[-1]["colorlabels"] == ["purple"]
+        assert [img["id"] for img in images] == [1, 2, 3]
+        assert [img["id"] for img in images[:2]] == [1, 2]
+
+    def test_rows_pass_through(self):
+        rows = [{"id": 1}]
+        assert decode_image_list(rows) is rows
+
+    def test_fetch_images_requests_columnar(self):
+        client = Mock()
+        client.call_tool.return_value = {"content": [{"type": "json", "json": self.PAYLOAD}]}
+        from types import SimpleNamespace
+        args = SimpleNamespace(source="all", min_rating=-2, only_raw=False)
+
+        images = fetch_images(client, args, limit=2)
+
+        assert [img["filename"] for img in images] == ["1.cr2", "2.cr2"]
+        assert client.call_tool.call_args.args[1]["format"] == "columnar"
+
+
+class TestCatalogSnapshot:
+    """Tests for the SQLite catalog snapshot and catalog_changes deltas."""
+
+    class FakeServer:
+        def __init__(self):
+            self.images = {
+                1: ("/fotos/a", "1.cr2", 1, True, 0, ["cliente"]),
+                2: ("/fotos/a", "2.jpg", 4, False, 1, []),
+                3: ("/fotos/b", "3.cr2", 5, True, 4, ["cliente", "best"]),
+            }
+            self.generation = 0
+            self.touched = {}
+            self.calls = []
+
+        def edit(self, image_id, **changes):
+            path, name, rating, raw, labels, tags = self.images[image_id]
+            rating = changes.get("rating", rating)
+            tags = changes.get("tags", tags)
+            self.images[image_id] = (path, name, rating, raw, labels, tags)
+            self.generation += 1
+            self.touched[image_id] = self.generation
+
+        def call_tool(self, name, params):
+            self.calls.append((name, dict(params)))
+            since = params.get("since")
+            if since is None:
+                ids = sorted(self.images)
+            else:
+                ids = sorted(i for i, g in self.touched.items() if g > int(since))
+            first = int(params.get("cursor", 0))
+            limit = params.get("limit", len(ids))
+            next_cursor = first + limit if first + limit < len(ids) else None
+            ids = ids[first:first + limit]
+            paths = sorted({self.images[i][0] for i in ids})
+            cols = {k: [] for k in ("id", "path", "filename", "rating", "is_raw", "colorlabels", "tags", "mtime")}
+            for i in ids:
+                path, filename, rating, raw, labels, tags = self.images[i]
+                for key, value in zip(cols, (i, paths.index(path), filename, rating, raw, labels, tags, 0)):
+                    cols[key].append(value)
+            images = {"format": "columnar", "count": len(ids), "paths": paths, "columns": cols}
+            changes = {"mode": "full" if since is None else "delta", "token": str(self.generation), "images": images}
+            result = {"content": [{"type": "text", "text": ""}, {"type": "json", "json": changes}]}
+            if next_cursor is not None:
+                result["nextCursor"] = str(next_cursor)
+            return result
+
+    def _args(self, **overrides):
+        from types import SimpleNamespace
+        base = dict(source="all", min_rating=-2, only_raw=False, path_contains=None, tag=None, collection=None)
+        base.update(overrides)
+        return SimpleNamespace(**base)
+
+    def test_full_then_delta(self, tmp_path):
+        server = self.FakeServer()
+        snapshot = CatalogSnapshot(tmp_path / "catalog.sqlite")
+
+        assert snapshot.sync(server)
+        assert [img["id"] for img in snapshot.query(self._args())] == [1, 2, 3]
+
+        server.edit(2, rating=0, tags=["cliente"])
+        assert snapshot.sync(server)
+        assert server.calls[-1][1] == {"since": "0", "limit": 2000}
+        assert [img["id"] for img in snapshot.query(self._args(min_rating=1))] == [1, 3]
+        assert [img["id"] for img in snapshot.query(self._args(source="tag", tag="cliente"))] == [1, 2, 3]
+        snapshot.close()
+
+    def test_filters_match_list_tools(self, tmp_path):
+        snapshot = CatalogSnapshot(tmp_path / "catalog.sqlite")
+        snapshot.sync(self.FakeServer())
+
+        assert snapshot.count(self._args(only_raw=True)) == 2
+        assert [i["id"] for i in snapshot.query(self._args(source="path", path_contains="/b"))] == [3]
+        assert [i["id"] for i in snapshot.query(self._args(source="tag", tag="best"))] == [3]
+        assert snapshot.query(self._args(), limit=1)[0] == {
+            "id": 1, "path": "/fotos/a", "filename": "1.cr2", "rating": 1, "is_raw": True, "colorlabels": [],
+        }
+        assert snapshot.query(self._args())[2]["colorlabels"] == ["green"]
+
+    def test_token_survives_reopen(self, tmp_path):
+        server = self.FakeServer()
+        CatalogSnapshot(tmp_path / "c.sqlite").sync(server)
+        server.edit(1, rating=5)
+
+        reopened = CatalogSnapshot(tmp_path / "c.sqlite")
+        reopened.sync(server)
+        assert server.calls[-1][1] == {"since": "0", "limit": 2000}
+        assert reopened.count(self._args(min_rating=5)) == 2
+
+    def test_full_sync_is_paged(self, tmp_path):
+        server = self.FakeServer()
+        snapshot = CatalogSnapshot(tmp_path / "c.sqlite")
+
+        assert snapshot.sync(server, page_size=2)
+        assert [params for _, params in server.calls] == [{"limit": 2}, {"limit": 2, "cursor": "2"}]
+        assert snapshot.count(self._args()) == 3
+        assert snapshot.token == "0"
+
+    def test_mode_change_between_pages_keeps_old_copy(self, tmp_path):
+        server = self.FakeServer()
+        snapshot = CatalogSnapshot(tmp_path / "c.sqlite")
+        snapshot.sync(server)
+        server.edit(1, rating=5)
+        server.edit(2, rating=5)
+        real_call = server.call_tool
+
+        def flip(name, params):
+            result = real_call(name, params)
+            if "cursor" in params:
+                result["content"][1]["json"]["mode"] = "full"
+            return result
+
+        server.call_tool = flip
+        assert snapshot.sync(server, page_size=1) is False
+        assert snapshot.token == "0"
+        assert snapshot.count(self._args(min_rating=5)) == 1
+
+    def test_server_without_tool(self, tmp_path):
+        client = Mock()
+        client.call_tool.side_effect = RuntimeError({"code": -32601, "message": "Unknown tool"})
+        assert CatalogSnapshot(tmp_path / "c.sqlite").sync(client) is False
+
+
+class TestRunJournal:
+    @pytest.fixture(autouse=True)
+    def _log_dir(self, tmp_path, monkeypatch):
+        import common
+        monkeypatch.setattr(common, "LOG_DIR", tmp_path)
+        monkeypatch.setattr(common, "_journal_seen", {})
+        monkeypatch.setattr(common, "_journal_pruned", True)
+        self.dir = tmp_path
+
+    def _images(self, rating=3):
+        return [{"id": i, "path": "/fotos", "filename": f"{i}.raw", "rating": rating} for i in (1, 2)]
+
+    def test_runs_share_image_metadata(self):
+        first = save_log("rating", "all", self._images(), "{}", extra={"llm": {"latency_ms": 5}})
+        second = save_log("tagging", "all", self._images(), "[]")
+
+        assert first.path == second.path and first.path.name.endswith(".jsonl.gz")
+        kinds = [r["type"] for r in read_run_journal(first.path)]
+        assert kinds == ["image", "image", "run", "run"]
+
+        runs = load_runs()
+        assert [r["mode"] for r in runs] == ["rating", "tagging"]
+        assert runs[1]["images_sample"][0]["filename"] == "1.raw"
+        assert runs[0]["extra"] == {"llm": {"latency_ms": 5}}
+
+    def test_changed_metadata_is_rewritten(self):
+        ref = save_log("rating", "all", self._images(), "{}")
+        save_log("rating", "all", self._images(rating=5), "{}")
+        kinds = [r["type"] for r in read_run_journal(ref.path)]
+        assert kinds.count("image") == 4
+        assert load_runs()[0]["images_sample"][0]["rating"] == 3
+
+    def test_dedupe_reads_other_writers_from_file(self):
+        import common
+        ref = save_log("rating", "all", self._images(), "{}")
+        # outro processo grava os mesmos ids com metadados diferentes
+        other = [dict(img, rating=5) for img in self._images()]
+        common._append_journal(ref.path, [
+            {"type": "image", "id": img["id"], "digest": common._image_digest(img), "meta": img} for img in other
+        ])
+
+        save_log("rating", "all", self._images(), "{}")
+        assert [r["images_sample"][0]["rating"] for r in load_runs()] == [3, 3]
+
+    def test_export_result_appended(self):
+        ref = save_log("export", "all", self._images(), "{}")
+        size = ref.path.stat().st_size
+        append_export_result_to_log(ref, {"content": [{"text": "ok"}]})
+
+        assert ref.path.stat().st_size > size
+        assert load_runs(mode="export")[0]["extra"]["export_result"] == {"content": [{"text": "ok"}]}
+
+    def test_uncompressed(self, monkeypatch):
+        monkeypatch.setenv("DT_MCP_RUN_LOG_COMPRESS", "none")
+        ref = save_log("rating", "all", self._images(), "{}")
+        assert ref.path.suffix == ".jsonl"
+        assert ref.path.read_text(encoding="utf-8").count("\n") == 3
+
+    def test_retention_by_age_and_size(self):
+        import os
+        old = self.dir / "batch-rating-20200101-000000.json"
+        old.write_text("{}")
+        os.utime(old, (0, 0))
+        big = [self.dir / f"runs-2026010{i}.jsonl" for i in (1, 2)]
+        for i, p in enumerate(big):
+            p.write_bytes(b"x" * 600_000)
+            os.utime(p, (time.time() - 10 + i, time.time() - 10 + i))
+
+        removed = prune_run_logs(days=30, max_mb=1)
+        assert removed == [old, big[0]]
+        assert big[1].exists()
+
+
 class TestLoggingSetup:
     """Tests for setup_logging function."""
     
@@ -283,6 +853,55 @@ class TestLoggingSetup:
         assert logger.level == logging.DEBUG
 
 
+class TestImageFingerprint:
+    """Tests for the perceptual hash used to collapse burst frames."""
+
+    @staticmethod
+    def _jpeg(seed=1, shift=0, blur=0):
+        import io
+        import random
+        from PIL import Image, ImageFilter
+
+        rng = random.Random(seed)
+        grid = Image.new("L", (8, 6))
+        grid.putdata([rng.randrange(256) for _ in range(48)])
+        img = grid.resize((340, 240), Image.Resampling.BICUBIC).crop((shift, 0, shift + 320, 240))
+        if blur:
+            img = img.filter(ImageFilter.GaussianBlur(blur))
+        buffer = io.BytesIO()
+        img.convert("RGB").save(buffer, "JPEG", quality=90)
+        return buffer.getvalue()
+
+    def test_near_frames_are_close(self):
+        base, _ = image_fingerprint(self._jpeg())
+        shifted, _ = image_fingerprint(self._jpeg(shift=2))
+        other, _ = image_fingerprint(self._jpeg(seed=2))
+
+        assert hamming_distance(base, shifted) <= 6
+        assert hamming_distance(base, other) > 12
+
+    def test_blur_lowers_sharpness(self):
+        _, sharp = image_fingerprint(self._jpeg())
+        _, blurry = image_fingerprint(self._jpeg(blur=3))
+        assert sharp > blurry
+
+    def test_numpy_and_pure_python_agree(self, monkeypatch):
+        pytest.importorskip("numpy")
+        import common
+
+        raw = self._jpeg(shift=5)
+        vectorized = image_fingerprint(raw)
+        monkeypatch.setattr(common, "np", None)
+        dhash, sharpness = image_fingerprint(raw)
+        assert dhash == vectorized[0]
+        assert sharpness == pytest.approx(vectorized[1], abs=1e-3)
+
+    def test_async_prep_fills_fingerprint(self, mock_image_list):
+        payloads, errors = prepare_vision_payloads_async(mock_image_list[:2], max_workers=2, fingerprint=True)
+        assert not errors
+        assert all(p.dhash is not None for p in payloads)
+
+
 class TestVisionImageDataclass:
     """Tests for VisionImage dataclass."""
     
@@ -293,14 +912,18 @@ class TestVisionImageDataclass:
         vi = VisionImage(
             meta=mock_image_dict,
             path=Path("/tmp/test.jpg"),
-            b64="base64data",
-            data_url="data:image/jpeg;base64,base64data"
+            data=b"jpegdata",
         )
         
         assert vi.meta == mock_image_dict
         assert vi.path == Path("/tmp/test.jpg")
-        assert vi.b64 == "base64data"
-        assert vi.data_url.startswith("data:image/jpeg")
+        assert vi.b64 == "anBlZ2RhdGE="
+        assert vi.data_url == "data:image/jpeg;base64,anBlZ2RhdGE="
+
+    def test_b64_size_is_arithmetic(self):
+        for n in range(0, 10):
+            vi = VisionImage(meta={}, path=Path("/tmp/x.jpg"), data=b"x" * n)
+            assert vi.b64_size == len(vi.b64)
     
     def test_vision_image_fields(self):
         """Test VisionImage has correct fields."""
@@ -308,7 +931,6 @@ class TestVisionImageDataclass:
         
         field_names = {f.name for f in fields(VisionImage)}
         
-        assert "meta" in field_names
-        assert "path" in field_names
-        assert "b64" in field_names
-        assert "data_url" in field_names
+        assert field_names == {"meta", "path", "data", "mime", "dhash", "sharpness"}
+        # base64 e data URL são derivados, não uma segunda cópia guardada
+        assert hasattr(VisionImage, "b64") and hasattr(VisionImage, "data_url")
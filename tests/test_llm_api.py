@@ -0,0 +1,243 @@
+"""
+Tests for llm_api.py module.
+Tests streaming consumption (NDJSON/SSE) and early stop on a complete JSON plan.
+"""
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "host"))
+
+import pytest
+from unittest.mock import MagicMock, patch
+from llm_api import JsonPlanWatcher, OllamaProvider, OpenAICompatProvider, achat_many, chat_many
+
+
+def _stream_response(lines):
+    resp = MagicMock()
+    resp.status_code = 200
+    resp.iter_lines.return_value = iter(lines)
+    return resp
+
+
+class TestJsonPlanWatcher:
+    """Tests for JsonPlanWatcher."""
+
+    def test_detects_closed_object(self):
+        watcher = JsonPlanWatcher()
+        assert not watcher.feed('  {"mode": "rating", "edits": [')
+        assert not watcher.feed('{"id": 1}]')
+        assert watcher.feed("}")
+
+    def test_starts_after_json_fence(self):
+        watcher = JsonPlanWatcher()
+        assert not watcher.feed("``")
+        assert not watcher.feed('`json\n[{"id": 1}')
+        assert watcher.feed("]\n```")
+        assert watcher.plan('```json\n[{"id": 1}]\n```') == '[{"id": 1}]'
+
+    def test_bracketed_prose_before_plan_never_stops_early(self):
+        watcher = JsonPlanWatcher()
+        assert not watcher.feed("Analisei as fotos [1, 2] e {ver notas}. Plano:\n")
+        assert not watcher.feed('{"mode": "rating", "edits": []}')
+
+    def test_ignores_braces_inside_strings(self):
+        watcher = JsonPlanWatcher()
+        assert not watcher.feed('{"notes": "chave } e \\" aspas {"')
+        assert watcher.feed("}")
+
+
+class TestStreamingProviders:
+    """Tests for streamed chat responses."""
+
+    def test_ollama_ndjson_stream(self):
+        pieces = ['{"mode": ', '"rating"', "}"]
+        lines = [json.dumps({"message": {"content": p}, "done": False}).encode() for p in pieces]
+        lines.append(json.dumps({"done": True, "eval_count": 30, "eval_duration": 2_000_000_000}).encode())
+        resp = _stream_response(lines)
+
+        with patch("requests.Session.post", return_value=resp) as post:
+            provider = OllamaProvider("http://localhost:11434", "m", stream=True)
+            content, meta = provider.chat([{"role": "user", "content": "oi"}])
+
+        assert post.call_args.kwargs["stream"] is True
+        assert post.call_args.kwargs["data"].payload["stream"] is True
+        assert json.loads(content) == {"mode": "rating"}
+        assert meta["streamed"] is True
+        assert meta["ttft_ms"] is not None
+        # Plano fechou antes da linha "done": leitura encerrada cedo
+        assert meta["stopped_early"] is True
+        resp.close.assert_called_once()
+
+    def test_fenced_plan_survives_early_stop(self):
+        from batch_processor import extract_json_from_markdown
+
+        pieces = ["```json\n", '{"edits": [{"id": 1, ', '"rating": 4}]}', "\n```\n"]
+        lines = [json.dumps({"message": {"content": p}, "done": False}).encode() for p in pieces]
+        lines.append(json.dumps({"done": True}).encode())
+        with patch("requests.Session.post", return_value=_stream_response(lines)):
+            provider = OllamaProvider("http://localhost:11434", "m", stream=True)
+            content, meta = provider.chat([])
+
+        assert meta["stopped_early"] is True
+        assert json.loads(extract_json_from_markdown(content)) == {"edits": [{"id": 1, "rating": 4}]}
+
+    def test_ollama_uses_eval_stats_when_done(self):
+        lines = [
+            json.dumps({"message": {"content": "ok"}, "done": False}).encode(),
+            json.dumps({"done": True, "eval_count": 30, "eval_duration": 2_000_000_000}).encode(),
+        ]
+        with patch("requests.Session.post", return_value=_stream_response(lines)):
+            provider = OllamaProvider("http://localhost:11434", "m", stream=True)
+            content, meta = provider.chat([])
+
+        assert content == "ok"
+        assert meta["tokens_per_sec"] == 15.0
+        assert meta["stopped_early"] is False
+
+    def test_openai_sse_stream(self):
+        def event(text, finish=None):
+            chunk = {"choices": [{"delta": {"content": text}, "finish_reason": finish}]}
+            return b"data: " + json.dumps(chunk).encode()
+
+        lines = [b": keep-alive", event('{"edits": '), b"", event("[]}"), event(" extra"), b"data: [DONE]"]
+        resp = _stream_response(lines)
+        with patch("requests.Session.post", return_value=resp):
+            provider = OpenAICompatProvider("http://localhost:1234", "m", stream=True)
+            content, meta = provider.chat([])
+
+        assert json.loads(content) == {"edits": []}
+        assert meta["stopped_early"] is True
+        assert meta["provider"] == "openai-compat"
+
+    def test_non_stream_unchanged(self):
+        resp = MagicMock()
+        resp.status_code = 200
+        resp.json.return_value = {"message": {"content": "{}"}, "eval_count": 1}
+        with patch("requests.Session.post", return_value=resp) as post:
+            content, meta = OllamaProvider("http://localhost:11434", "m").chat([])
+
+        assert content == "{}"
+        assert post.call_args.kwargs["stream"] is False
+        assert "streamed" not in meta
+
+
+class _FakeOllamaHandler(BaseHTTPRequestHandler):
+    """
+    Simula /api/chat com latência fixa e conta as requisições simultâneas.
+    Com ``gate`` > 0, as primeiras requisições esperam (até 2 s) que ``gate``
+    estejam em andamento, então o pico observado não depende do relógio.
+    """
+
+    delay = 0.01
+    cond = threading.Condition()
+    inflight = 0
+    peak = 0
+    gate = 0
+
+    @classmethod
+    def reset(cls, gate=0):
+        with cls.cond:
+            cls.inflight = cls.peak = 0
+            cls.gate = gate
+
+    def do_POST(self):
+        cls = type(self)
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with cls.cond:
+            cls.inflight += 1
+            cls.peak = max(cls.peak, cls.inflight)
+            cls.cond.notify_all()
+            cls.cond.wait_for(lambda: cls.peak >= cls.gate, timeout=2)
+        try:
+            time.sleep(self.delay)
+        finally:
+            with cls.cond:
+                cls.inflight -= 1
+        out = json.dumps({
+            "message": {"content": body["messages"][-1]["content"]},
+            "eval_count": 1,
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fake_ollama():
+    _FakeOllamaHandler.reset()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _FakeOllamaHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+class TestConcurrentFanOut:
+    """Tests for achat/achat_many against a fake local server."""
+
+    def test_results_keep_request_order(self, fake_ollama):
+        provider = OllamaProvider(fake_ollama, "m")
+        message_lists = [[{"role": "user", "content": str(i)}] for i in range(6)]
+        results = chat_many(provider, message_lists, max_concurrency=3)
+        provider.close()
+
+        assert [answer for answer, _ in results] == [str(i) for i in range(6)]
+
+    def test_inflight_requests_match_concurrency(self, fake_ollama):
+        provider = OllamaProvider(fake_ollama, "m")
+        message_lists = [[{"role": "user", "content": str(i)}] for i in range(8)]
+        peaks = {}
+        for concurrency in (1, 2, 4, 8):
+            _FakeOllamaHandler.reset(gate=concurrency)
+            chat_many(provider, message_lists, max_concurrency=concurrency)
+            peaks[concurrency] = _FakeOllamaHandler.peak
+        provider.close()
+
+        assert peaks == {1: 1, 2: 2, 4: 4, 8: 8}
+
+    def test_sync_only_provider_is_supported(self):
+        import asyncio
+
+        provider = MagicMock()
+        provider.chat.side_effect = lambda messages: (messages[0]["content"], {})
+        results = asyncio.run(achat_many(provider, [[{"content": "a"}], [{"content": "b"}]], 2))
+
+        assert [answer for answer, _ in results] == ["a", "b"]
+
+    def test_message_builders_run_only_when_slot_opens(self):
+        import threading
+
+        live = []
+        peak = []
+        lock = threading.Lock()
+
+        def builder(i):
+            def build():
+                with lock:
+                    live.append(i)
+                    peak.append(len(live))
+                return [{"content": str(i)}]
+            return build
+
+        def chat(messages):
+            time.sleep(0.01)
+            with lock:
+                live.remove(int(messages[0]["content"]))
+            return messages[0]["content"], {}
+
+        provider = MagicMock()
+        provider.chat.side_effect = chat
+        results = chat_many(provider, [builder(i) for i in range(6)], max_concurrency=2)
+
+        assert [answer for answer, _ in results] == [str(i) for i in range(6)]
+        assert max(peak) <= 2
@@ -0,0 +1,122 @@
+"""
+Tests for mcp_daemon.py module.
+Runs the daemon socket server against a stub stdio MCP server.
+"""
+import os
+import socket
+import stat
+import sys
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "host"))
+
+import pytest
+
+from common import McpClient, ensure_private_dir, find_running_daemon
+from mcp_daemon import CLIENT_INFO, PROTOCOL_VERSION, SHUTDOWN_METHOD, McpDaemonServer, serve
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="requer socket Unix")
+
+STUB_SERVER = """
+import json
+import sys
+
+for line in sys.stdin:
+    data = json.loads(line)
+    if data.get("method") == "fail":
+        payload = {"jsonrpc": "2.0", "id": data["id"], "error": {"code": -1, "message": "falhou"}}
+    else:
+        payload = {"jsonrpc": "2.0", "id": data["id"], "result": {"method": data["method"], "params": data["params"]}}
+    sys.stdout.write(json.dumps(payload) + "\\n")
+    sys.stdout.flush()
+"""
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    stub = tmp_path / "stub_server.py"
+    stub.write_text(STUB_SERVER)
+    # Caminho curto: sockets Unix têm limite de ~108 bytes
+    socket_path = Path(tmp_path) / "d.sock"
+
+    upstream = McpClient([sys.executable, "-u", str(stub)], PROTOCOL_VERSION, CLIENT_INFO)
+    upstream.start()
+    server = McpDaemonServer(socket_path, upstream, {"serverInfo": {"name": "stub"}})
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield socket_path
+    server.shutdown()
+    server.server_close()
+    upstream.close()
+
+
+def _client(socket_path):
+    return McpClient([], PROTOCOL_VERSION, {"name": "test"}, socket_path=str(socket_path), response_timeout=5)
+
+
+class TestMcpDaemon:
+    """Tests for McpDaemonServer."""
+
+    def test_initialize_is_cached(self, daemon):
+        with _client(daemon) as client:
+            assert client.initialize() == {"serverInfo": {"name": "stub"}}
+
+    def test_tool_calls_are_forwarded(self, daemon):
+        with _client(daemon) as client:
+            result = client.call_tool("list_collection", {"limit": 3})
+
+        assert result["method"] == "tools/call"
+        assert result["params"] == {"name": "list_collection", "arguments": {"limit": 3}}
+
+    def test_errors_are_forwarded(self, daemon):
+        with _client(daemon) as client:
+            with pytest.raises(RuntimeError, match="falhou"):
+                client.request("fail")
+
+    def test_concurrent_clients_keep_their_ids(self, daemon):
+        with _client(daemon) as first, _client(daemon) as second:
+            futures = [
+                (i, (first if i % 2 else second).call_tool_async("echo", {"i": i})) for i in range(10)
+            ]
+            for i, future in futures:
+                assert future.result(timeout=5)["params"]["arguments"] == {"i": i}
+
+    def test_find_running_daemon(self, daemon, tmp_path):
+        assert find_running_daemon(daemon) == str(daemon)
+        assert find_running_daemon(tmp_path / "missing.sock") is None
+
+    def test_socket_is_private_from_bind(self, daemon):
+        assert stat.S_IMODE(os.lstat(daemon).st_mode) == 0o600
+
+    def test_ignores_non_socket_paths(self, daemon, tmp_path):
+        regular = tmp_path / "fake.sock"
+        regular.write_text("")
+        link = tmp_path / "link.sock"
+        link.symlink_to(daemon)
+
+        assert find_running_daemon(regular) is None
+        assert find_running_daemon(link) is None
+
+    def test_private_dir_rejects_open_permissions(self, tmp_path):
+        assert stat.S_IMODE(os.stat(ensure_private_dir(tmp_path / "run")).st_mode) == 0o700
+        shared = tmp_path / "shared"
+        shared.mkdir(mode=0o777)
+        shared.chmod(0o777)
+        with pytest.raises(RuntimeError):
+            ensure_private_dir(shared)
+
+    def test_serve_keeps_non_socket_files(self, tmp_path):
+        target = tmp_path / "notes.txt"
+        target.write_text("importante")
+
+        assert serve(target) == 1
+        assert target.read_text() == "importante"
+
+    def test_serve_keeps_live_socket(self, daemon):
+        assert serve(daemon) == 1
+        assert find_running_daemon(daemon) == str(daemon)
+
+    def test_shutdown_method(self, daemon):
+        with _client(daemon) as client:
+            assert client.request(SHUTDOWN_METHOD) == {"ok": True}
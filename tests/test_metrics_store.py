@@ -0,0 +1,111 @@
+"""
+Tests for metrics_store.py (append-only JSONL metrics).
+"""
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "host"))
+
+from metrics_store import MetricsWriter, read_metrics, summarize_metrics, TIMESTAMP_FORMAT
+
+
+def _entry(mode, success, duration, ts=None):
+    return {
+        "timestamp": ts or time.strftime(TIMESTAMP_FORMAT),
+        "mode": mode,
+        "success": success,
+        "duration": duration,
+    }
+
+
+class TestMetricsWriter:
+    def test_buffers_until_flush(self, tmp_path):
+        path = tmp_path / "metrics.jsonl"
+        writer = MetricsWriter(path, flush_every=3, flush_seconds=3600)
+        writer.record(_entry("rating", True, 1.0))
+        writer.record(_entry("rating", False, 2.0))
+        assert not path.exists()
+
+        writer.record(_entry("tagging", True, 3.0))
+        assert [e["mode"] for e in read_metrics(path)] == ["rating", "rating", "tagging"]
+
+    def test_appends_across_writers(self, tmp_path):
+        path = tmp_path / "metrics.jsonl"
+        a = MetricsWriter(path, flush_every=100, flush_seconds=3600)
+        b = MetricsWriter(path, flush_every=100, flush_seconds=3600)
+        a.record(_entry("rating", True, 1.0))
+        b.record(_entry("tagging", True, 1.0))
+        a.flush()
+        b.flush()
+        assert len(list(read_metrics(path))) == 2
+
+    def test_compaction_drops_expired_entries(self, tmp_path):
+        path = tmp_path / "metrics.jsonl"
+        writer = MetricsWriter(path, flush_every=100, flush_seconds=3600, compact_bytes=0, retention_days=1)
+        old = time.strftime(TIMESTAMP_FORMAT, time.localtime(time.time() - 3 * 86400))
+        writer.record(_entry("rating", True, 1.0, ts=old))
+        writer.record(_entry("rating", True, 2.0))
+        writer.flush()
+        assert [e["duration"] for e in read_metrics(path)] == [2.0]
+
+    def test_compaction_runs_on_growth_not_on_every_flush(self, tmp_path, monkeypatch):
+        path = tmp_path / "metrics.jsonl"
+        writer = MetricsWriter(path, flush_every=1, flush_seconds=3600, compact_bytes=300)
+        compactions = []
+        real_compact = writer._compact
+        monkeypatch.setattr(writer, "_compact", lambda: (compactions.append(1), real_compact()))
+
+        for i in range(12):
+            writer.record(_entry("rating", True, float(i)))
+
+        # ~100 bytes por linha: uma compactação a cada ~3 linhas novas, não a cada flush
+        assert 2 <= len(compactions) <= 4
+        assert len(list(read_metrics(path))) == 12
+
+    def test_compaction_when_oldest_entry_expires(self, tmp_path):
+        path = tmp_path / "metrics.jsonl"
+        old = time.strftime(TIMESTAMP_FORMAT, time.localtime(time.time() - 5 * 86400))
+        path.write_text(json.dumps(_entry("rating", True, 1.0, ts=old)) + "\n", encoding="utf-8")
+        writer = MetricsWriter(path, flush_every=1, compact_bytes=1 << 20, retention_days=2)
+        writer.record(_entry("rating", True, 2.0))
+
+        assert [e["duration"] for e in read_metrics(path)] == [2.0]
+
+    def test_migrates_legacy_json_array(self, tmp_path):
+        legacy = tmp_path / "metrics.json"
+        legacy.write_text(json.dumps([_entry("export", True, 5.0)]), encoding="utf-8")
+        path = tmp_path / "metrics.jsonl"
+        writer = MetricsWriter(path, flush_every=1)
+        writer.record(_entry("export", False, 1.0))
+
+        assert [e["success"] for e in read_metrics(path)] == [True, False]
+        assert not legacy.exists()
+
+    def test_ignores_corrupted_lines(self, tmp_path):
+        path = tmp_path / "metrics.jsonl"
+        path.write_text(json.dumps(_entry("rating", True, 1.0)) + "\n{trunc\n", encoding="utf-8")
+        assert len(list(read_metrics(path))) == 1
+
+
+class TestSummarizeMetrics:
+    def test_success_rate_and_percentiles(self):
+        entries = [_entry("rating", i % 4 != 0, float(i)) for i in range(1, 101)]
+        entries.append(_entry("tagging", False, 2.0))
+        summary = summarize_metrics(entries)
+
+        assert summary["rating"]["count"] == 100
+        assert summary["rating"]["success_rate"] == 0.75
+        assert summary["rating"]["p50"] == 50.5
+        assert summary["rating"]["p99"] == 99.01
+        assert summary["tagging"] == {
+            "count": 1, "success_rate": 0.0, "p50": 2.0, "p90": 2.0, "p99": 2.0,
+        }
+
+    def test_since_filters_old_entries(self):
+        old = time.strftime(TIMESTAMP_FORMAT, time.localtime(time.time() - 7 * 86400))
+        entries = [_entry("rating", True, 1.0, ts=old), _entry("rating", False, 3.0)]
+        summary = summarize_metrics(entries, since=time.time() - 86400)
+        assert summary["rating"]["count"] == 1
+        assert summary["rating"]["success_rate"] == 0.0
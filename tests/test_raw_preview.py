@@ -0,0 +1,153 @@
+"""
+Tests for raw_preview.py module.
+Builds minimal TIFF/RAF containers with embedded JPEGs to exercise the parser.
+"""
+import io
+import struct
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "host"))
+
+import pytest
+from PIL import Image
+
+from raw_preview import extract_raw_preview, is_raw_file
+from common import encode_image_bytes
+
+
+def _jpeg_bytes(size, color=(120, 80, 40), orientation=None):
+    buffer = io.BytesIO()
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    Image.new("RGB", size, color=color).save(buffer, "JPEG", exif=exif)
+    return buffer.getvalue()
+
+
+def build_raf(path, preview):
+    header = b"FUJIFILMCCD-RAW 0201FF383501".ljust(84, b"\0")
+    header += struct.pack(">II", 100, len(preview))
+    path.write_bytes(header.ljust(100, b"\0") + preview + b"\0" * 64)
+    return path
+
+
+def _ifd(entries, next_ifd=0):
+    """entries: list of (tag, type, count, value) with inline 4-byte values."""
+    out = struct.pack("<H", len(entries))
+    for tag, typ, count, value in sorted(entries):
+        if typ == 3:
+            out += struct.pack("<HHIHH", tag, typ, count, value, 0)
+        else:
+            out += struct.pack("<HHII", tag, typ, count, value)
+    return out + struct.pack("<I", next_ifd)
+
+
+def build_tiff_raw(path, thumb, preview, orientation=1):
+    """IFD0 com thumbnail (JPEGInterchangeFormat) + SubIFD com preview em strip."""
+    ifd0_offset = 8
+    ifd0_size = 2 + 4 * 12 + 4
+    sub_offset = ifd0_offset + ifd0_size
+    sub_size = 2 + 3 * 12 + 4
+    thumb_offset = sub_offset + sub_size
+    preview_offset = thumb_offset + len(thumb)
+
+    ifd0 = _ifd([
+        (0x0112, 3, 1, orientation),
+        (0x014A, 4, 1, sub_offset),
+        (0x0201, 4, 1, thumb_offset),
+        (0x0202, 4, 1, len(thumb)),
+    ])
+    sub = _ifd([
+        (0x0103, 3, 1, 6),
+        (0x0111, 4, 1, preview_offset),
+        (0x0117, 4, 1, len(preview)),
+    ])
+    path.write_bytes(b"II" + struct.pack("<HI", 42, ifd0_offset) + ifd0 + sub + thumb + preview)
+    return path
+
+
+class TestRawPreviewExtraction:
+    """Tests for extract_raw_preview."""
+
+    def test_is_raw_file(self):
+        assert is_raw_file(Path("IMG_0001.CR2"))
+        assert is_raw_file(Path("DSC_0001.nef"))
+        assert not is_raw_file(Path("photo.jpg"))
+
+    def test_picks_smallest_preview_covering_max_dimension(self, tmp_path):
+        thumb = _jpeg_bytes((160, 120))
+        preview = _jpeg_bytes((2000, 1500))
+        raw = build_tiff_raw(tmp_path / "IMG_0001.CR2", thumb, preview)
+
+        big = extract_raw_preview(raw, max_dimension=1600)
+        assert (big.width, big.height) == (2000, 1500)
+        assert big.data == preview
+
+        small = extract_raw_preview(raw, max_dimension=100)
+        assert (small.width, small.height) == (160, 120)
+
+    def test_reads_orientation_from_ifd0(self, tmp_path):
+        raw = build_tiff_raw(
+            tmp_path / "DSC_0001.NEF", _jpeg_bytes((160, 120)), _jpeg_bytes((800, 600)), orientation=6
+        )
+        assert extract_raw_preview(raw).orientation == 6
+
+    def test_raf_header_offset(self, tmp_path):
+        preview = _jpeg_bytes((1920, 1280))
+        raf = build_raf(tmp_path / "DSCF0001.RAF", preview)
+
+        result = extract_raw_preview(raf)
+        assert result.data == preview
+        assert (result.width, result.height) == (1920, 1280)
+
+    def test_lossless_jpeg_is_ignored(self, tmp_path):
+        # SOF3 (lossless) não é decodificável pelo Pillow
+        lossless = b"\xff\xd8\xff\xc3\x00\x0b\x08\x00\x10\x00\x10\x01\x01\x11\x00" + b"\0" * 16
+        raw = build_tiff_raw(tmp_path / "IMG.DNG", lossless, lossless)
+        assert extract_raw_preview(raw) is None
+
+    def test_not_a_tiff(self, tmp_path):
+        bogus = tmp_path / "bogus.arw"
+        bogus.write_bytes(b"not a raw file at all")
+        assert extract_raw_preview(bogus) is None
+
+
+class TestRawEncoding:
+    """Tests for RAW handling in encode_image_bytes."""
+
+    def test_encode_uses_preview_and_orientation(self, tmp_path):
+        raw = build_tiff_raw(
+            tmp_path / "IMG_0002.CR2", _jpeg_bytes((160, 120)), _jpeg_bytes((2000, 1500)), orientation=6
+        )
+        data, mime = encode_image_bytes(raw, max_dimension=1000, use_cache=False)
+
+        assert mime == "image/jpeg"
+        with Image.open(io.BytesIO(data)) as out:
+            # 2000x1500 reduzido para 1000x750 e rotacionado 90°
+            assert out.size == (750, 1000)
+
+    def test_encode_applies_raf_exif_orientation(self, tmp_path):
+        raf = build_raf(tmp_path / "DSCF0002.RAF", _jpeg_bytes((800, 600), orientation=6))
+        data, _ = encode_image_bytes(raf, max_dimension=1000, use_cache=False)
+
+        with Image.open(io.BytesIO(data)) as out:
+            assert out.size == (600, 800)
+
+    def test_cache_hit_skips_preview_extraction(self, tmp_path):
+        from unittest.mock import patch
+        from common import ThumbnailCache
+
+        raw = build_tiff_raw(tmp_path / "IMG_0004.CR2", _jpeg_bytes((160, 120)), _jpeg_bytes((800, 600)))
+        cache = ThumbnailCache(tmp_path / "cache")
+        first, _ = encode_image_bytes(raw, cache=cache)
+
+        with patch("common.extract_raw_preview") as extract:
+            assert encode_image_bytes(raw, cache=cache)[0] == first
+        extract.assert_not_called()
+
+    def test_encode_raw_without_preview_raises(self, tmp_path):
+        bogus = tmp_path / "IMG_0003.CR2"
+        bogus.write_bytes(b"II*\0" + b"\0" * 64)
+        with pytest.raises(OSError):
+            encode_image_bytes(bogus, use_cache=False)